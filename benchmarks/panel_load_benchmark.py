@@ -0,0 +1,177 @@
+"""Load test of the panel-facing code paths against simulated 3x-ui panels.
+
+Starts several local panels (tests/panel_simulator.py, alternating the new
+and the legacy API), writes a scratch config.yml pointing at them and drives
+the bot's real code: the traffic snapshot (cold, warm, after every session
+expired, after counter resets), a burst of concurrent user queries, with
+and without injected errors, and a bulk reset of 1,000 clients, by whole
+inbounds and client by client.  Reports the duration or per-query latency of
+each scenario and how many panel requests of each kind it made.
+
+    python benchmarks/panel_load_benchmark.py --panels 5 --inbounds 20 --clients 250 --latency 0.05
+"""
+import argparse
+import asyncio
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import date
+
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tests"))
+
+from panel_simulator import PanelSimulator  # noqa: E402
+
+
+def _calls(panels):
+    total = Counter()
+    for panel in panels:
+        total.update(panel.calls)
+    return total
+
+
+def _format_calls(calls: Counter) -> str:
+    return ", ".join(f"{name}={count}" for name, count in sorted(calls.items())) or "-"
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+async def scenarios(main, database, panels, args):
+    import query_logic
+    from xui_api import close_all_panel_apis
+
+    today = date.today().strftime("%Y-%m-%d")
+    results = []
+
+    async def measure(name, coro_fn):
+        before = _calls(panels)
+        started = time.perf_counter()
+        detail = await coro_fn()
+        elapsed = time.perf_counter() - started
+        results.append((name, elapsed, _calls(panels) - before, detail))
+
+    async def snapshot():
+        outcome, records = await main._collect_snapshots(today)
+        ok = sum(1 for r in outcome if r["ok"])
+        return f"{len(records)} rows, {ok}/{len(outcome)} panels ok"
+
+    async def snapshot_and_store():
+        outcome, records = await main._collect_snapshots(today)
+        started = time.perf_counter()
+        database.batch_record_traffic(records)
+        return f"{len(records)} rows, stored in {(time.perf_counter() - started) * 1e3:.0f} ms"
+
+    emails = [(f"panel-{i}", email) for i, panel in enumerate(panels) for email in panel.emails]
+    step = max(1, len(emails) // args.queries)
+    picks = (emails[::step] * args.queries)[:args.queries]
+
+    async def queries():
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies, failures = [], 0
+
+        async def one(panel_name, email):
+            nonlocal failures
+            async with semaphore:
+                started = time.perf_counter()
+                ok, _ = await query_logic.query_user_data(panel_name, email)
+                latencies.append(time.perf_counter() - started)
+                failures += not ok
+
+        await asyncio.gather(*(one(p, e) for p, e in picks))
+        return (f"{len(picks)} queries, p50 {statistics.median(latencies) * 1e3:.1f} ms, "
+                f"p95 {_percentile(latencies, 0.95) * 1e3:.1f} ms, {failures} failed")
+
+    await measure("snapshot (cold: login + API detection)", snapshot)
+    await measure("snapshot (warm)", snapshot)
+    for panel in panels:
+        panel.expire_sessions()
+    await measure("snapshot (all sessions expired)", snapshot)
+    await measure("snapshot + store (first day)", snapshot_and_store)
+    for panel in panels:
+        panel.add_traffic(up=10 * 1024 ** 2, down=30 * 1024 ** 2)
+    panels[0].reset_counters()
+    await measure("snapshot + store (panel-0 counters reset)", snapshot_and_store)
+    await measure("queries (cold cache)", queries)
+    await measure("queries (warm cache)", queries)
+    for panel in panels:
+        panel.error_rate = args.error_rate
+    await close_all_panel_apis()
+    await measure(f"queries ({args.error_rate:.0%} panel errors, new sessions)", queries)
+    await close_all_panel_apis()
+    for panel in panels:
+        panel.error_rate = 0
+
+    def bulk_reset(emails):
+        async def run():
+            ok, outcome = await query_logic.reset_panel_clients("panel-0", emails)
+            if not ok:
+                return outcome
+            return f"{sum(outcome.values())}/{len(outcome)} clients reset"
+        return run
+
+    # Whole inbounds are reset with one call each; leaving one client of every
+    # inbound out forces the client-by-client path.
+    await measure(f"bulk reset ({args.reset_clients} clients on panel-0)",
+                  bulk_reset(panels[0].emails[:args.reset_clients]))
+    spread = [email for i, email in enumerate(panels[0].emails) if i % args.clients][:args.reset_clients]
+    await measure(f"bulk reset ({len(spread)} clients, one per inbound kept)", bulk_reset(spread))
+    await close_all_panel_apis()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--panels", type=int, default=5)
+    parser.add_argument("--inbounds", type=int, default=20, help="inbounds per panel")
+    parser.add_argument("--clients", type=int, default=250, help="clients per inbound")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every panel request")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--reset-clients", type=int, default=1000)
+    args = parser.parse_args()
+
+    panels = [
+        PanelSimulator(style="legacy" if i % 2 else "api", inbounds=args.inbounds,
+                       clients_per_inbound=args.clients, latency=args.latency, seed=i).start()
+        for i in range(args.panels)
+    ]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with open(os.path.join(temp_dir, "config.yml"), "w", encoding="utf-8") as f:
+            yaml.dump({
+                "bot_token": "YOUR_TELEGRAM_BOT_TOKEN",
+                "users": {"admin_users": [1], "normal_users": []},
+                "panels": {f"panel-{i}": p.panel_config for i, p in enumerate(panels)},
+                "query": {"cache_ttl": 30},
+            }, f)
+        # config.py and database.py resolve their files at import time.
+        os.chdir(temp_dir)
+        os.environ["DB_DIR"] = temp_dir
+        import database
+        import main as bot
+
+        results = asyncio.run(scenarios(bot, database, panels, args))
+        database.close_db()
+        os.chdir(ROOT)
+    for panel in panels:
+        panel.stop()
+
+    clients = args.inbounds * args.clients
+    print(f"{args.panels} panels x {clients} clients, {args.latency * 1e3:.0f} ms panel latency")
+    for name, elapsed, calls, detail in results:
+        print(f"{name:48} {elapsed:7.2f}s  {detail}")
+        print(f"{'':48} panel requests: {_format_calls(calls)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""Latency and memory benchmark of the traffic statistics queries.
+
+Fills a fresh database with synthetic daily snapshots (panels x clients x
+days, with every client's counters reset once a month on its own reset day)
+through database.batch_record_traffic(), then times each stats function and
+each /api/admin/stats endpoint.  Reports p50/p95 latency, the peak Python
+allocation of one call and the peak RSS of the process.  The database and
+config.yml live in a scratch directory, so it runs from any directory.
+
+    python benchmarks/stats_benchmark.py                   # compare with the baseline
+    python benchmarks/stats_benchmark.py --save-baseline   # record a new baseline
+
+With a baseline for the same data size, exits with status 1 when any p95,
+peak allocation or the peak RSS regressed past the tolerance.  Timings only
+compare across runs on the same machine; re-record the baseline when moving
+to another one.
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# database.py reads DB_DIR at import; point it at a scratch directory first.
+_TEMP_DIR = tempfile.TemporaryDirectory()
+os.environ["DB_DIR"] = _TEMP_DIR.name
+
+import database  # noqa: E402
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stats_baseline.json")
+GB = 1024 ** 3
+
+
+def generate(panels: int, clients: int, days: int) -> date:
+    """Write ``days`` daily snapshots for every client, ending today; returns the first day."""
+    first = date.today() - timedelta(days=days - 1)
+    # Per-client daily usage and reset day, fixed so runs are reproducible.
+    rates = [((c * 7919) % 200 + 1) * 1024 ** 2 for c in range(clients)]
+    used = [0] * clients
+    for n in range(days):
+        day = first + timedelta(days=n)
+        records = []
+        for c in range(clients):
+            if day.day == c % 28 + 1:
+                used[c] = 0  # Monthly counter reset on the panel.
+            used[c] += rates[c]
+            records.append((f"panel-{c % panels}", f"user-{c:06d}@example.com",
+                            used[c] // 4, used[c] - used[c] // 4, 100 * GB, 0,
+                            day.strftime("%Y-%m-%d")))
+        database.batch_record_traffic(records)
+    return first
+
+
+def cases(first: date, last: date):
+    """(name, callable) for every measured operation."""
+    # config.py reads config.yml from the working directory at import, and
+    # exits after writing a default one when there is none.
+    with open(os.path.join(_TEMP_DIR.name, "config.yml"), "w", encoding="utf-8") as f:
+        yaml.dump({
+            "bot_token": "YOUR_TELEGRAM_BOT_TOKEN",
+            "users": {"admin_users": [1], "normal_users": []},
+            "panels": {},
+        }, f)
+    os.chdir(_TEMP_DIR.name)
+    import webapp
+
+    webapp.app.config.update(TESTING=True, SECRET_KEY="benchmark")
+    client = webapp.app.test_client()
+    with client.session_transaction() as session:
+        session["is_admin"] = True
+
+    def endpoint(path):
+        def call():
+            response = client.get(path)
+            assert response.status_code == 200, (path, response.status_code)
+        return call
+
+    end = last.strftime("%Y-%m-%d")
+    month = (last - timedelta(days=29)).strftime("%Y-%m-%d")
+    week = (last - timedelta(days=6)).strftime("%Y-%m-%d")
+    return [
+        ("get_daily_stats (30d)", lambda: database.get_daily_stats(month, end)),
+        ("get_daily_stats (30d, panel)", lambda: database.get_daily_stats(month, end, "panel-0")),
+        ("get_panel_daily_stats (30d)", lambda: database.get_panel_daily_stats(month, end)),
+        ("get_user_daily_stats (7d)",
+         lambda: database.get_user_daily_stats(week, end, "panel-0", limit=500)),
+        ("get_top_users (30d)", lambda: database.get_top_users(month, end)),
+        ("get_top_users (all days)",
+         lambda: database.get_top_users(first.strftime("%Y-%m-%d"), end)),
+        ("get_latest_snapshot", database.get_latest_snapshot),
+        ("get_latest_snapshot (panel)", lambda: database.get_latest_snapshot("panel-0")),
+        ("GET /api/admin/stats/overview", endpoint("/api/admin/stats/overview")),
+        ("GET /api/admin/stats/week", endpoint(f"/api/admin/stats/week?date={end}")),
+        ("GET /api/admin/stats/month", endpoint(f"/api/admin/stats/month?date={end}")),
+        ("GET /api/admin/stats/panel/<name>", endpoint("/api/admin/stats/panel/panel-0")),
+    ]
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def measure(fn, repeat: int):
+    fn()  # Warm the page cache and statement cache.
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "p50_ms": round(statistics.median(samples) * 1e3, 3),
+        "p95_ms": round(_percentile(samples, 0.95) * 1e3, 3),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux.
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def rss_regression(now_mb: float, baseline, tolerance: float, min_mb: float):
+    """Description of a peak RSS regression, or None."""
+    before = baseline.get("peak_rss_mb")
+    if before and now_mb > before * (1 + tolerance) and now_mb - before > min_mb:
+        return f"{before:.1f} -> {now_mb:.1f} MB"
+    return None
+
+
+def regressions(results, baseline, tolerance: float, min_ms: float):
+    """{name: description} of the measurements worse than the baseline allows."""
+    found = {}
+    for name, now in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        problems = []
+        if (now["p95_ms"] > before["p95_ms"] * (1 + tolerance)
+                and now["p95_ms"] - before["p95_ms"] > min_ms):
+            problems.append(f"p95 {before['p95_ms']:.2f} -> {now['p95_ms']:.2f} ms")
+        if now["peak_kb"] > before["peak_kb"] * (1 + tolerance) and now["peak_kb"] - before["peak_kb"] > 64:
+            problems.append(f"peak {before['peak_kb']:.0f} -> {now['peak_kb']:.0f} KB")
+        if problems:
+            found[name] = ", ".join(problems)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--panels", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed relative regression (default 0.5 = 50%%)")
+    parser.add_argument("--min-ms", type=float, default=2.0,
+                        help="ignore p95 regressions smaller than this many ms")
+    parser.add_argument("--min-rss-mb", type=float, default=16.0,
+                        help="ignore peak RSS regressions smaller than this many MB")
+    args = parser.parse_args()
+    # cases() changes into the scratch directory.
+    args.baseline = os.path.abspath(args.baseline)
+    params = {"panels": args.panels, "clients": args.clients, "days": args.days}
+
+    database.init_db()
+    started = time.perf_counter()
+    first = generate(args.panels, args.clients, args.days)
+    print(f"{args.panels} panels x {args.clients} clients x {args.days} days "
+          f"generated in {time.perf_counter() - started:.1f}s")
+
+    results = {}
+    operations = dict(cases(first, date.today()))
+    print(f"{'':36} {'p50 ms':>9} {'p95 ms':>9} {'peak KB':>9}")
+    for name, fn in operations.items():
+        results[name] = measure(fn, args.repeat)
+        r = results[name]
+        print(f"{name:36} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} {r['peak_kb']:9.0f}")
+    peak_rss_mb = _peak_rss_mb()
+    print(f"peak RSS: {peak_rss_mb:.1f} MB")
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    found = {}
+    if baseline and baseline["params"] == params:
+        found = regressions(results, baseline["results"], args.tolerance, args.min_ms)
+        # Re-measure suspects once so a single scheduler hiccup does not fail the run.
+        retry = {name: measure(operations[name], args.repeat) for name in found}
+        found = regressions(retry, baseline["results"], args.tolerance, args.min_ms)
+        rss = rss_regression(peak_rss_mb, baseline, args.tolerance, args.min_rss_mb)
+        if rss:
+            found["peak RSS"] = rss
+    database.close_db()
+    os.chdir(ROOT)
+    _TEMP_DIR.cleanup()
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"params": params, "peak_rss_mb": peak_rss_mb, "results": results}, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if baseline is None:
+        print("No baseline recorded; run with --save-baseline first.")
+        return 0
+    if baseline["params"] != params:
+        print(f"Baseline was recorded for {baseline['params']}; not comparing.")
+        return 0
+    for name, problem in found.items():
+        print(f"REGRESSION {name}: {problem}")
+    if not found:
+        print("No regressions against the baseline.")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
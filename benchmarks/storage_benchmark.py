@@ -0,0 +1,149 @@
+"""Compare the legacy text-keyed traffic_records layout with the normalized one.
+
+Builds a legacy database (with the original three secondary indexes), measures
+its size and a few representative queries, migrates it with database.init_db()
+(plus the VACUUM the bot runs afterwards) and measures again.
+
+    python benchmarks/storage_benchmark.py --clients 30000 --days 365
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+LEGACY_SCHEMA = """
+    CREATE TABLE traffic_records (
+        id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        panel_name  TEXT    NOT NULL,
+        email       TEXT    NOT NULL,
+        record_date TEXT    NOT NULL,
+        upload      INTEGER DEFAULT 0,
+        download    INTEGER DEFAULT 0,
+        total_bytes INTEGER DEFAULT 0,
+        expiry_time INTEGER DEFAULT 0,
+        created_at  TEXT    DEFAULT (datetime('now','localtime')),
+        UNIQUE(panel_name, email, record_date)
+    );
+    CREATE INDEX idx_tr_date  ON traffic_records(record_date);
+    CREATE INDEX idx_tr_panel ON traffic_records(panel_name);
+    CREATE INDEX idx_tr_email ON traffic_records(email);
+"""
+
+# The queries the old database.py ran against traffic_records.
+LEGACY_QUERIES = {
+    "daily user deltas (7d)": ("""
+        SELECT a.record_date, a.email, (a.upload - b.upload) + (a.download - b.download)
+        FROM traffic_records a
+        LEFT JOIN traffic_records b
+          ON b.panel_name = a.panel_name AND b.email = a.email
+         AND b.record_date = date(a.record_date, '-1 day')
+        WHERE a.record_date BETWEEN ? AND ? AND a.panel_name = ?""", "week_panel"),
+    "latest snapshot": ("""
+        SELECT t.* FROM traffic_records t
+        JOIN (SELECT panel_name, email, MAX(record_date) AS d
+              FROM traffic_records GROUP BY panel_name, email) m
+          ON t.panel_name = m.panel_name AND t.email = m.email AND t.record_date = m.d""", None),
+    "end-of-day check": ("""
+        SELECT 1 FROM traffic_records
+        WHERE record_date = ? AND created_at >= ? LIMIT 1""", "eod"),
+    "panel summary for a day": ("""
+        SELECT * FROM traffic_records WHERE panel_name = ? AND record_date = ?
+        ORDER BY (upload + download) DESC""", "panel_day"),
+}
+
+
+def _size(path):
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+def _timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def build_legacy(path, clients, days, panels):
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    start = date.today() - timedelta(days=days - 1)
+    for d in range(days):
+        record_date = (start + timedelta(days=d)).strftime("%Y-%m-%d")
+        conn.executemany(
+            """INSERT INTO traffic_records
+                   (panel_name, email, record_date, upload, download, total_bytes, created_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            ((f"panel-{c % panels}", f"user-{c:06d}@example.com", record_date,
+              c * d * 1000, c * d * 3000, 100 * 1024 ** 3, f"{record_date} 23:50:00")
+             for c in range(clients)),
+        )
+    conn.commit()
+    conn.close()
+    return start, start + timedelta(days=days - 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=3000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--panels", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        database.DB_DIR = temp_dir
+        database.DB_PATH = os.path.join(temp_dir, "traffic.db")
+        first, last = build_legacy(database.DB_PATH, args.clients, args.days, args.panels)
+        last_s = last.strftime("%Y-%m-%d")
+        week_s = (last - timedelta(days=6)).strftime("%Y-%m-%d")
+        params = {
+            None: (),
+            "week_panel": (week_s, last_s, "panel-0"),
+            "eod": (last_s, f"{last_s} 23:00:00"),
+            "panel_day": ("panel-0", last_s),
+        }
+
+        before_size = _size(database.DB_PATH)
+        conn = sqlite3.connect(database.DB_PATH)
+        before = {name: _timed(lambda: conn.execute(sql, params[key]).fetchall(), args.repeat)
+                  for name, (sql, key) in LEGACY_QUERIES.items()}
+        conn.close()
+
+        started = time.perf_counter()
+        database.init_db()
+        database.run_pending_maintenance()
+        migration = time.perf_counter() - started
+        database._get_conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        after_size = _size(database.DB_PATH)
+        after = {
+            "daily user deltas (7d)": _timed(
+                lambda: database.get_user_daily_stats(week_s, last_s, "panel-0", limit=10 ** 9),
+                args.repeat),
+            "latest snapshot": _timed(database.get_latest_snapshot, args.repeat),
+            "end-of-day check": _timed(lambda: database.has_daily_traffic_snapshot(last_s),
+                                       args.repeat),
+            "panel summary for a day": _timed(
+                lambda: database.get_panel_summary_for_date("panel-0", last_s), args.repeat),
+        }
+        database.close_db()
+
+    rows = args.clients * args.days
+    print(f"{args.clients} clients x {args.days} days = {rows} snapshot rows "
+          f"({first} .. {last}), migration {migration:.1f}s")
+    print(f"{'':28} {'before':>12} {'after':>12}")
+    print(f"{'on-disk size (MB)':28} {before_size / 1e6:12.1f} {after_size / 1e6:12.1f}")
+    for name in LEGACY_QUERIES:
+        print(f"{name + ' (ms)':28} {before[name] * 1e3:12.2f} {after[name] * 1e3:12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,35 @@
 # config.py
-import yaml
+"""config.yml, loaded once per process and kept in memory.
+
+Accessors read the in-memory copy.  At most once a second they stat the file
+and reload it when its mtime, size or inode changed, so the bot and every web
+worker pick up each other's edits without re-parsing YAML on every lookup.
+Changes are made under an exclusive lock on a fresh copy of the file and
+written to a temp file that is renamed over config.yml, so readers never see
+a half-written file.
+"""
+import copy
+import logging
 import os
-from typing import Dict, Any, List
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, FrozenSet, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import yaml
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
 
 CONFIG_FILE = "config.yml"
+# Time zone of the daily jobs and of the dates traffic is recorded under.
+SCHEDULE_TIMEZONE = ZoneInfo("Asia/Hong_Kong")
 DEFAULT_CONFIG = {
     "bot_token": "YOUR_TELEGRAM_BOT_TOKEN",
     "users": {
@@ -12,67 +38,368 @@ DEFAULT_CONFIG = {
     },
     "panels": {}
 }
+# Seconds between checks of config.yml for changes made by other processes.
+RELOAD_CHECK_INTERVAL = 1.0
+
+config: Dict[str, Any] = {}
+_lock = threading.RLock()
+_stamp: Optional[Tuple[int, int, int]] = None
+_checked_at = 0.0
+_admin_ids: FrozenSet[int] = frozenset()
+_authorized_ids: FrozenSet[int] = frozenset()
+
+
+def _file_stamp() -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(CONFIG_FILE)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def _read_file() -> Dict[str, Any]:
+    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+        data = yaml.safe_load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"'{CONFIG_FILE}' does not contain a mapping")
+    return data
+
+
+def _install(data: Dict[str, Any], stamp: Optional[Tuple[int, int, int]]) -> None:
+    """Make ``data`` the in-memory config and rebuild the lookup sets."""
+    global config, _stamp, _admin_ids, _authorized_ids
+    users = data.get("users") or {}
+    admins = frozenset(users.get("admin_users") or [])
+    config = data
+    _stamp = stamp
+    _admin_ids = admins
+    _authorized_ids = admins | frozenset(users.get("normal_users") or [])
+
+
+def _reload(force: bool = False) -> None:
+    """Re-read config.yml if it changed on disk since it was last loaded."""
+    global _checked_at
+    with _lock:
+        _checked_at = time.monotonic()
+        stamp = _file_stamp()
+        if stamp is None or (stamp == _stamp and not force):
+            return
+        try:
+            data = _read_file()
+        except Exception as e:
+            # Keep serving the last good config rather than failing every lookup.
+            logger.error(f"Failed to reload '{CONFIG_FILE}', keeping the previous config: {e}")
+            return
+        _install(data, stamp)
+
+
+def _current() -> Dict[str, Any]:
+    if time.monotonic() - _checked_at >= RELOAD_CHECK_INTERVAL:
+        _reload()
+    return config
+
 
 def get_config() -> Dict[str, Any]:
-    """Loads the configuration from config.yml."""
+    """A copy of the current configuration, safe for the caller to modify."""
+    return copy.deepcopy(_current())
+
+
+def _write_file(config_data: Dict[str, Any]) -> None:
+    text = yaml.dump(config_data, allow_unicode=True, sort_keys=False)
+    directory = os.path.dirname(os.path.abspath(CONFIG_FILE))
+    fd, tmp_path = tempfile.mkstemp(prefix=".config-", suffix=".yml", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(CONFIG_FILE):
+            os.chmod(tmp_path, os.stat(CONFIG_FILE).st_mode & 0o777)
+        try:
+            os.replace(tmp_path, CONFIG_FILE)
+        except OSError:
+            # config.yml bind-mounted on its own (see docker-compose.yml) cannot
+            # be replaced by a rename; fall back to rewriting it in place.
+            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@contextmanager
+def _file_lock() -> Iterator[None]:
+    """Serialize read-modify-write cycles across threads and processes."""
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        with open(CONFIG_FILE + ".lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def save_config(config_data: Dict[str, Any]):
+    """Saves the configuration atomically and makes it the in-memory config."""
+    with _file_lock():
+        _write_file(config_data)
+        _install(config_data, _file_stamp())
+
+
+@contextmanager
+def edit_config() -> Iterator[Dict[str, Any]]:
+    """Yield the latest configuration for changes; it is saved when the block exits.
+
+    The file is re-read under the lock first, so edits made meanwhile by other
+    processes are never overwritten.
+    """
+    with _file_lock():
+        _reload()
+        data = copy.deepcopy(config)
+        yield data
+        if data != config:
+            _write_file(data)
+            _install(data, _file_stamp())
+
+
+def _load_initial() -> None:
     if not os.path.exists(CONFIG_FILE):
         save_config(DEFAULT_CONFIG)
         print(f"'{CONFIG_FILE}' not found. A default config file has been created.")
         print("Please edit it with your bot token and user IDs.")
         # Exiting because the token is mandatory
         exit()
-    
-    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-        return yaml.safe_load(f)
-
-def save_config(config_data: Dict[str, Any]):
-    """Saves the configuration and reloads it into memory."""
-    global config
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-        yaml.dump(config_data, f, allow_unicode=True, sort_keys=False)
-    config = config_data  # Update the in-memory config immediately
+    global _checked_at
+    _install(_read_file(), _file_stamp())
+    _checked_at = time.monotonic()
 
 
 # Load config at import time
-config = get_config()
+_load_initial()
 
 # --- Helper functions to access config values ---
 
 def get_bot_token() -> str:
-    return config.get("bot_token", "")
+    return _current().get("bot_token", "")
 
 def get_admin_users() -> List[int]:
-    return config.get("users", {}).get("admin_users", [])
+    return _current().get("users", {}).get("admin_users", [])
 
 def get_normal_users() -> List[int]:
-    return config.get("users", {}).get("normal_users", [])
+    return _current().get("users", {}).get("normal_users", [])
 
 def get_panel_config(name: str) -> Dict[str, str]:
     """Retrieves a specific panel's configuration by name."""
-    return config.get("panels", {}).get(name, {})
+    return _current().get("panels", {}).get(name, {})
 
 def get_all_panels() -> Dict[str, Any]:
     """Retrieves all configured panels."""
-    return config.get("panels", {})
+    return _current().get("panels", {})
+
+def get_panel_reset_day(name: str) -> Optional[int]:
+    """The panel's own monthly reset day, or None when it follows the global setting."""
+    reset_day = get_panel_config(name).get("reset_day")
+    return int(reset_day) if reset_day else None
+
+def add_or_update_panel(name: str, url: str, username: str, password: str,
+                        reset_day: Optional[int] = None) -> None:
+    """Adds a panel or updates its connection settings, keeping its other keys."""
+    with edit_config() as cfg:
+        panels = cfg.get("panels") or {}
+        panel = panels.get(name) or {}
+        panel.update({"url": url, "username": username, "password": password})
+        if reset_day is not None:
+            panel["reset_day"] = reset_day
+        panels[name] = panel
+        cfg["panels"] = panels
+
+def set_panel_disabled(name: str, disabled: bool) -> bool:
+    """Disables or re-enables a panel; False if there is no such panel."""
+    with edit_config() as cfg:
+        panel = (cfg.get("panels") or {}).get(name)
+        if panel is None:
+            return False
+        panel["disabled"] = disabled
+    return True
 
 def delete_panel(name: str) -> bool:
     """Deletes a panel configuration by name."""
-    current_config = get_config()
-    if "panels" in current_config and name in current_config["panels"]:
-        del current_config["panels"][name]
-        save_config(current_config)
-        return True
-    return False
+    if name not in get_all_panels():
+        return False
+    with edit_config() as cfg:
+        panels = cfg.get("panels") or {}
+        if name not in panels:
+            return False
+        del panels[name]
+    return True
+
+def add_normal_user(user_id: int) -> bool:
+    """Adds a normal user; False if the user is already authorized."""
+    if is_authorized(user_id):
+        return False
+    with edit_config() as cfg:
+        users = cfg.setdefault("users", {})
+        normal_users = users.get("normal_users") or []
+        if user_id in normal_users or user_id in (users.get("admin_users") or []):
+            return False
+        users["normal_users"] = normal_users + [user_id]
+    return True
+
+def del_normal_user(user_id: int) -> bool:
+    """Removes a normal user; False if there is no such user."""
+    if user_id not in get_normal_users():
+        return False
+    with edit_config() as cfg:
+        users = cfg.setdefault("users", {})
+        normal_users = users.get("normal_users") or []
+        if user_id not in normal_users:
+            return False
+        users["normal_users"] = [uid for uid in normal_users if uid != user_id]
+    return True
 
 def is_admin(user_id: int) -> bool:
     """Checks if a user is an admin."""
-    return user_id in get_admin_users()
+    _current()
+    return user_id in _admin_ids
 
 def is_authorized(user_id: int) -> bool:
     """Checks if a user is either an admin or a normal user."""
-    return is_admin(user_id) or user_id in get_normal_users()
+    _current()
+    return user_id in _authorized_ids
+
+def get_web_admin_password() -> str:
+    return str(_current().get("web", {}).get("admin_password", "") or "")
+
+def get_accounting_mode() -> str:
+    """'unidirectional' or 'bidirectional' (panel traffic counted twice)."""
+    return _current().get("traffic", {}).get("accounting_mode", "unidirectional")
+
+def is_daily_report_enabled() -> bool:
+    return bool(_current().get("daily_report", {}).get("enable", False))
+
+def get_daily_report_hour() -> int:
+    """Hour of the day (0-23, service timezone) the daily report is sent."""
+    hour = int(_current().get("daily_report", {}).get("hour", 8))
+    return hour if 0 <= hour <= 23 else 8
 
 def is_monthly_reset_enabled() -> bool:
     """Checks if the monthly traffic reset job is enabled."""
-    return config.get("monthly_reset", {}).get("enable", False)
+    return _current().get("monthly_reset", {}).get("enable", False)
+
+def get_web_threads() -> int:
+    """Request threads per web worker; panel calls of all threads share one event loop."""
+    return max(1, int(_current().get("web", {}).get("threads", 8)))
+
+def get_web_panel_timeout() -> float:
+    """Seconds a web request waits for a panel call before giving up on it."""
+    return max(1.0, float(_current().get("web", {}).get("panel_timeout", 90)))
+
+def get_query_cache_ttl() -> float:
+    """Seconds a panel's inbound list is reused for user queries (0 disables)."""
+    return max(0.0, float(_current().get("query", {}).get("cache_ttl", 30)))
+
+def get_snapshot_concurrency() -> int:
+    """Maximum number of panels polled at the same time by the traffic snapshot."""
+    return max(1, int(_current().get("snapshot", {}).get("concurrency", 10)))
+
+def get_snapshot_timeout() -> float:
+    """Per-panel timeout (seconds) for the traffic snapshot."""
+    return max(1.0, float(_current().get("snapshot", {}).get("timeout", 60)))
+
+def get_status_timeout() -> float:
+    """Per-panel timeout (seconds) for the /status overview."""
+    return max(1.0, float(_current().get("status", {}).get("timeout", 8)))
+
+def get_send_per_chat_interval() -> float:
+    """Minimum seconds between two bot messages to the same chat."""
+    return max(0.0, float(_current().get("telegram", {}).get("per_chat_interval", 1.0)))
+
+def get_send_global_rate() -> float:
+    """Maximum bot messages per second across all chats."""
+    return max(1.0, float(_current().get("telegram", {}).get("global_rate", 25)))
+
+def get_alert_rules() -> Optional[Dict[str, Any]]:
+    """Thresholds of the traffic alert rules, or None when alerting is off."""
+    alerts = _current().get("alerts", {})
+    if not alerts.get("enable", True):
+        return None
+    return {
+        "quota_percent": float(alerts.get("quota_percent", 90)),
+        "spike_factor": float(alerts.get("spike_factor", 3)),
+        "spike_min_bytes": int(float(alerts.get("spike_min_gb", 1)) * 1024 ** 3),
+        "expiry_days": int(alerts.get("expiry_days", 3)),
+    }
+
+def get_reset_concurrency() -> int:
+    """Maximum per-client reset requests in flight against one panel."""
+    return max(1, int(_current().get("reset", {}).get("concurrency", 20)))
+
+def get_reset_panel_concurrency() -> int:
+    """Panels reset at the same time by the scheduled reset job."""
+    return max(1, int(_current().get("reset", {}).get("panel_concurrency", 4)))
+
+def get_reset_retry_interval() -> float:
+    """Seconds before the first retry of a failed scheduled reset; doubles with each retry."""
+    return max(1.0, float(_current().get("reset", {}).get("retry_interval", 1))) * 60
+
+def get_reset_retry_max_interval() -> float:
+    """Upper bound of the retry interval, in seconds."""
+    return max(1.0, float(_current().get("reset", {}).get("retry_max_interval", 60))) * 60
+
+def get_reset_retry_deadline() -> float:
+    """Seconds after its due time a failed scheduled reset is retried before it is given up."""
+    return max(0.0, float(_current().get("reset", {}).get("retry_deadline", 24))) * 3600
+
+def get_reset_timezone() -> str:
+    """Default time zone of reset days and client billing cycles."""
+    return _current().get("reset", {}).get("timezone", "Asia/Hong_Kong")
+
+def get_panel_timezone(name: str) -> str:
+    """Time zone the panel's reset day is counted in."""
+    return get_panel_config(name).get("timezone") or get_reset_timezone()
+
+def get_rate_limit_max_failures() -> int:
+    """Failed queries within the window after which a user or IP is banned."""
+    return max(1, int(_current().get("rate_limit", {}).get("max_failures", 5)))
+
+def get_rate_limit_window() -> float:
+    """Length (seconds) of the window failed queries are counted in."""
+    return max(1.0, float(_current().get("rate_limit", {}).get("window_minutes", 5)) * 60)
+
+def get_rate_limit_block() -> float:
+    """Duration (seconds) of a ban for too many failed queries."""
+    return max(1.0, float(_current().get("rate_limit", {}).get("block_minutes", 120)) * 60)
+
+def get_health_interval() -> int:
+    """Seconds between background panel health checks."""
+    return max(10, int(_current().get("health", {}).get("interval", 60)))
+
+def get_health_timeout() -> float:
+    """Per-panel timeout (seconds) of a health check."""
+    return max(1.0, float(_current().get("health", {}).get("timeout", 8)))
+
+def get_health_failure_threshold() -> int:
+    """Consecutive failed checks after which a panel's circuit opens."""
+    return max(1, int(_current().get("health", {}).get("failure_threshold", 2)))
+
+def get_health_max_backoff() -> int:
+    """Upper bound (seconds) of the retry delay for an open circuit."""
+    return max(60, int(_current().get("health", {}).get("max_backoff", 1800)))
+
+def get_sampling_interval() -> int:
+    """Minutes between intraday traffic samples; 0 (the default) disables sampling."""
+    return max(0, int(_current().get("sampling", {}).get("interval_minutes", 0)))
+
+def get_sampling_raw_hours() -> int:
+    """Hours raw samples are kept before being reduced to one per hour."""
+    return max(1, int(_current().get("sampling", {}).get("raw_hours", 48)))
+
+def get_sampling_hourly_days() -> int:
+    """Days hourly samples are kept; older history lives in the daily snapshots only."""
+    return max(1, int(_current().get("sampling", {}).get("hourly_days", 30)))
 
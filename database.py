@@ -1,7 +1,9 @@
+import atexit
 import sqlite3
 import os
 import logging
-from datetime import datetime, timedelta
+import threading
+from datetime import date, datetime, timedelta
 from typing import List, Dict, Optional, Tuple
 
 logger = logging.getLogger(__name__)
@@ -10,33 +12,362 @@ DB_DIR = os.environ.get("DB_DIR", os.path.join(os.path.dirname(os.path.abspath(_
 DB_PATH = os.path.join(DB_DIR, "traffic.db")
 
 
+_local = threading.local()
+_pool_lock = threading.Lock()
+_pool: List[sqlite3.Connection] = []
+# Bumped by close_db() so every thread reopens instead of reusing a closed handle.
+_generation = 0
+
+
 def _get_conn() -> sqlite3.Connection:
+    """Return this thread's long-lived connection, opening it on first use.
+
+    PRAGMAs are applied once per connection and sqlite3 keeps its prepared
+    statement cache across calls.  A new connection is opened when DB_PATH
+    changes or after a fork.
+    """
+    key = (DB_PATH, os.getpid(), _generation)
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.key == key:
+        if conn.in_transaction:
+            # A previous call failed half-way; don't let its work leak into ours.
+            conn.rollback()
+        return conn
+    if conn is not None and _local.key[1] == key[1]:
+        _close(conn)
     os.makedirs(DB_DIR, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, cached_statements=256, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA journal_mode=WAL")
     conn.execute("PRAGMA busy_timeout=5000")
+    _local.conn, _local.key = conn, key
+    with _pool_lock:
+        _pool.append(conn)
     return conn
 
 
+def _close(conn: sqlite3.Connection) -> None:
+    with _pool_lock:
+        if conn in _pool:
+            _pool.remove(conn)
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def close_db() -> None:
+    """Close every pooled connection of this process; registered with atexit."""
+    global _generation
+    with _pool_lock:
+        conns, _pool[:] = list(_pool), []
+        _generation += 1
+    for conn in conns:
+        _close(conn)
+
+
+atexit.register(close_db)
+# Handles inherited across fork() belong to the parent; never reuse or close them.
+os.register_at_fork(after_in_child=lambda: _pool.clear())
+
+
+# Schema upgrades applied in order by init_db(); PRAGMA user_version records how
+# many have run.  Each one runs in a single IMMEDIATE transaction that re-checks
+# the version, so processes starting together (bot and web workers) apply it once.
+_MIGRATIONS = [
+    # 1: (record_date, created_at) serves date-range scans and the end-of-day
+    #    snapshot check; the single-column indexes are covered by it or by
+    #    UNIQUE(panel_name, email, record_date).
+    """
+    CREATE TABLE IF NOT EXISTS traffic_records (
+        id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        panel_name  TEXT    NOT NULL,
+        email       TEXT    NOT NULL,
+        record_date TEXT    NOT NULL,
+        upload      INTEGER DEFAULT 0,
+        download    INTEGER DEFAULT 0,
+        total_bytes INTEGER DEFAULT 0,
+        expiry_time INTEGER DEFAULT 0,
+        created_at  TEXT    DEFAULT (datetime('now','localtime')),
+        UNIQUE(panel_name, email, record_date)
+    );
+    CREATE INDEX IF NOT EXISTS idx_tr_date_created ON traffic_records(record_date, created_at);
+    DROP INDEX IF EXISTS idx_tr_date;
+    DROP INDEX IF EXISTS idx_tr_panel;
+    DROP INDEX IF EXISTS idx_tr_email;
+    """,
+    # 2: Normalized storage.  Panel names and emails live once in the panels and
+    #    clients dictionaries; snapshots are clustered on (client_id, day) with
+    #    day = days since 1970-01-01 and created_at = local wall-clock seconds.
+    #    Derived tables are dropped here and rebuilt by init_db().  The freed
+    #    pages are handed back by a VACUUM in run_pending_maintenance().
+    """
+    CREATE TABLE IF NOT EXISTS traffic_samples (
+        panel_name TEXT NOT NULL, email TEXT NOT NULL, sampled_at INTEGER NOT NULL,
+        upload INTEGER DEFAULT 0, download INTEGER DEFAULT 0,
+        PRIMARY KEY (panel_name, email, sampled_at)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS traffic_samples_hourly (
+        panel_name TEXT NOT NULL, email TEXT NOT NULL, sampled_at INTEGER NOT NULL,
+        upload INTEGER DEFAULT 0, download INTEGER DEFAULT 0,
+        PRIMARY KEY (panel_name, email, sampled_at)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE panels (
+        id          INTEGER PRIMARY KEY,
+        name        TEXT    NOT NULL UNIQUE
+    );
+    CREATE TABLE clients (
+        id          INTEGER PRIMARY KEY,
+        panel_id    INTEGER NOT NULL REFERENCES panels(id),
+        email       TEXT    NOT NULL,
+        UNIQUE(panel_id, email)
+    );
+    INSERT INTO panels (name)
+        SELECT panel_name FROM traffic_records
+        UNION SELECT panel_name FROM traffic_samples
+        UNION SELECT panel_name FROM traffic_samples_hourly;
+    INSERT INTO clients (panel_id, email)
+        SELECT p.id, s.email
+        FROM (SELECT panel_name, email FROM traffic_records
+              UNION SELECT panel_name, email FROM traffic_samples
+              UNION SELECT panel_name, email FROM traffic_samples_hourly) s
+        JOIN panels p ON p.name = s.panel_name;
+
+    CREATE TABLE traffic_snapshots (
+        client_id   INTEGER NOT NULL,
+        day         INTEGER NOT NULL,
+        upload      INTEGER DEFAULT 0,
+        download    INTEGER DEFAULT 0,
+        total_bytes INTEGER DEFAULT 0,
+        expiry_time INTEGER DEFAULT 0,
+        created_at  INTEGER NOT NULL,
+        PRIMARY KEY (client_id, day)
+    ) WITHOUT ROWID;
+    INSERT INTO traffic_snapshots
+        SELECT c.id, CAST(julianday(r.record_date) - 2440587.5 AS INTEGER),
+               r.upload, r.download, r.total_bytes, r.expiry_time,
+               COALESCE(CAST(strftime('%s', r.created_at) AS INTEGER),
+                        CAST(strftime('%s', r.record_date) AS INTEGER))
+        FROM traffic_records r
+        JOIN panels p ON p.name = r.panel_name
+        JOIN clients c ON c.panel_id = p.id AND c.email = r.email;
+    CREATE INDEX idx_ts_day_created ON traffic_snapshots(day, created_at);
+
+    CREATE TABLE samples_v2 (
+        client_id INTEGER NOT NULL, sampled_at INTEGER NOT NULL,
+        upload INTEGER DEFAULT 0, download INTEGER DEFAULT 0,
+        PRIMARY KEY (client_id, sampled_at)
+    ) WITHOUT ROWID;
+    INSERT INTO samples_v2
+        SELECT c.id, s.sampled_at, s.upload, s.download FROM traffic_samples s
+        JOIN panels p ON p.name = s.panel_name
+        JOIN clients c ON c.panel_id = p.id AND c.email = s.email;
+    CREATE TABLE samples_hourly_v2 (
+        client_id INTEGER NOT NULL, sampled_at INTEGER NOT NULL,
+        upload INTEGER DEFAULT 0, download INTEGER DEFAULT 0,
+        PRIMARY KEY (client_id, sampled_at)
+    ) WITHOUT ROWID;
+    INSERT INTO samples_hourly_v2
+        SELECT c.id, s.sampled_at, s.upload, s.download FROM traffic_samples_hourly s
+        JOIN panels p ON p.name = s.panel_name
+        JOIN clients c ON c.panel_id = p.id AND c.email = s.email;
+
+    DROP TABLE traffic_records;
+    DROP TABLE traffic_samples;
+    DROP TABLE traffic_samples_hourly;
+    ALTER TABLE samples_v2 RENAME TO traffic_samples;
+    ALTER TABLE samples_hourly_v2 RENAME TO traffic_samples_hourly;
+
+    INSERT OR IGNORE INTO pending_maintenance (task)
+        SELECT 'vacuum' WHERE EXISTS (SELECT 1 FROM traffic_snapshots);
+
+    DROP TABLE IF EXISTS traffic_deltas;
+    DROP TABLE IF EXISTS panel_daily_rollup;
+    CREATE TABLE traffic_deltas (
+        day         INTEGER NOT NULL,
+        client_id   INTEGER NOT NULL,
+        delta_up    INTEGER DEFAULT 0,
+        delta_down  INTEGER DEFAULT 0,
+        PRIMARY KEY (day, client_id)
+    ) WITHOUT ROWID;
+    CREATE TABLE panel_daily_rollup (
+        day         INTEGER NOT NULL,
+        panel_id    INTEGER NOT NULL,
+        upload      INTEGER DEFAULT 0,
+        download    INTEGER DEFAULT 0,
+        total       INTEGER DEFAULT 0,
+        user_count  INTEGER DEFAULT 0,
+        PRIMARY KEY (day, panel_id)
+    ) WITHOUT ROWID;
+    """,
+    # 3: Last known health of each panel, shared by the bot and web workers.
+    """
+    CREATE TABLE IF NOT EXISTS panel_health (
+        panel_name  TEXT    PRIMARY KEY,
+        xray_state  TEXT,
+        latency_ms  INTEGER,
+        error       TEXT,
+        failures    INTEGER NOT NULL DEFAULT 0,
+        checked_at  INTEGER NOT NULL,
+        retry_at    INTEGER NOT NULL DEFAULT 0
+    );
+    """,
+    # 4: Alerts already sent, one row per (rule, client, period), for dedup.
+    """
+    CREATE TABLE IF NOT EXISTS alert_log (
+        rule        TEXT    NOT NULL,
+        client_id   INTEGER NOT NULL,
+        period      TEXT    NOT NULL,
+        created_at  INTEGER NOT NULL,
+        PRIMARY KEY (rule, client_id, period)
+    ) WITHOUT ROWID;
+    """,
+    # 5: Notifications raised outside the bot process (web workers), waiting
+    #    for the bot to deliver them.  chat_id NULL means every admin.
+    """
+    CREATE TABLE IF NOT EXISTS notification_outbox (
+        id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id     INTEGER,
+        text        TEXT    NOT NULL,
+        parse_mode  TEXT,
+        created_at  INTEGER NOT NULL
+    );
+    """,
+    # 6: Failed-query counters and bans, shared by the bot and all web workers.
+    #    Rows are dead once expires_at passes and are purged on the next write.
+    """
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        key           TEXT PRIMARY KEY,
+        window_start  REAL NOT NULL,
+        count         INTEGER NOT NULL DEFAULT 0,
+        prev_count    INTEGER NOT NULL DEFAULT 0,
+        blocked_until REAL NOT NULL DEFAULT 0,
+        expires_at    REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_rl_expires ON rate_limits(expires_at);
+    """,
+    # 7: What was learned about each panel's API (style, session cookie name,
+    #    Xray version), so restarted processes skip detection.
+    """
+    CREATE TABLE IF NOT EXISTS panel_api_meta (
+        panel_name  TEXT    PRIMARY KEY,
+        url         TEXT    NOT NULL,
+        api_style   TEXT,
+        cookie_name TEXT,
+        version     TEXT,
+        updated_at  INTEGER NOT NULL
+    );
+    """,
+    # 8: Billing cycles of clients that reset on their own day instead of with
+    #    their panel (cycle_start NULL follows the client's expiryTime), and
+    #    the next due time of every panel and client reset.  email '' is a
+    #    panel-wide reset; ``cycle`` is the rule next_reset_at came from.
+    """
+    CREATE TABLE IF NOT EXISTS client_cycles (
+        panel_name  TEXT NOT NULL,
+        email       TEXT NOT NULL,
+        cycle_start TEXT,
+        timezone    TEXT,
+        PRIMARY KEY (panel_name, email)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS reset_schedule (
+        panel_name    TEXT    NOT NULL,
+        email         TEXT    NOT NULL,
+        cycle         TEXT    NOT NULL,
+        next_reset_at INTEGER NOT NULL,
+        last_reset_at INTEGER,
+        PRIMARY KEY (panel_name, email)
+    ) WITHOUT ROWID;
+    """,
+    # 9: Scheduled reset retries, every reset attempt for auditing, and the
+    #    counters a client had right before a reset on a day (summed over the
+    #    day's resets), which keep that day's delta across the counter drop.
+    """
+    ALTER TABLE reset_schedule ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE reset_schedule ADD COLUMN retry_at INTEGER;
+    CREATE TABLE IF NOT EXISTS reset_log (
+        id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        panel_name  TEXT    NOT NULL,
+        email       TEXT    NOT NULL,
+        due_at      INTEGER NOT NULL,
+        attempt     INTEGER NOT NULL,
+        started_at  INTEGER NOT NULL,
+        finished_at INTEGER NOT NULL,
+        success     INTEGER NOT NULL,
+        clients     INTEGER NOT NULL DEFAULT 0,
+        error       TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_reset_log_started ON reset_log(started_at);
+    CREATE TABLE IF NOT EXISTS reset_carry (
+        client_id   INTEGER NOT NULL,
+        day         INTEGER NOT NULL,
+        upload      INTEGER NOT NULL DEFAULT 0,
+        download    INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (client_id, day)
+    ) WITHOUT ROWID;
+    """,
+    # 10: When each panel's counters were last reset, by any process; inbound
+    #     lists cached before that time show pre-reset traffic and are dropped.
+    """
+    CREATE TABLE IF NOT EXISTS panel_reset_stamps (
+        panel_name  TEXT    PRIMARY KEY,
+        reset_at    REAL    NOT NULL
+    );
+    """,
+]
+
+
+def _statements(script: str):
+    """Split a migration script into single statements for Connection.execute()."""
+    statement = ""
+    for part in script.split(";"):
+        statement += part + ";"
+        if sqlite3.complete_statement(statement):
+            if statement.strip(" \n;"):
+                yield statement
+            statement = ""
+
+
+def _migrate(conn: sqlite3.Connection) -> List[int]:
+    """Apply pending migrations; returns the numbers applied by this call."""
+    applied = []
+    for number, script in enumerate(_MIGRATIONS, start=1):
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have applied it while we waited for the lock.
+            if conn.execute("PRAGMA user_version").fetchone()[0] < number:
+                for statement in _statements(script):
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {number}")
+                applied.append(number)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info("Applied database migration %s.", number)
+    return applied
+
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# Local wall-clock time as seconds, matching the strings datetime('now','localtime') gave.
+_NOW_LOCAL = "CAST(strftime('%s', 'now', 'localtime') AS INTEGER)"
+
+
+def _day(record_date: str) -> int:
+    """'YYYY-MM-DD' -> days since 1970-01-01, the storage format of snapshot dates."""
+    return datetime.strptime(record_date, "%Y-%m-%d").date().toordinal() - _EPOCH_ORDINAL
+
+
+def _date(day: int) -> str:
+    return date.fromordinal(day + _EPOCH_ORDINAL).strftime("%Y-%m-%d")
+
+
 def init_db():
     conn = _get_conn()
     conn.executescript("""
-        CREATE TABLE IF NOT EXISTS traffic_records (
-            id          INTEGER PRIMARY KEY AUTOINCREMENT,
-            panel_name  TEXT    NOT NULL,
-            email       TEXT    NOT NULL,
-            record_date TEXT    NOT NULL,
-            upload      INTEGER DEFAULT 0,
-            download    INTEGER DEFAULT 0,
-            total_bytes INTEGER DEFAULT 0,
-            expiry_time INTEGER DEFAULT 0,
-            created_at  TEXT    DEFAULT (datetime('now','localtime')),
-            UNIQUE(panel_name, email, record_date)
-        );
-        CREATE INDEX IF NOT EXISTS idx_tr_date  ON traffic_records(record_date);
-        CREATE INDEX IF NOT EXISTS idx_tr_panel ON traffic_records(panel_name);
-        CREATE INDEX IF NOT EXISTS idx_tr_email ON traffic_records(email);
         CREATE TABLE IF NOT EXISTS query_logs (
             id          INTEGER PRIMARY KEY AUTOINCREMENT,
             source      TEXT    NOT NULL,
@@ -47,29 +378,85 @@ def init_db():
             created_at  TEXT    DEFAULT (datetime('now','localtime'))
         );
         CREATE INDEX IF NOT EXISTS idx_ql_created ON query_logs(created_at);
+        CREATE TABLE IF NOT EXISTS pending_maintenance (
+            task        TEXT    PRIMARY KEY
+        );
     """)
     conn.commit()
-    conn.close()
+    _migrate(conn)
+    needs_backfill = (
+        conn.execute("SELECT 1 FROM traffic_snapshots LIMIT 1").fetchone() is not None
+        and (conn.execute("SELECT 1 FROM traffic_deltas LIMIT 1").fetchone() is None
+             or conn.execute("SELECT 1 FROM panel_daily_rollup LIMIT 1").fetchone() is None)
+    )
+    if needs_backfill:
+        rebuild_traffic_deltas()
     logger.info("Database initialised at %s", DB_PATH)
 
 
-def batch_record_traffic(records: List[Tuple]):
-    """Each tuple: (panel_name, email, upload, download, total_bytes, expiry_time, record_date)"""
+def run_pending_maintenance() -> None:
+    """Run the maintenance migrations left for later, i.e. the VACUUM after a table rewrite.
+
+    VACUUM copies the whole database under an exclusive lock, so it is not
+    part of init_db(), which every web worker runs on import: only the bot
+    at startup and the backfill CLI call this.
+    """
+    conn = _get_conn()
+    tasks = {row["task"] for row in conn.execute("SELECT task FROM pending_maintenance")}
+    if "vacuum" in tasks:
+        logger.info("Compacting the database after a migration; this may take a while.")
+        # Hand the pages freed by the rewritten tables back to the filesystem.
+        conn.execute("VACUUM")
+    conn.execute("DELETE FROM pending_maintenance")
+    conn.commit()
+
+
+def _client_ids(conn: sqlite3.Connection, keys) -> Dict[Tuple[str, str], int]:
+    """Ids for (panel_name, email) pairs, registering the ones not seen before."""
+    keys = set(keys)
+    panel_names = {panel for panel, _ in keys}
+    conn.executemany("INSERT OR IGNORE INTO panels (name) VALUES (?)",
+                     [(name,) for name in panel_names])
+    panel_ids = {
+        name: conn.execute("SELECT id FROM panels WHERE name = ?", (name,)).fetchone()[0]
+        for name in panel_names
+    }
+    conn.executemany("INSERT OR IGNORE INTO clients (panel_id, email) VALUES (?, ?)",
+                     [(panel_ids[panel], email) for panel, email in keys])
+    ids = {}
+    for name, panel_id in panel_ids.items():
+        for row in conn.execute("SELECT id, email FROM clients WHERE panel_id = ?", (panel_id,)):
+            ids[(name, row["email"])] = row["id"]
+    return ids
+
+
+def batch_record_traffic(records: List[Tuple],
+                         alert_rules: Optional[Dict] = None) -> List[Dict]:
+    """Each tuple: (panel_name, email, upload, download, total_bytes, expiry_time, record_date)
+
+    With ``alert_rules`` the freshly written days are evaluated against them and
+    the alerts not yet sent for their period are returned (see _evaluate_alerts).
+    """
     if not records:
-        return
+        return []
     conn = _get_conn()
+    ids = _client_ids(conn, ((r[0], r[1]) for r in records))
     conn.executemany(
-       """INSERT INTO traffic_records
-               (panel_name, email, upload, download, total_bytes, expiry_time, record_date)
-          VALUES (?, ?, ?, ?, ?, ?, ?)
-          ON CONFLICT(panel_name, email, record_date)
+        f"""INSERT INTO traffic_snapshots
+               (client_id, day, upload, download, total_bytes, expiry_time, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, {_NOW_LOCAL})
+           ON CONFLICT(client_id, day)
            DO UPDATE SET upload=excluded.upload, download=excluded.download,
                          total_bytes=excluded.total_bytes, expiry_time=excluded.expiry_time,
-                         created_at=datetime('now','localtime')""",
-        records,
+                         created_at=excluded.created_at""",
+        [(ids[(panel, email)], _day(record_date), up, down, total, expiry)
+         for panel, email, up, down, total, expiry, record_date in records],
     )
+    days = {_day(r[6]) for r in records}
+    _refresh_deltas(conn, days)
+    alerts = _evaluate_alerts(conn, days, alert_rules) if alert_rules else []
     conn.commit()
-    conn.close()
+    return alerts
 
 
 def cleanup_old_traffic(retention_days: int = 365,
@@ -81,72 +468,330 @@ def cleanup_old_traffic(retention_days: int = 365,
     else:
         reference = datetime.now().date()
     cutoff = reference - timedelta(days=retention_days - 1)
+    cutoff_day = cutoff.toordinal() - _EPOCH_ORDINAL
 
     conn = _get_conn()
-    cursor = conn.execute(
-        "DELETE FROM traffic_records WHERE record_date < ?",
-        (cutoff.strftime("%Y-%m-%d"),),
-    )
+    cursor = conn.execute("DELETE FROM traffic_snapshots WHERE day < ?", (cutoff_day,))
     deleted = cursor.rowcount
+    for table in ("traffic_deltas", "panel_daily_rollup", "reset_carry"):
+        conn.execute(f"DELETE FROM {table} WHERE day < ?", (cutoff_day,))
+    conn.execute("DELETE FROM alert_log WHERE created_at < ?", (cutoff_day * 86400,))
+    # Drop dictionary entries no longer referenced by any stored row.
+    conn.execute(
+        """DELETE FROM clients
+           WHERE NOT EXISTS (SELECT 1 FROM traffic_snapshots t WHERE t.client_id = clients.id)
+             AND NOT EXISTS (SELECT 1 FROM traffic_samples s WHERE s.client_id = clients.id)
+             AND NOT EXISTS (SELECT 1 FROM traffic_samples_hourly h
+                             WHERE h.client_id = clients.id)"""
+    )
+    conn.execute("DELETE FROM alert_log WHERE client_id NOT IN (SELECT id FROM clients)")
     conn.commit()
-    conn.close()
     if deleted:
         logger.info("Removed %s traffic records older than %s.", deleted, cutoff)
     return deleted
 
 
-def _delta_cte() -> str:
-    """Reusable CTE: computes per-row daily deltas from consecutive cumulative snapshots."""
-    return """
-    WITH deltas AS (
-        SELECT
-            a.record_date,
-            a.panel_name,
-            a.email,
-            CASE
-                WHEN b.upload   IS NOT NULL AND a.upload   >= b.upload
-                    THEN a.upload   - b.upload
-               WHEN b.upload   IS NOT NULL AND a.upload   <  b.upload
-                   THEN a.upload
-                ELSE 0
-           END AS delta_up,
-           CASE
-               WHEN b.download IS NOT NULL AND a.download >= b.download
-                   THEN a.download - b.download
-               WHEN b.download IS NOT NULL AND a.download <  b.download
-                   THEN a.download
-                ELSE 0
-           END AS delta_down
-        FROM traffic_records a
-        LEFT JOIN traffic_records b
-            ON b.panel_name  = a.panel_name
-           AND b.email       = a.email
-           AND b.record_date = date(a.record_date, '-1 day')
+# --- Alert rules ---
+# Each rule is one set-based query over all clients of a snapshot day.  The
+# period column is the dedup key: a client alerts once per rule and period.
+_ALERT_COLUMNS = """
+    t.client_id, p.name AS panel_name, c.email
+"""
+_NOT_ALERTED = """
+    NOT EXISTS (SELECT 1 FROM alert_log a
+                WHERE a.rule = ? AND a.client_id = t.client_id AND a.period = {period})
+"""
+
+_QUOTA_ALERT_SQL = f"""
+    SELECT 'quota' AS rule, {_ALERT_COLUMNS},
+           strftime('%Y-%m', t.day * 86400, 'unixepoch') AS period,
+           t.upload + t.download AS value, t.total_bytes AS threshold
+    FROM traffic_snapshots t
+    JOIN clients c ON c.id = t.client_id
+    JOIN panels p ON p.id = c.panel_id
+    WHERE t.day = ? AND t.total_bytes > 0
+      AND (t.upload + t.download) * 100.0 >= t.total_bytes * ?
+      AND {_NOT_ALERTED.format(period="strftime('%Y-%m', t.day * 86400, 'unixepoch')")}
+"""
+
+_SPIKE_ALERT_SQL = f"""
+    SELECT 'spike' AS rule, {_ALERT_COLUMNS},
+           date(t.day * 86400, 'unixepoch') AS period,
+           t.delta_up + t.delta_down AS value, CAST(h.mean AS INTEGER) AS threshold
+    FROM traffic_deltas t
+    JOIN (SELECT client_id, AVG(delta_up + delta_down) AS mean, COUNT(*) AS days
+          FROM traffic_deltas WHERE day BETWEEN ? AND ?
+          GROUP BY client_id) h ON h.client_id = t.client_id
+    JOIN clients c ON c.id = t.client_id
+    JOIN panels p ON p.id = c.panel_id
+    WHERE t.day = ? AND h.days >= 3
+      AND t.delta_up + t.delta_down >= ?
+      AND t.delta_up + t.delta_down > h.mean * ?
+      AND {_NOT_ALERTED.format(period="date(t.day * 86400, 'unixepoch')")}
+"""
+
+_EXPIRY_ALERT_SQL = f"""
+    SELECT 'expiry' AS rule, {_ALERT_COLUMNS},
+           CAST(t.expiry_time AS TEXT) AS period,
+           t.expiry_time AS value, NULL AS threshold
+    FROM traffic_snapshots t
+    JOIN clients c ON c.id = t.client_id
+    JOIN panels p ON p.id = c.panel_id
+    WHERE t.day = ? AND t.expiry_time > ? AND t.expiry_time <= ?
+      AND {_NOT_ALERTED.format(period="CAST(t.expiry_time AS TEXT)")}
+"""
+
+
+def _evaluate_alerts(conn: sqlite3.Connection, days, rules: Dict,
+                     now: Optional[int] = None) -> List[Dict]:
+    """Run the alert rules over whole snapshot days and log the new hits.
+
+    rules: quota_percent (usage >= % of total), spike_factor and spike_min_bytes
+    (day's usage > factor x mean of the previous 7 days), expiry_days (expires
+    within N days).  A falsy value disables that rule.
+    """
+    now = int(now if now is not None else datetime.now().timestamp())
+    alerts = []
+    for day in sorted(days):
+        if rules.get("quota_percent"):
+            alerts += conn.execute(_QUOTA_ALERT_SQL,
+                                   (day, rules["quota_percent"], "quota")).fetchall()
+        if rules.get("spike_factor"):
+            alerts += conn.execute(_SPIKE_ALERT_SQL, (
+                day - 7, day - 1, day, rules.get("spike_min_bytes", 0),
+                rules["spike_factor"], "spike",
+            )).fetchall()
+    if rules.get("expiry_days"):
+        alerts += conn.execute(_EXPIRY_ALERT_SQL, (
+            max(days), now * 1000, (now + rules["expiry_days"] * 86400) * 1000, "expiry",
+        )).fetchall()
+    conn.executemany(
+        "INSERT OR IGNORE INTO alert_log (rule, client_id, period, created_at) VALUES (?, ?, ?, ?)",
+        [(a["rule"], a["client_id"], a["period"], now) for a in alerts],
     )
+    return [dict(a) for a in alerts]
+
+
+# Daily delta of one snapshot row against the previous day's cumulative counters.
+# A counter lower than the day before means the panel was reset, so the whole
+# current value counts as that day's usage; without a previous day it is 0.
+# For a reset done by the bot, the counters read right before it (reset_carry)
+# are the usage up to the drop, and the snapshot only what came after it.
+_DELTA_SELECT = """
+    SELECT
+        a.day,
+        a.client_id,
+        CASE
+            WHEN b.upload   IS NULL THEN 0
+            WHEN r.upload   IS NOT NULL
+                THEN CASE WHEN r.upload >= b.upload THEN r.upload - b.upload
+                          ELSE r.upload END + a.upload
+            WHEN a.upload   >= b.upload
+                THEN a.upload   - b.upload
+            ELSE a.upload
+        END AS delta_up,
+        CASE
+            WHEN b.download IS NULL THEN 0
+            WHEN r.download IS NOT NULL
+                THEN CASE WHEN r.download >= b.download THEN r.download - b.download
+                          ELSE r.download END + a.download
+            WHEN a.download >= b.download
+                THEN a.download - b.download
+            ELSE a.download
+        END AS delta_down
+    FROM traffic_snapshots a
+    LEFT JOIN traffic_snapshots b
+        ON b.client_id = a.client_id
+       AND b.day       = a.day - 1
+    LEFT JOIN reset_carry r
+        ON r.client_id = a.client_id
+       AND r.day       = a.day
+"""
+
+_ROLLUP_SELECT = """
+    SELECT d.day, c.panel_id,
+           SUM(d.delta_up), SUM(d.delta_down), SUM(d.delta_up + d.delta_down), COUNT(*)
+    FROM traffic_deltas d
+    JOIN clients c ON c.id = d.client_id
+"""
+
+
+def _refresh_deltas(conn: sqlite3.Connection, days) -> None:
+    """Recompute materialized deltas and panel rollups for the given snapshot days.
+
+    The following day is refreshed too, since its delta depends on the
+    snapshot that was just (re)written.
     """
+    for day in sorted(set(days) | {d + 1 for d in days}):
+        conn.execute("DELETE FROM traffic_deltas WHERE day = ?", (day,))
+        conn.execute(
+            "INSERT INTO traffic_deltas (day, client_id, delta_up, delta_down)"
+            + _DELTA_SELECT + " WHERE a.day = ?",
+            (day,),
+        )
+        conn.execute("DELETE FROM panel_daily_rollup WHERE day = ?", (day,))
+        conn.execute(
+            "INSERT INTO panel_daily_rollup"
+            " (day, panel_id, upload, download, total, user_count)"
+            + _ROLLUP_SELECT + " WHERE d.day = ? GROUP BY d.day, c.panel_id",
+            (day,),
+        )
+
+
+def record_reset_carry(records: List[Tuple]) -> None:
+    """Keep the usage of clients that were just reset.
+
+    Each tuple: (panel_name, email, upload, download, total_bytes, expiry_time, record_date),
+    with the counters read right before the reset.  They are added to the
+    day's reset_carry and the day's snapshot is set to the zeroed counters,
+    so the day's delta still includes everything used before the reset.
+    """
+    if not records:
+        return
+    conn = _get_conn()
+    ids = _client_ids(conn, ((r[0], r[1]) for r in records))
+    rows = [(ids[(panel, email)], _day(record_date), up, down, total, expiry)
+            for panel, email, up, down, total, expiry, record_date in records]
+    conn.executemany(
+        """INSERT INTO reset_carry (client_id, day, upload, download) VALUES (?, ?, ?, ?)
+           ON CONFLICT(client_id, day)
+           DO UPDATE SET upload = upload + excluded.upload,
+                         download = download + excluded.download""",
+        [(client_id, day, up, down) for client_id, day, up, down, _, _ in rows],
+    )
+    conn.executemany(
+        f"""INSERT INTO traffic_snapshots
+               (client_id, day, upload, download, total_bytes, expiry_time, created_at)
+           VALUES (?, ?, 0, 0, ?, ?, {_NOW_LOCAL})
+           ON CONFLICT(client_id, day)
+           DO UPDATE SET upload=0, download=0, created_at=excluded.created_at""",
+        [(client_id, day, total, expiry) for client_id, day, _, _, total, expiry in rows],
+    )
+    _refresh_deltas(conn, {day for _, day, _, _, _, _ in rows})
+    conn.commit()
+
+
+def rebuild_traffic_deltas() -> int:
+    """Backfill the traffic_deltas and panel_daily_rollup tables from all stored snapshots."""
+    conn = _get_conn()
+    conn.execute("DELETE FROM traffic_deltas")
+    cursor = conn.execute(
+        "INSERT INTO traffic_deltas (day, client_id, delta_up, delta_down)"
+        + _DELTA_SELECT
+    )
+    rebuilt = cursor.rowcount
+    conn.execute("DELETE FROM panel_daily_rollup")
+    conn.execute(
+        "INSERT INTO panel_daily_rollup"
+        " (day, panel_id, upload, download, total, user_count)"
+        + _ROLLUP_SELECT + " GROUP BY d.day, c.panel_id"
+    )
+    conn.commit()
+    logger.info("Rebuilt %s traffic delta rows.", rebuilt)
+    return rebuilt
+
+
+# --- Intraday samples ---
+# Cumulative counters sampled every few minutes (unix seconds in sampled_at).
+# Three tiers: raw samples for the last raw_hours, the last sample of each hour
+# for hourly_days, and beyond that only the daily snapshots in traffic_snapshots.
+
+def record_traffic_samples(samples: List[Tuple], sampled_at: int) -> None:
+    """Each tuple: (panel_name, email, upload, download)"""
+    if not samples:
+        return
+    conn = _get_conn()
+    ids = _client_ids(conn, ((s[0], s[1]) for s in samples))
+    conn.executemany(
+        """INSERT OR REPLACE INTO traffic_samples (client_id, sampled_at, upload, download)
+           VALUES (?, ?, ?, ?)""",
+        [(ids[(p, e)], sampled_at, up, down) for p, e, up, down in samples],
+    )
+    conn.commit()
+
+
+def downsample_traffic_samples(raw_hours: int = 48, hourly_days: int = 30,
+                               now: Optional[int] = None) -> Tuple[int, int]:
+    """Fold raw samples older than ``raw_hours`` into hourly ones and expire old hours.
+
+    Returns (raw samples folded, hourly samples expired).
+    """
+    now = int(now if now is not None else datetime.now().timestamp())
+    # Only whole hours are folded, so an hour is never split across both tiers.
+    raw_cutoff = (now - raw_hours * 3600) // 3600 * 3600
+    hourly_cutoff = now - hourly_days * 86400
+
+    conn = _get_conn()
+    # With MAX() SQLite takes the bare columns from the row holding the maximum,
+    # i.e. the counters of the hour's last sample.
+    conn.execute(
+        """INSERT OR REPLACE INTO traffic_samples_hourly
+               (client_id, sampled_at, upload, download)
+           SELECT client_id, sampled_at / 3600 * 3600, upload, download
+           FROM (SELECT client_id, MAX(sampled_at) AS sampled_at, upload, download
+                 FROM traffic_samples WHERE sampled_at < ?
+                 GROUP BY client_id, sampled_at / 3600)""",
+        (raw_cutoff,),
+    )
+    folded = conn.execute(
+        "DELETE FROM traffic_samples WHERE sampled_at < ?", (raw_cutoff,)
+    ).rowcount
+    expired = conn.execute(
+        "DELETE FROM traffic_samples_hourly WHERE sampled_at < ?", (hourly_cutoff,)
+    ).rowcount
+    conn.commit()
+    if folded or expired:
+        logger.info("Downsampled %s raw traffic samples, expired %s hourly samples.",
+                    folded, expired)
+    return folded, expired
+
+
+def get_client_samples(panel_name: str, email: str,
+                       start: int, end: int) -> List[Dict]:
+    """Samples of one client between two unix timestamps, oldest first, across both tiers."""
+    conn = _get_conn()
+    row = conn.execute(
+        """SELECT c.id FROM clients c JOIN panels p ON p.id = c.panel_id
+           WHERE p.name = ? AND c.email = ?""",
+        (panel_name, email),
+    ).fetchone()
+    if row is None:
+        return []
+    rows = conn.execute(
+        """SELECT sampled_at, upload, download, 'hourly' AS resolution
+           FROM traffic_samples_hourly
+           WHERE client_id = ? AND sampled_at BETWEEN ? AND ?
+           UNION ALL
+           SELECT sampled_at, upload, download, 'raw'
+           FROM traffic_samples
+           WHERE client_id = ? AND sampled_at BETWEEN ? AND ?
+           ORDER BY sampled_at""",
+        (row["id"], start, end, row["id"], start, end),
+    ).fetchall()
+    return [dict(r) for r in rows]
 
 
 def get_daily_stats(start_date: str, end_date: str,
                     panel_name: Optional[str] = None) -> List[Dict]:
     conn = _get_conn()
-    where = ["deltas.record_date >= ?", "deltas.record_date <= ?"]
-    params: list = [start_date, end_date]
+    where = ["r.day >= ?", "r.day <= ?"]
+    params: list = [_day(start_date), _day(end_date)]
     if panel_name:
-        where.append("deltas.panel_name = ?")
+        where.append("p.name = ?")
         params.append(panel_name)
-    sql = _delta_cte() + f"""
-        SELECT record_date,
-               SUM(delta_up) AS total_upload,
-               SUM(delta_down) AS total_download,
-               SUM(delta_up + delta_down) AS daily_total
-        FROM deltas
+    sql = f"""
+        SELECT r.day,
+               SUM(r.upload) AS total_upload,
+               SUM(r.download) AS total_download,
+               SUM(r.total) AS daily_total
+        FROM panel_daily_rollup r
+        JOIN panels p ON p.id = r.panel_id
         WHERE {' AND '.join(where)}
-        GROUP BY record_date
-        ORDER BY record_date
+        GROUP BY r.day
+        ORDER BY r.day
     """
     rows = conn.execute(sql, params).fetchall()
-    conn.close()
-    return [{"record_date": r["record_date"],
+    return [{"record_date": _date(r["day"]),
              "total_upload": r["total_upload"] or 0,
              "total_download": r["total_download"] or 0,
              "daily_total": r["daily_total"] or 0} for r in rows]
@@ -154,43 +799,42 @@ def get_daily_stats(start_date: str, end_date: str,
 
 def get_panel_daily_stats(start_date: str, end_date: str) -> List[Dict]:
     conn = _get_conn()
-    sql = _delta_cte() + """
-        SELECT record_date, panel_name,
-               SUM(delta_up + delta_down) AS daily_total
-        FROM deltas
-        WHERE record_date >= ? AND record_date <= ?
-        GROUP BY record_date, panel_name
-        ORDER BY record_date, panel_name
+    sql = """
+        SELECT r.day, p.name AS panel_name, r.total AS daily_total, r.user_count
+        FROM panel_daily_rollup r
+        JOIN panels p ON p.id = r.panel_id
+        WHERE r.day >= ? AND r.day <= ?
+        ORDER BY r.day, p.name
     """
-    rows = conn.execute(sql, [start_date, end_date]).fetchall()
-    conn.close()
-    return [{"record_date": r["record_date"],
+    rows = conn.execute(sql, [_day(start_date), _day(end_date)]).fetchall()
+    return [{"record_date": _date(r["day"]),
              "panel_name": r["panel_name"],
-             "daily_total": r["daily_total"] or 0} for r in rows]
+             "daily_total": r["daily_total"] or 0,
+             "user_count": r["user_count"] or 0} for r in rows]
 
 
 def get_user_daily_stats(start_date: str, end_date: str,
                           panel_name: str, email: Optional[str] = None,
                           limit: int = 100) -> List[Dict]:
     conn = _get_conn()
-    params: list = [start_date, end_date, panel_name]
-    where = ["deltas.record_date >= ?", "deltas.record_date <= ?", "deltas.panel_name = ?"]
+    params: list = [_day(start_date), _day(end_date), panel_name]
+    where = ["d.day >= ?", "d.day <= ?", "p.name = ?"]
     if email:
-        where.append("deltas.email = ?")
+        where.append("c.email = ?")
         params.append(email)
-    sql = _delta_cte() + f"""
-        SELECT record_date, email,
-               SUM(delta_up + delta_down) AS daily_total
-        FROM deltas
+    sql = f"""
+        SELECT d.day, c.email,
+               d.delta_up + d.delta_down AS daily_total
+        FROM traffic_deltas d
+        JOIN clients c ON c.id = d.client_id
+        JOIN panels p ON p.id = c.panel_id
         WHERE {' AND '.join(where)}
-        GROUP BY record_date, email
-        ORDER BY record_date, daily_total DESC
+        ORDER BY d.day, daily_total DESC
         LIMIT ?
     """
     params.append(limit)
     rows = conn.execute(sql, params).fetchall()
-    conn.close()
-    return [{"record_date": r["record_date"],
+    return [{"record_date": _date(r["day"]),
              "email": r["email"],
              "daily_total": r["daily_total"] or 0} for r in rows]
 
@@ -198,83 +842,335 @@ def get_user_daily_stats(start_date: str, end_date: str,
 def get_top_users(start_date: str, end_date: str,
                   panel_name: Optional[str] = None, limit: int = 20) -> List[Dict]:
     conn = _get_conn()
-    where = ["deltas.record_date >= ?", "deltas.record_date <= ?"]
-    params: list = [start_date, end_date]
+    where = ["d.day >= ?", "d.day <= ?"]
+    params: list = [_day(start_date), _day(end_date)]
     if panel_name:
-        where.append("deltas.panel_name = ?")
+        where.append("p.name = ?")
         params.append(panel_name)
-    sql = _delta_cte() + f"""
-        SELECT email, panel_name,
-               SUM(delta_up + delta_down) AS total_usage
-        FROM deltas
+    sql = f"""
+        SELECT c.email, p.name AS panel_name,
+               SUM(d.delta_up + d.delta_down) AS total_usage
+        FROM traffic_deltas d
+        JOIN clients c ON c.id = d.client_id
+        JOIN panels p ON p.id = c.panel_id
         WHERE {' AND '.join(where)}
-        GROUP BY email, panel_name
+        GROUP BY d.client_id
         ORDER BY total_usage DESC
         LIMIT ?
     """
     params.append(limit)
     rows = conn.execute(sql, params).fetchall()
-    conn.close()
     return [{"email": r["email"],
              "panel_name": r["panel_name"],
              "total_usage": r["total_usage"] or 0} for r in rows]
 
 
+# Snapshot columns in the shape callers knew from the old traffic_records rows.
+_SNAPSHOT_COLUMNS = """
+    p.name AS panel_name, c.email, date(t.day * 86400, 'unixepoch') AS record_date,
+    t.upload, t.download, t.total_bytes, t.expiry_time,
+    datetime(t.created_at, 'unixepoch') AS created_at
+"""
+
+
+def _latest_snapshot_sql(panel_name: Optional[str]) -> str:
+    """Latest row per client.
+
+    One descending primary-key probe per client, so the cost grows with the
+    number of clients rather than with the number of stored days.
+    """
+    panel_filter = "WHERE p.name = ?" if panel_name else ""
+    return f"""
+        SELECT {_SNAPSHOT_COLUMNS}
+        FROM clients c
+        JOIN panels p ON p.id = c.panel_id
+        -- CROSS JOIN pins clients as the outer loop.
+        CROSS JOIN traffic_snapshots t
+          ON t.client_id = c.id
+         AND t.day = (SELECT MAX(m.day) FROM traffic_snapshots m WHERE m.client_id = c.id)
+        {panel_filter}
+        ORDER BY p.name, (t.upload + t.download) DESC
+    """
+
+
 def get_latest_snapshot(panel_name: Optional[str] = None) -> List[Dict]:
     conn = _get_conn()
-    if panel_name:
-        sql = """
-            SELECT t.* FROM traffic_records t
-            INNER JOIN (
-                SELECT panel_name, email, MAX(record_date) AS maxd
-                FROM traffic_records GROUP BY panel_name, email
-            ) m ON t.panel_name = m.panel_name
-               AND t.email = m.email
-               AND t.record_date = m.maxd
-            WHERE t.panel_name = ?
-            ORDER BY (t.upload + t.download) DESC
-        """
-        rows = conn.execute(sql, (panel_name,)).fetchall()
-    else:
-        sql = """
-            SELECT t.* FROM traffic_records t
-            INNER JOIN (
-                SELECT panel_name, email, MAX(record_date) AS maxd
-                FROM traffic_records GROUP BY panel_name, email
-            ) m ON t.panel_name = m.panel_name
-               AND t.email = m.email
-               AND t.record_date = m.maxd
-            ORDER BY t.panel_name, (t.upload + t.download) DESC
-        """
-        rows = conn.execute(sql).fetchall()
-    conn.close()
+    params = (panel_name,) if panel_name else ()
+    rows = conn.execute(_latest_snapshot_sql(panel_name), params).fetchall()
     return [dict(r) for r in rows]
 
 
 def get_date_range() -> Optional[Tuple[str, str]]:
     conn = _get_conn()
     row = conn.execute(
-        "SELECT MIN(record_date) AS mind, MAX(record_date) AS maxd FROM traffic_records"
+        "SELECT MIN(day) AS mind, MAX(day) AS maxd FROM traffic_snapshots"
     ).fetchone()
-    conn.close()
-    if row and row["mind"]:
-        return row["mind"], row["maxd"]
+    if row and row["mind"] is not None:
+        return _date(row["mind"]), _date(row["maxd"])
     return None
 
 
 def has_daily_traffic_snapshot(record_date: str) -> bool:
     """Return whether a date has the scheduled end-of-day traffic snapshot."""
+    day = _day(record_date)
     conn = _get_conn()
     row = conn.execute(
-        """SELECT 1 FROM traffic_records
-           WHERE record_date = ? AND time(created_at) >= '23:00:00'
+        """SELECT 1 FROM traffic_snapshots
+           WHERE day = ? AND created_at >= ?
            LIMIT 1""",
-        (record_date,),
+        (day, day * 86400 + 23 * 3600),
     ).fetchone()
-    conn.close()
     return row is not None
 
 
+def save_panel_health(panel_name: str, xray_state: Optional[str], latency_ms: Optional[int],
+                      error: Optional[str], failures: int, checked_at: int, retry_at: int) -> None:
+    conn = _get_conn()
+    conn.execute(
+        """INSERT OR REPLACE INTO panel_health
+               (panel_name, xray_state, latency_ms, error, failures, checked_at, retry_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        (panel_name, xray_state, latency_ms, error, failures, checked_at, retry_at),
+    )
+    conn.commit()
+
+
+def get_panel_health(panel_name: Optional[str] = None) -> List[Dict]:
+    conn = _get_conn()
+    if panel_name:
+        rows = conn.execute("SELECT * FROM panel_health WHERE panel_name = ?",
+                            (panel_name,)).fetchall()
+    else:
+        rows = conn.execute("SELECT * FROM panel_health ORDER BY panel_name").fetchall()
+    return [dict(r) for r in rows]
+
+
+def delete_panel_health(panel_name: str) -> None:
+    conn = _get_conn()
+    conn.execute("DELETE FROM panel_health WHERE panel_name = ?", (panel_name,))
+    conn.commit()
+
+
+def save_panel_meta(panel_name: str, url: str, api_style: Optional[str],
+                    cookie_name: Optional[str], version: Optional[str]) -> None:
+    conn = _get_conn()
+    conn.execute(
+        f"""INSERT OR REPLACE INTO panel_api_meta
+                (panel_name, url, api_style, cookie_name, version, updated_at)
+            VALUES (?, ?, ?, ?, ?, {_NOW_LOCAL})""",
+        (panel_name, url, api_style, cookie_name, version),
+    )
+    conn.commit()
+
+
+def get_panel_meta(panel_name: str) -> Optional[Dict]:
+    row = _get_conn().execute(
+        "SELECT * FROM panel_api_meta WHERE panel_name = ?", (panel_name,)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def delete_panel_meta(panel_name: str) -> None:
+    conn = _get_conn()
+    conn.execute("DELETE FROM panel_api_meta WHERE panel_name = ?", (panel_name,))
+    conn.commit()
+
+
+def mark_panel_reset(panel_name: str, reset_at: float) -> None:
+    conn = _get_conn()
+    conn.execute("INSERT OR REPLACE INTO panel_reset_stamps (panel_name, reset_at) VALUES (?, ?)",
+                 (panel_name, reset_at))
+    conn.commit()
+
+
+def get_panel_reset_stamp(panel_name: str) -> Optional[float]:
+    row = _get_conn().execute(
+        "SELECT reset_at FROM panel_reset_stamps WHERE panel_name = ?", (panel_name,)
+    ).fetchone()
+    return row["reset_at"] if row else None
+
+
+def set_client_cycle(panel_name: str, email: str, cycle_start: Optional[str],
+                     timezone: Optional[str]) -> None:
+    """Give a client its own billing cycle; cycle_start None follows its expiryTime."""
+    conn = _get_conn()
+    conn.execute(
+        """INSERT OR REPLACE INTO client_cycles (panel_name, email, cycle_start, timezone)
+           VALUES (?, ?, ?, ?)""",
+        (panel_name, email, cycle_start, timezone),
+    )
+    conn.commit()
+
+
+def delete_client_cycle(panel_name: str, email: str) -> bool:
+    conn = _get_conn()
+    cur = conn.execute("DELETE FROM client_cycles WHERE panel_name = ? AND email = ?",
+                       (panel_name, email))
+    conn.commit()
+    return cur.rowcount > 0
+
+
+def get_client_cycles(panel_name: Optional[str] = None) -> List[Dict]:
+    """Client cycles with the expiryTime (ms, 0 if unknown) of each client's latest snapshot."""
+    panel_filter = "WHERE cc.panel_name = ?" if panel_name else ""
+    rows = _get_conn().execute(
+        f"""SELECT cc.panel_name, cc.email, cc.cycle_start, cc.timezone,
+                   COALESCE((SELECT t.expiry_time FROM traffic_snapshots t
+                             WHERE t.client_id = c.id ORDER BY t.day DESC LIMIT 1), 0)
+                       AS expiry_time
+            FROM client_cycles cc
+            LEFT JOIN panels p ON p.name = cc.panel_name
+            LEFT JOIN clients c ON c.panel_id = p.id AND c.email = cc.email
+            {panel_filter}
+            ORDER BY cc.panel_name, cc.email""",
+        (panel_name,) if panel_name else (),
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def get_reset_schedule() -> Dict[Tuple[str, str], Dict]:
+    rows = _get_conn().execute("SELECT * FROM reset_schedule").fetchall()
+    return {(r["panel_name"], r["email"]): dict(r) for r in rows}
+
+
+def save_reset_schedule(rows: List[Tuple]) -> None:
+    """Each tuple: (panel_name, email, cycle, next_reset_at, last_reset_at, attempts, retry_at)."""
+    if not rows:
+        return
+    conn = _get_conn()
+    conn.executemany(
+        """INSERT OR REPLACE INTO reset_schedule
+               (panel_name, email, cycle, next_reset_at, last_reset_at, attempts, retry_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        rows,
+    )
+    conn.commit()
+
+
+def delete_reset_schedule(keys: List[Tuple[str, str]]) -> None:
+    if not keys:
+        return
+    conn = _get_conn()
+    conn.executemany("DELETE FROM reset_schedule WHERE panel_name = ? AND email = ?", keys)
+    conn.commit()
+
+
+def record_reset_attempts(rows: List[Tuple]) -> None:
+    """Each tuple: (panel_name, email, due_at, attempt, started_at, finished_at,
+    success, clients, error); email '' is a panel-wide reset."""
+    if not rows:
+        return
+    conn = _get_conn()
+    conn.executemany(
+        """INSERT INTO reset_log (panel_name, email, due_at, attempt, started_at,
+                                  finished_at, success, clients, error)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        [(*r[:6], 1 if r[6] else 0, *r[7:]) for r in rows],
+    )
+    conn.commit()
+
+
+def get_reset_log(limit: int = 100, panel_name: Optional[str] = None) -> List[Dict]:
+    sql = "SELECT * FROM reset_log"
+    params: list = []
+    if panel_name:
+        sql += " WHERE panel_name = ?"
+        params.append(panel_name)
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(limit)
+    return [dict(r) for r in _get_conn().execute(sql, params).fetchall()]
+
+
+def enqueue_notification(text: str, parse_mode: Optional[str] = "Markdown",
+                         chat_id: Optional[int] = None) -> None:
+    """Queue a message for the bot to send; chat_id None addresses all admins."""
+    conn = _get_conn()
+    conn.execute(
+        f"""INSERT INTO notification_outbox (chat_id, text, parse_mode, created_at)
+            VALUES (?, ?, ?, {_NOW_LOCAL})""",
+        (chat_id, text, parse_mode),
+    )
+    conn.commit()
+
+
+def take_notifications(limit: int = 100) -> List[Dict]:
+    """Remove and return up to ``limit`` queued notifications, oldest first."""
+    conn = _get_conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(
+            "SELECT * FROM notification_outbox ORDER BY id LIMIT ?", (limit,)
+        ).fetchall()
+        if rows:
+            conn.execute("DELETE FROM notification_outbox WHERE id <= ?", (rows[-1]["id"],))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return [dict(r) for r in rows]
+
+
+def get_rate_limit(key: str, now: float) -> Optional[Dict]:
+    row = _get_conn().execute(
+        "SELECT * FROM rate_limits WHERE key = ? AND expires_at > ?", (key, now)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def add_rate_limit_failure(key: str, max_failures: int, window: float,
+                           block: float, now: float) -> float:
+    """Count one failure for ``key``; returns the ban end time, or 0 if not banned.
+
+    Failures are counted in a sliding window approximated from two fixed
+    ones (the previous window's count weighted by its overlap), so one row
+    per key is enough.  Reaching max_failures bans the key for ``block``
+    seconds.  Expired rows of all keys are purged here, which keeps the
+    table bounded without a cleanup job.
+    """
+    conn = _get_conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM rate_limits WHERE expires_at <= ?", (now,))
+        row = conn.execute(
+            "SELECT window_start, count, prev_count, blocked_until FROM rate_limits WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row and row["blocked_until"] > now:
+            conn.commit()
+            return row["blocked_until"]
+        window_start, count, prev_count = (
+            (row["window_start"], row["count"], row["prev_count"]) if row else (now, 0, 0))
+        if now - window_start >= 2 * window:
+            window_start, count, prev_count = now, 0, 0
+        elif now - window_start >= window:
+            window_start, count, prev_count = window_start + window, 0, count
+        count += 1
+        overlap = max(0.0, 1 - (now - window_start) / window)
+        blocked_until = 0.0
+        if prev_count * overlap + count >= max_failures:
+            blocked_until = now + block
+            window_start, count, prev_count = now, 0, 0
+        conn.execute(
+            """INSERT OR REPLACE INTO rate_limits
+                   (key, window_start, count, prev_count, blocked_until, expires_at)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (key, window_start, count, prev_count, blocked_until,
+             max(blocked_until, window_start + 2 * window)),
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return blocked_until
+
+
+def clear_rate_limit(key: str, now: float) -> None:
+    """Forget the failures of ``key`` after a success; an active ban stays."""
+    conn = _get_conn()
+    conn.execute("DELETE FROM rate_limits WHERE key = ? AND blocked_until <= ?", (key, now))
+    conn.commit()
+
+
 def record_query_log(source: str, actor: str, panel_name: str, email: str, success: bool) -> None:
     """Persist a single query log entry (TG bot or Web)."""
     conn = _get_conn()
@@ -284,7 +1180,6 @@ def record_query_log(source: str, actor: str, panel_name: str, email: str, succe
         (source, str(actor), panel_name or "", email or "", 1 if success else 0),
     )
     conn.commit()
-    conn.close()
 
 
 def get_query_logs(limit: int = 200) -> List[Dict]:
@@ -297,27 +1192,43 @@ def get_query_logs(limit: int = 200) -> List[Dict]:
            LIMIT ?""",
         (limit,),
     ).fetchall()
-    conn.close()
     return [dict(r) for r in rows]
 
 
 def get_panel_user_list(panel_name: str) -> List[str]:
     conn = _get_conn()
     rows = conn.execute(
-        "SELECT DISTINCT email FROM traffic_records WHERE panel_name = ? ORDER BY email",
+        """SELECT c.email FROM clients c JOIN panels p ON p.id = c.panel_id
+           WHERE p.name = ?
+             AND EXISTS (SELECT 1 FROM traffic_snapshots t WHERE t.client_id = c.id)
+           ORDER BY c.email""",
         (panel_name,),
     ).fetchall()
-    conn.close()
     return [r["email"] for r in rows]
 
 
 def get_panel_summary_for_date(panel_name: str, record_date: str) -> List[Dict]:
     conn = _get_conn()
     rows = conn.execute(
-        """SELECT * FROM traffic_records
-           WHERE panel_name = ? AND record_date = ?
-           ORDER BY (upload + download) DESC""",
-        (panel_name, record_date),
+        f"""SELECT {_SNAPSHOT_COLUMNS}
+            FROM panels p
+            JOIN clients c ON c.panel_id = p.id
+            JOIN traffic_snapshots t ON t.client_id = c.id AND t.day = ?
+            WHERE p.name = ?
+            ORDER BY (t.upload + t.download) DESC""",
+        (_day(record_date), panel_name),
     ).fetchall()
-    conn.close()
     return [dict(r) for r in rows]
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+    if sys.argv[1:] == ["backfill-deltas"]:
+        init_db()
+        run_pending_maintenance()
+        rebuild_traffic_deltas()
+    else:
+        print("Usage: python database.py backfill-deltas")
+        sys.exit(1)
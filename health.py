@@ -0,0 +1,103 @@
+# health.py
+"""Panel health state with a circuit breaker.
+
+The bot's health monitor probes every panel in the background and stores the
+result in the panel_health table, so the bot and all web workers share it.
+After ``health.failure_threshold`` consecutive failures a panel's circuit is
+open: callers fail fast instead of waiting out timeouts, and the panel is
+probed again after a delay that doubles with every further failure.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+import config
+from database import save_panel_health, get_panel_health
+from xui_api import get_panel_api
+
+logger = logging.getLogger(__name__)
+
+
+def _now() -> int:
+    return int(time.time())
+
+
+def get_health(panel_name: str) -> Optional[Dict]:
+    rows = get_panel_health(panel_name)
+    return rows[0] if rows else None
+
+
+def get_all_health() -> Dict[str, Dict]:
+    return {row["panel_name"]: row for row in get_panel_health()}
+
+
+def is_down(row: Optional[Dict]) -> bool:
+    """Whether a health row marks its panel as offline."""
+    return bool(row) and row["failures"] >= config.get_health_failure_threshold()
+
+
+def is_circuit_open(panel_name: str, now: Optional[int] = None) -> bool:
+    """True while calls to an offline panel should fail fast.
+
+    Once ``retry_at`` passes the circuit is half-open: the next call or
+    health check is let through and decides whether it closes again.
+    """
+    row = get_health(panel_name)
+    return is_down(row) and (now if now is not None else _now()) < row["retry_at"]
+
+
+def record_probe(panel_name: str, xray_state: Optional[str], latency: float,
+                 error: Optional[str], now: Optional[int] = None) -> Tuple[bool, bool]:
+    """Store one check result; returns (was_down, is_down) for alerting on transitions."""
+    now = now if now is not None else _now()
+    previous = get_health(panel_name)
+    threshold = config.get_health_failure_threshold()
+    if error is None:
+        failures, retry_at = 0, 0
+    else:
+        failures = (previous["failures"] if previous else 0) + 1
+        retry_at = 0
+        if failures >= threshold:
+            backoff = config.get_health_interval() * 2 ** (failures - threshold)
+            retry_at = now + min(backoff, config.get_health_max_backoff())
+    save_panel_health(panel_name, xray_state, int(latency * 1000), error,
+                      failures, now, retry_at)
+    return is_down(previous), failures >= threshold
+
+
+async def probe_panel(name: str, panel_config: dict, timeout: float) -> Tuple[Optional[str], float, Optional[str]]:
+    """Return (xray state, latency in seconds, error) for one panel; never raises."""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    try:
+        status = await asyncio.wait_for(
+            get_panel_api(name, panel_config).get_server_status(), timeout=timeout)
+    except asyncio.TimeoutError:
+        return None, loop.time() - started, "超时"
+    except Exception as e:
+        logger.warning(f"Health probe of panel '{name}' failed: {e}")
+        return None, loop.time() - started, "连接失败"
+    latency = loop.time() - started
+    if status and 'xray' in status:
+        return status['xray'].get('state', 'N/A'), latency, None
+    return None, latency, "连接失败"
+
+
+async def check_panels(panels: Dict[str, dict], timeout: float,
+                       now: Optional[int] = None) -> List[Tuple[str, bool, bool, Optional[str]]]:
+    """Probe every enabled panel whose circuit allows it, concurrently.
+
+    Returns (name, was_down, is_down, error) for each panel that was probed.
+    """
+    now = now if now is not None else _now()
+    due = [
+        (name, pconf) for name, pconf in panels.items()
+        if not pconf.get("disabled", False) and not is_circuit_open(name, now)
+    ]
+    results = await asyncio.gather(*(probe_panel(name, pconf, timeout) for name, pconf in due))
+    checked = []
+    for (name, _), (state, latency, error) in zip(due, results):
+        was_down, down = record_probe(name, state, latency, error, now)
+        checked.append((name, was_down, down, error))
+    return checked
@@ -1,10 +1,11 @@
+import asyncio
 import logging
 import subprocess
 import sys
 from functools import wraps
 from datetime import datetime, timedelta, time
-from zoneinfo import ZoneInfo
 from telegram import Update, BotCommand
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -15,11 +16,18 @@ from telegram.ext import (
 )
 
 import config
-from xui_api import XUIApi
+from xui_api import XUIApi, get_panel_api, drop_panel_api, close_all_panel_apis
+import message_queue
+import rate_limit
+from message_queue import send_to_admins
+from health import check_panels, get_health, is_circuit_open, probe_panel, record_probe
+from reset_schedule import ResetScheduler, group_by_panel, is_valid_timezone, zone
 from database import (
-    init_db, batch_record_traffic, cleanup_old_traffic,
+    init_db, run_pending_maintenance, batch_record_traffic, cleanup_old_traffic,
+    record_traffic_samples, downsample_traffic_samples, delete_panel_health,
     get_daily_stats, get_panel_daily_stats, get_top_users, has_daily_traffic_snapshot,
-    record_query_log,
+    record_query_log, take_notifications, set_client_cycle, delete_client_cycle,
+    record_reset_attempts,
 )
 
 logging.basicConfig(
@@ -27,7 +35,16 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-SCHEDULE_TIMEZONE = ZoneInfo("Asia/Hong_Kong")
+SCHEDULE_TIMEZONE = config.SCHEDULE_TIMEZONE
+# Minimum seconds between edits of the /status overview message.
+STATUS_EDIT_INTERVAL = 1.0
+# Seconds between polls of the notification outbox filled by the web app.
+OUTBOX_POLL_INTERVAL = 2
+# Seconds between reloads of the reset rules, which picks up reset days
+# changed from the web app.  Resets themselves run on a timer set for the
+# earliest due one.
+RESET_SYNC_INTERVAL = 600
+RESET_JOB_NAME = "traffic_reset"
 
 
 def _scheduled_time(hour: int, minute: int = 0) -> time:
@@ -37,11 +54,6 @@ def _scheduled_time(hour: int, minute: int = 0) -> time:
 # Init database on startup
 init_db()
 
-# --- Rate Limiting ---
-failed_query_attempts = {}
-blocked_users = {}
-
-
 # --- Helper Functions ---
 def _format_bytes(size: int) -> str:
     if size is None:
@@ -106,7 +118,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             "/listusers - 👥 列出所有授权用户\n"
             "/setresetday <面板名> <日期> - 🔧 设置面板流量重置日(1-28)\n"
             "/report - 📈 立即发送今日日报\n"
-            "/resetpanel <面板名> - ⚡️ 立即重置指定面板流量"
+            "/resetpanel <面板名> - ⚡️ 立即重置指定面板流量\n"
+            "/resetclients <面板名> <用户名...> - 🔄 重置指定用户流量\n"
+            "/setcycle <面板名> <用户名> <起始日期|expiry|off> [时区] - 📅 设置用户计费周期\n"
+            "/nextresets - ⏰ 查看即将进行的流量重置"
         )
     else:
         help_text = (
@@ -118,6 +133,58 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     await update.message.reply_text(help_text, parse_mode='Markdown')
 
 
+def _format_status_overview(all_panels: dict, results: dict) -> str:
+    lines = ["**所有面板状态概览:**"]
+    for name, panel_config in all_panels.items():
+        if panel_config.get("disabled", False):
+            lines.append(f"- **{name}**: `已禁用`")
+        elif name not in results:
+            lines.append(f"- **{name}**: `查询中...`")
+        else:
+            state, latency, error = results[name]
+            shown = state.capitalize() if state else f"`{error}`"
+            lines.append(f"- **{name}**: {shown} ({latency * 1000:.0f} ms)")
+    return "\n".join(lines)
+
+
+async def _status_overview(update: Update, all_panels: dict) -> None:
+    """Probe all panels at once and fill one message in as they answer."""
+    results = {}
+    live = []
+    for name, pconf in all_panels.items():
+        if pconf.get("disabled", False):
+            continue
+        if is_circuit_open(name):
+            # Known to be down: show the monitor's last result instead of waiting on it.
+            row = get_health(name)
+            ago = max(0, int(datetime.now().timestamp()) - row["checked_at"])
+            results[name] = (None, (row["latency_ms"] or 0) / 1000, f"离线，{ago}秒前检查")
+        else:
+            live.append((name, pconf))
+    message = await update.message.reply_text(
+        _format_status_overview(all_panels, results), parse_mode='Markdown')
+    timeout = config.get_status_timeout()
+
+    async def probe(name, pconf):
+        return name, await probe_panel(name, pconf, timeout)
+
+    probes = [probe(name, pconf) for name, pconf in live]
+    loop = asyncio.get_running_loop()
+    last_edit = loop.time()
+    for index, probe_result in enumerate(asyncio.as_completed(probes), start=1):
+        name, (state, latency, error) = await probe_result
+        record_probe(name, state, latency, error)
+        results[name] = (state, latency, error)
+        # Telegram throttles edits of one message; batch answers arriving close together.
+        if index == len(probes) or loop.time() - last_edit >= STATUS_EDIT_INTERVAL:
+            try:
+                await message.edit_text(_format_status_overview(all_panels, results),
+                                        parse_mode='Markdown')
+            except BadRequest as e:
+                logger.debug(f"Status overview edit skipped: {e}")
+            last_edit = loop.time()
+
+
 @admin_only
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     panel_name = context.args[0] if context.args else None
@@ -128,20 +195,7 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await update.message.reply_text("未配置任何面板，请使用 /setting 命令进行配置。")
             return
 
-        status_messages = ["**所有面板状态概览:**"]
-        for name, panel_config in all_panels.items():
-            if panel_config.get("disabled", False):
-                status_messages.append(f"- **{name}**: `已禁用`")
-                continue
-            async with XUIApi(panel_config["url"], panel_config["username"], panel_config["password"]) as api:
-                status = await api.get_server_status()
-            if status and 'xray' in status:
-                xray_status = status['xray'].get('state', 'N/A')
-                status_messages.append(f"- **{name}**: {xray_status.capitalize()}")
-            else:
-                status_messages.append(f"- **{name}**: `连接失败`")
-
-        await update.message.reply_text("\n".join(status_messages), parse_mode='Markdown')
+        await _status_overview(update, all_panels)
         return
 
     panel_config = config.get_panel_config(panel_name)
@@ -149,10 +203,15 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text(f"未找到名为 '{panel_name}' 的面板配置。")
         return
 
+    if is_circuit_open(panel_name):
+        row = get_health(panel_name)
+        await update.message.reply_text(
+            f"面板 '{panel_name}' 当前离线 ({row['error']})，将在后台自动重试，请稍后再查看。")
+        return
+
     await update.message.reply_text(f"正在获取 '{panel_name}' 的服务器状态，请稍候...")
 
-    async with XUIApi(panel_config["url"], panel_config["username"], panel_config["password"]) as api:
-        status = await api.get_server_status()
+    status = await get_panel_api(panel_name, panel_config).get_server_status()
     if status and 'cpu' in status and 'mem' in status and 'disk' in status:
         cpu_percent = status.get('cpu', 0)
         mem = status.get('mem', {})
@@ -198,24 +257,20 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text(f"无法获取 '{panel_name}' 的完整服务器状态，请检查面板连接或稍后再试。")
 
 
-from query_logic import query_user_data
+from query_logic import (
+    query_user_data, reset_panel, reset_panel_now, reset_panel_clients, format_client_reset_summary,
+    CLIENT_NOT_ON_PANEL, RESET_SUMMARY_MAX_FAILED,
+)
 
 
 @authorized
 async def query_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = update.effective_user.id
-
-    if user_id in blocked_users:
-        unblock_time = blocked_users[user_id]
-        if datetime.now() < unblock_time:
-            remaining_time = unblock_time - datetime.now()
-            await update.message.reply_text(
-                f"您因查询过于频繁已被暂时封禁，请在 {int(remaining_time.total_seconds() / 60)} 分钟后再试。")
-            return
-        else:
-            del blocked_users[user_id]
-            if user_id in failed_query_attempts:
-                del failed_query_attempts[user_id]
+    limit_key = f"tg:{update.effective_user.id}"
+    remaining = rate_limit.blocked_for(limit_key)
+    if remaining:
+        await update.message.reply_text(
+            f"您因查询过于频繁已被暂时封禁，请在 {int(remaining / 60)} 分钟后再试。")
+        return
 
     if len(context.args) < 2:
         await update.message.reply_text("请提供面板名称和用户名进行查询，格式: /query <面板名> <用户名>")
@@ -231,8 +286,7 @@ async def query_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         pass
 
     if success:
-        if user_id in failed_query_attempts:
-            del failed_query_attempts[user_id]
+        rate_limit.record_success(limit_key)
         accounting_mode = config.get_accounting_mode()
         used_gb = result['used_gb']
         total_gb = result['total_gb']
@@ -257,19 +311,9 @@ async def query_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         await update.message.reply_text(reply_text, parse_mode='Markdown')
     else:
         await update.message.reply_text(result)
-        now = datetime.now()
-        if user_id not in failed_query_attempts:
-            failed_query_attempts[user_id] = []
-        failed_query_attempts[user_id].append(now)
-        five_minutes_ago = now - timedelta(minutes=5)
-        failed_query_attempts[user_id] = [
-            t for t in failed_query_attempts[user_id] if t > five_minutes_ago
-        ]
-        if len(failed_query_attempts[user_id]) >= 5:
-            block_duration = timedelta(hours=2)
-            blocked_users[user_id] = now + block_duration
-            await update.message.reply_text("您因查询不存在的用户过于频繁，已被封禁2小时。")
-            del failed_query_attempts[user_id]
+        if rate_limit.record_failure(limit_key):
+            await update.message.reply_text(
+                f"您因查询不存在的用户过于频繁，已被封禁{rate_limit.format_block_duration()}。")
 
 
 @admin_only
@@ -319,6 +363,8 @@ async def delpanel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         return
     panel_name = context.args[0]
     if config.delete_panel(panel_name):
+        drop_panel_api(panel_name)
+        delete_panel_health(panel_name)
         await update.message.reply_text(f"🗑️ 面板 '{panel_name}' 已被成功删除。")
     else:
         await update.message.reply_text(f"未找到名为 '{panel_name}' 的面板。")
@@ -361,9 +407,68 @@ async def setresetday_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         panel_name, panel_config["url"], panel_config["username"],
         panel_config["password"], reset_day=day
     )
+    _reschedule_resets(context.job_queue)
     await update.message.reply_text(f"✅ 面板 '{panel_name}' 的流量重置日已设为每月{day}号。")
 
 
+def _format_reset_time(due: int, tz: str) -> str:
+    return datetime.fromtimestamp(due, zone(tz)).strftime("%Y-%m-%d %H:%M %Z")
+
+
+@admin_only
+async def setcycle_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Give a client its own monthly billing cycle, or put it back on the panel's."""
+    if len(context.args) not in (3, 4):
+        await update.message.reply_text(
+            "使用格式: /setcycle <面板名> <用户名> <起始日期(YYYY-MM-DD)|expiry|off> [时区]")
+        return
+    panel_name, email, start = context.args[:3]
+    timezone = context.args[3] if len(context.args) == 4 else None
+    if not config.get_panel_config(panel_name):
+        await update.message.reply_text(f"未找到面板 '{panel_name}'。")
+        return
+    if start == "off":
+        if delete_client_cycle(panel_name, email):
+            _reschedule_resets(context.job_queue)
+            await update.message.reply_text(f"✅ 用户 '{email}' 已恢复随面板 '{panel_name}' 一起重置流量。")
+        else:
+            await update.message.reply_text(f"用户 '{email}' 没有单独的计费周期。")
+        return
+    if start != "expiry":
+        try:
+            datetime.strptime(start, "%Y-%m-%d")
+        except ValueError:
+            await update.message.reply_text("起始日期格式应为 YYYY-MM-DD，或使用 expiry 按到期时间重置。")
+            return
+    if timezone and not is_valid_timezone(timezone):
+        await update.message.reply_text(f"未知时区 '{timezone}'，例如 Asia/Shanghai。")
+        return
+    set_client_cycle(panel_name, email, None if start == "expiry" else start, timezone)
+    _reschedule_resets(context.job_queue)
+    due = reset_scheduler.due_at((panel_name, email))
+    if due is None:
+        next_text = "下次重置时间将在获取到该用户的到期时间后确定。"
+    else:
+        next_text = f"下次重置: {_format_reset_time(due, timezone or config.get_reset_timezone())}"
+    await update.message.reply_text(
+        f"✅ 用户 '{email}' 将按自己的计费周期重置流量，不再随面板 '{panel_name}' 一起重置。\n{next_text}")
+
+
+@admin_only
+async def nextresets_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """List the next scheduled panel and client resets."""
+    upcoming = reset_scheduler.upcoming(15)
+    if not upcoming:
+        await update.message.reply_text("当前没有计划中的流量重置。")
+        return
+    lines = ["**⏰ 即将进行的流量重置:**"]
+    for due, (panel_name, email), cycle, attempts in upcoming:
+        target = f"`{email}`" if email else "全部用户"
+        retry = f" (第{attempts + 1}次尝试)" if attempts else ""
+        lines.append(f"- {_format_reset_time(due, cycle.tz)} **{panel_name}**: {target}{retry}")
+    await update.message.reply_text("\n".join(lines), parse_mode='Markdown')
+
+
 @admin_only
 async def resetpanel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Manually reset traffic for a specific panel."""
@@ -378,22 +483,39 @@ async def resetpanel_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await update.message.reply_text(f"正在重置 '{panel_name}' 的流量...")
     initiator = update.effective_user
     init_name = initiator.full_name or initiator.username or str(initiator.id)
-    async with XUIApi(panel_config["url"], panel_config["username"], panel_config["password"]) as api:
-        success = await api.reset_all_client_traffic()
+    ok, result = await reset_panel_now(panel_name)
+    if not ok:
+        await update.message.reply_text(f"❌ {result}")
+        return
+    success, count, error = result[""]
     if success:
-        await update.message.reply_text(f"✅ 面板 '{panel_name}' 流量重置成功！")
+        await update.message.reply_text(f"✅ 面板 '{panel_name}' 流量重置成功！(共 {count} 个用户)")
         msg = f"✅ **{panel_name}**: 流量重置成功！(手动重置，由 {init_name} 触发)"
     else:
-        await update.message.reply_text(f"❌ 面板 '{panel_name}' 流量重置失败！")
-        msg = f"❌ **{panel_name}**: 流量重置失败！(手动重置，由 {init_name} 触发)"
+        await update.message.reply_text(f"❌ 面板 '{panel_name}' 流量重置失败 ({error})！")
+        msg = f"❌ **{panel_name}**: 流量重置失败 ({error})！(手动重置，由 {init_name} 触发)"
     # Broadcast the result to other admins (the issuer already got the reply above)
-    for uid in config.get_admin_users():
-        if uid == update.effective_user.id:
-            continue
-        try:
-            await context.bot.send_message(chat_id=uid, text=msg, parse_mode='Markdown')
-        except Exception as e:
-            logger.error(f"Failed to notify admin {uid}: {e}")
+    send_to_admins(msg, exclude=update.effective_user.id)
+
+
+@admin_only
+async def resetclients_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Reset traffic for a list of clients on one panel."""
+    emails = [e for arg in context.args[1:] for e in arg.split(",") if e]
+    if not emails:
+        await update.message.reply_text("使用格式: /resetclients <面板名> <用户名1> [用户名2 ...]")
+        return
+    panel_name = context.args[0]
+    await update.message.reply_text(f"正在重置 '{panel_name}' 上 {len(emails)} 个用户的流量...")
+    success, result = await reset_panel_clients(panel_name, emails)
+    if not success:
+        await update.message.reply_text(f"❌ {result}")
+        return
+    summary = format_client_reset_summary(panel_name, result)
+    await update.message.reply_text(summary, parse_mode='Markdown')
+    initiator = update.effective_user
+    init_name = initiator.full_name or initiator.username or str(initiator.id)
+    send_to_admins(f"{summary}\n(手动重置，由 {init_name} 触发)", exclude=initiator.id)
 
 
 # --- Settings Conversation ---
@@ -436,6 +558,8 @@ async def set_password(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         connected = await api.login()
     if connected:
         config.add_or_update_panel(name, url, username, password)
+        # The new settings just worked; forget failures recorded against the old ones.
+        delete_panel_health(name)
         await update.message.reply_text(f"✅ 面板 '{name}' 连接成功！配置已保存。")
     else:
         await update.message.reply_text("❌ 连接失败！请检查凭证后使用 /setting 重试。")
@@ -448,28 +572,123 @@ async def cancel_setting(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 
 # --- Scheduled Jobs ---
+async def _snapshot_panel(name: str, pconf: dict, record_date: str,
+                          semaphore: asyncio.Semaphore, timeout: float) -> dict:
+    """Fetch one panel's clients as snapshot rows; never raises."""
+    if is_circuit_open(name):
+        return {"panel": name, "ok": False, "records": [],
+                "error": "panel offline (circuit open), skipped"}
+    async with semaphore:
+        started = datetime.now()
+        try:
+            api = get_panel_api(name, pconf)
+            clients = await asyncio.wait_for(api.get_all_clients(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return {"panel": name, "ok": False, "records": [],
+                    "error": f"timed out after {timeout:.0f}s"}
+        except Exception as e:
+            return {"panel": name, "ok": False, "records": [], "error": str(e)}
+        elapsed = (datetime.now() - started).total_seconds()
+    records = [
+        (name, c["email"], c["up"], c["down"], c["total"], c["expiryTime"], record_date)
+        for c in clients if c["email"]
+    ]
+    return {"panel": name, "ok": True, "records": records, "error": None, "elapsed": elapsed}
+
+
+async def _collect_snapshots(record_date: str) -> tuple:
+    """Poll every enabled panel concurrently; returns (per-panel results, snapshot rows).
+
+    Panels are polled concurrently (bounded by ``snapshot.concurrency``), each
+    under its own ``snapshot.timeout``, so a slow or dead panel cannot hold up
+    the others.
+    """
+    semaphore = asyncio.Semaphore(config.get_snapshot_concurrency())
+    timeout = config.get_snapshot_timeout()
+    results = await asyncio.gather(*(
+        _snapshot_panel(name, pconf, record_date, semaphore, timeout)
+        for name, pconf in config.get_all_panels().items()
+        if not pconf.get("disabled", False)
+    ))
+    records = []
+    for result in results:
+        if result["ok"]:
+            logger.info(f"Snapshot of panel '{result['panel']}': {len(result['records'])} clients "
+                        f"in {result['elapsed']:.1f}s.")
+            records.extend(result["records"])
+        else:
+            logger.error(f"Snapshot of panel '{result['panel']}' failed: {result['error']}")
+    return results, records
+
+
+# Lines listed per rule in one digest; keeps the message under Telegram's 4096 chars.
+ALERT_DIGEST_MAX_LINES = 20
+
+
+def _format_alert_digest(alerts: list, rules: dict) -> str:
+    sections = [
+        ("quota", f"用量达到配额 {rules.get('quota_percent', 0):g}%",
+         lambda a: f"{_format_bytes(a['value'])} / {_format_bytes(a['threshold'])} "
+                   f"({a['value'] / a['threshold'] * 100:.0f}%)"),
+        ("spike", f"用量突增 (超过 7 日均值 {rules.get('spike_factor', 0):g} 倍)",
+         lambda a: f"当日 {_format_bytes(a['value'])}，日均 {_format_bytes(a['threshold'])}"),
+        ("expiry", f"即将到期 ({rules.get('expiry_days', 0)} 天内)",
+         lambda a: datetime.fromtimestamp(a['value'] / 1000, SCHEDULE_TIMEZONE).strftime('%Y-%m-%d') + " 到期"),
+    ]
+    lines = [f"🔔 **流量告警汇总** (共 {len(alerts)} 条)"]
+    for rule, title, detail in sections:
+        hits = [a for a in alerts if a["rule"] == rule]
+        if not hits:
+            continue
+        lines.append(f"\n**{title}**")
+        for a in hits[:ALERT_DIGEST_MAX_LINES]:
+            lines.append(f"- {a['panel_name']} / `{a['email']}`: {detail(a)}")
+        if len(hits) > ALERT_DIGEST_MAX_LINES:
+            lines.append(f"- ...以及另外 {len(hits) - ALERT_DIGEST_MAX_LINES} 条")
+    return "\n".join(lines)
+
+
+def _send_alert_digest(alerts: list) -> None:
+    """Send all alerts of one snapshot to every admin as a single message."""
+    if not alerts:
+        return
+    logger.info(f"Sending alert digest with {len(alerts)} alerts.")
+    send_to_admins(_format_alert_digest(alerts, config.get_alert_rules() or {}))
+
+
 async def record_traffic_job(context: ContextTypes.DEFAULT_TYPE):
     """Daily job: snapshot all panels' client traffic into the database."""
     logger.info("Running scheduled job: record_traffic_job")
-    all_panels = config.get_all_panels()
-    if not all_panels:
+    if not config.get_all_panels():
         logger.warning("record_traffic_job skipped: no panels configured.")
-        return
+        return []
+    # Fix the date before fanning out so late panels still land on the same day.
     today = datetime.now(SCHEDULE_TIMEZONE).strftime("%Y-%m-%d")
-    records = []
-    for name, pconf in all_panels.items():
-        if pconf.get("disabled", False):
-            continue
-        async with XUIApi(pconf["url"], pconf["username"], pconf["password"]) as api:
-            clients = await api.get_all_clients()
-        for c in clients:
-            if not c["email"]:
-                continue
-            records.append((name, c["email"], c["up"], c["down"],
-                            c["total"], c["expiryTime"], today))
-    batch_record_traffic(records)
+    results, records = await _collect_snapshots(today)
+    alerts = batch_record_traffic(records, config.get_alert_rules())
+    _send_alert_digest(alerts)
     cleanup_old_traffic()
-    logger.info(f"Recorded {len(records)} traffic entries for {today}.")
+    failed = sum(1 for r in results if not r["ok"])
+    logger.info(f"Recorded {len(records)} traffic entries for {today} "
+                f"({len(results) - failed} panels ok, {failed} failed).")
+    return results
+
+
+async def sample_traffic_job(context: ContextTypes.DEFAULT_TYPE):
+    """Intraday job: store a traffic sample and refresh today's daily snapshot.
+
+    Keeping the daily tier current means a failed 23:50 run no longer loses the
+    day: the last successful sample already holds that day's counters.
+    """
+    if not config.get_all_panels():
+        return []
+    now = datetime.now(SCHEDULE_TIMEZONE)
+    results, records = await _collect_snapshots(now.strftime("%Y-%m-%d"))
+    record_traffic_samples([(r[0], r[1], r[2], r[3]) for r in records], int(now.timestamp()))
+    alerts = batch_record_traffic(records, config.get_alert_rules())
+    _send_alert_digest(alerts)
+    downsample_traffic_samples(config.get_sampling_raw_hours(), config.get_sampling_hourly_days())
+    return results
 
 
 def _format_daily_report_text(report_date: str, stats: list,
@@ -544,13 +763,7 @@ async def daily_report_job(context: ContextTypes.DEFAULT_TYPE):
         logger.info("Daily report is disabled, skipping.")
         return
 
-    report_text = await _generate_daily_report_text()
-    admin_users = config.get_admin_users()
-    for uid in admin_users:
-        try:
-            await context.bot.send_message(chat_id=uid, text=report_text, parse_mode='Markdown')
-        except Exception as e:
-            logger.error(f"Failed to send report to {uid}: {e}")
+    send_to_admins(await _generate_daily_report_text())
 
 
 @admin_only
@@ -561,64 +774,176 @@ async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 
 async def check_inbounds_job(context: ContextTypes.DEFAULT_TYPE):
-    """Check for expiring inbounds and panel status."""
+    """Check for expiring inbounds."""
     logger.info("Running scheduled job: check_inbounds_job")
     all_panels = config.get_all_panels()
     if not all_panels:
         logger.warning("Job skipped: No panels are configured.")
         return
-    admin_users = config.get_admin_users()
     for name, pconf in all_panels.items():
         if pconf.get("disabled", False):
             continue
-        async with XUIApi(pconf["url"], pconf["username"], pconf["password"]) as api:
-            if not await api.login():
-                logger.error(f"Panel '{name}' connection failed. Sending alert.")
-                for uid in admin_users:
-                    await context.bot.send_message(chat_id=uid, text=f"🚨 **面板 '{name}' 离线告警**", parse_mode='Markdown')
-                continue
-            inbounds_data = await api.get_inbounds()
-        if inbounds_data and inbounds_data.get("success"):
+        # Offline alerts come from health_check_job, once per outage.
+        if is_circuit_open(name):
+            continue
+        inbounds_data = await get_panel_api(name, pconf).get_inbounds()
+        if inbounds_data is None:
+            logger.error(f"Panel '{name}' connection failed.")
+            continue
+        if inbounds_data.get("success"):
             three_days_later = (datetime.now(SCHEDULE_TIMEZONE) + timedelta(days=3)).timestamp() * 1000
             for inbound in inbounds_data.get("obj", []):
                 expiry_ts = inbound.get("expiryTime", 0)
                 if 0 < expiry_ts < three_days_later:
                     expiry_date = datetime.fromtimestamp(expiry_ts / 1000, SCHEDULE_TIMEZONE).strftime('%Y-%m-%d')
                     message = f"🔔 **入站到期提醒 ({name})** 🔔\n- 备注: {inbound.get('remark', 'N/A')}\n- 将于: {expiry_date} 到期"
-                    for uid in admin_users:
-                        await context.bot.send_message(chat_id=uid, text=message, parse_mode='Markdown')
+                    send_to_admins(message)
 
 
-async def traffic_reset_job(context: ContextTypes.DEFAULT_TYPE):
-    """Check each panel individually for its reset day and reset if needed."""
-    logger.info("Running scheduled job: traffic_reset_job")
+async def health_check_job(context: ContextTypes.DEFAULT_TYPE):
+    """Probe panels in the background and alert admins when one goes down or recovers."""
     all_panels = config.get_all_panels()
     if not all_panels:
-        return
-    admin_users = config.get_admin_users()
-    today = datetime.now(SCHEDULE_TIMEZONE)
-    for name, pconf in all_panels.items():
-        if pconf.get("disabled", False):
-            continue
-        reset_day = config.get_panel_reset_day(name)
-        if reset_day is None:
-            # global monthly reset check
-            if not config.is_monthly_reset_enabled():
-                continue
-            reset_day = 1
-        if today.day != reset_day:
+        return []
+    checked = await check_panels(all_panels, config.get_health_timeout())
+    for name, was_down, is_down, error in checked:
+        if is_down and not was_down:
+            logger.error(f"Panel '{name}' is offline: {error}")
+            text = f"🚨 **面板 '{name}' 离线告警**\n- 原因: {error}"
+        elif was_down and not is_down:
+            logger.info(f"Panel '{name}' is back online.")
+            text = f"✅ **面板 '{name}' 已恢复在线**"
+        else:
             continue
-        logger.info(f"Resetting traffic for panel '{name}' on day {reset_day}.")
-        async with XUIApi(pconf["url"], pconf["username"], pconf["password"]) as api:
-            reset_success = await api.reset_all_client_traffic()
-        if reset_success:
-            msg = f"✅ **{name}**: 流量重置成功！(重置日: {reset_day}号)"
+        send_to_admins(text)
+    return checked
+
+
+async def deliver_outbox_job(context: ContextTypes.DEFAULT_TYPE):
+    """Hand notifications queued by the web app to the bot's message queue."""
+    notifications = take_notifications()
+    for n in notifications:
+        if n["chat_id"] is None:
+            send_to_admins(n["text"], n["parse_mode"])
+        else:
+            message_queue.send(n["chat_id"], n["text"], n["parse_mode"])
+    return len(notifications)
+
+
+reset_scheduler = ResetScheduler()
+
+
+def _arm_reset_job(job_queue) -> None:
+    """Set the reset timer for the earliest due reset, replacing the previous one."""
+    for job in job_queue.get_jobs_by_name(RESET_JOB_NAME):
+        job.schedule_removal()
+    due = reset_scheduler.next_due()
+    if due is not None:
+        delay = max(0.0, due - datetime.now().timestamp())
+        job_queue.run_once(traffic_reset_job, when=delay, name=RESET_JOB_NAME)
+
+
+def _reschedule_resets(job_queue) -> None:
+    reset_scheduler.sync()
+    if job_queue:
+        _arm_reset_job(job_queue)
+
+
+async def reset_schedule_sync_job(context: ContextTypes.DEFAULT_TYPE):
+    """Reload reset days and client cycles; the first run catches up missed resets."""
+    _reschedule_resets(context.job_queue)
+
+
+def _finish_panel_resets(name: str, started: int, outcome: dict) -> str:
+    """Log one attempt's results, schedule retries or next cycles; returns the admin message."""
+    finished = int(datetime.now().timestamp())
+    tz = config.get_reset_timezone()
+    log_rows, done, lines = [], [], []
+    reset_clients, retrying, given_up = [], [], []
+    for email, (success, count, error) in outcome.items():
+        key = (name, email)
+        due_at, attempt = reset_scheduler.attempt(key)
+        log_rows.append((name, email, due_at, attempt, started, finished, success, count, error))
+        if success or error == CLIENT_NOT_ON_PANEL:
+            done.append(key)
+            retry_at = None
+        else:
+            retry_at = reset_scheduler.fail(key, finished)
+        tried = f"(第{attempt}次尝试)" if attempt > 1 else ""
+        if email and success:
+            reset_clients.append(email)
+        elif email:
+            if retry_at is None:
+                given_up.append(email)
+            elif attempt == 1:
+                retrying.append(email)
+        elif success:
+            reset_day = config.get_panel_reset_day(name) or 1
+            lines.append(f"✅ **{name}**: 流量重置成功！(重置日: {reset_day}号){tried}")
             logger.info(f"Successfully reset traffic for panel: {name}")
+        elif retry_at is None:
+            lines.append(f"❌ **{name}**: 流量重置失败 ({error})，已尝试 {attempt} 次，本周期不再重试！")
+            logger.error(f"Gave up resetting traffic for panel '{name}' after {attempt} attempts: {error}")
         else:
-            msg = f"❌ **{name}**: 流量重置失败！"
-            logger.error(f"Failed to reset traffic for panel: {name}")
-        for uid in admin_users:
-            await context.bot.send_message(chat_id=uid, text=msg, parse_mode='Markdown')
+            if attempt == 1:
+                lines.append(f"❌ **{name}**: 流量重置失败 ({error})，"
+                             f"将于 {_format_reset_time(retry_at, tz)} 重试。")
+            logger.error(f"Failed to reset traffic for panel '{name}' (attempt {attempt}): {error}")
+    reset_scheduler.complete(done, finished)
+    record_reset_attempts(log_rows)
+
+    def listed(emails):
+        shown = ", ".join(f"`{email}`" for email in emails[:RESET_SUMMARY_MAX_FAILED])
+        more = len(emails) - RESET_SUMMARY_MAX_FAILED
+        return shown + (f" 等 {len(emails)} 个" if more > 0 else "")
+
+    if reset_clients:
+        lines.append(f"✅ **{name}**: {len(reset_clients)} 个用户的计费周期流量已重置。")
+    if retrying:
+        lines.append(f"⚠️ **{name}**: {len(retrying)} 个用户重置失败，稍后重试: {listed(retrying)}")
+    if given_up:
+        lines.append(f"❌ **{name}**: {len(given_up)} 个用户的计费周期重置失败，已放弃: {listed(given_up)}")
+        logger.error(f"Gave up client resets on panel '{name}': {given_up}")
+    return "\n".join(lines)
+
+
+async def traffic_reset_job(context: ContextTypes.DEFAULT_TYPE):
+    """Run the due panel and client resets, then wait for the next due or retry time.
+
+    Panels are reset concurrently, at most ``reset.panel_concurrency`` at a
+    time; each failed reset is rescheduled with backoff rather than retried
+    in place, so no run holds up the resets that come due after it.
+    """
+    logger.info("Running scheduled job: traffic_reset_job")
+    reset_scheduler.sync()
+    keys = reset_scheduler.pop_due()
+    record_date = datetime.now(SCHEDULE_TIMEZONE).strftime("%Y-%m-%d")
+    semaphore = asyncio.Semaphore(config.get_reset_panel_concurrency())
+
+    async def run(name: str, whole_panel: bool, emails: list):
+        async with semaphore:
+            started = int(datetime.now().timestamp())
+            try:
+                outcome = await reset_panel(name, whole_panel, emails, record_date)
+            except Exception as e:
+                logger.error(f"Traffic reset of panel '{name}' failed: {e}")
+                outcome = {key: (False, 0, str(e)) for key in ([""] if whole_panel else []) + emails}
+            return name, started, outcome
+
+    try:
+        runs = await asyncio.gather(*(run(name, whole_panel, emails)
+                                      for name, (whole_panel, emails) in group_by_panel(keys).items()))
+        for name, started, outcome in runs:
+            message = _finish_panel_resets(name, started, outcome)
+            if message:
+                send_to_admins(message)
+    finally:
+        unfinished = reset_scheduler.fail_unfinished(keys)
+        if unfinished:
+            logger.error(f"Traffic resets interrupted, retrying later: {unfinished}")
+        if context is not None and context.job_queue:
+            _arm_reset_job(context.job_queue)
+    return keys
 
 
 async def post_init(application: Application) -> None:
@@ -635,14 +960,27 @@ async def post_init(application: Application) -> None:
         BotCommand("listusers", "👥 列出所有用户 (管理员)"),
         BotCommand("setresetday", "🔧 设置面板重置日 (管理员)"),
         BotCommand("resetpanel", "⚡️ 重置面板流量 (管理员)"),
+        BotCommand("resetclients", "🔄 重置指定用户流量 (管理员)"),
+        BotCommand("setcycle", "📅 设置用户计费周期 (管理员)"),
+        BotCommand("nextresets", "⏰ 查看即将进行的流量重置 (管理员)"),
         BotCommand("report", "📈 发送今日日报 (管理员)"),
     ]
     await application.bot.set_my_commands(commands)
+    message_queue.start(application.bot)
+
+
+async def post_shutdown(application: Application) -> None:
+    await message_queue.stop()
+    await close_all_panel_apis()
 
 
 def run_web_app():
     logger.info("Starting web application with Gunicorn...")
-    command = ["gunicorn", "--workers", "2", "--timeout", "120", "--bind", "0.0.0.0:5000", "webapp:app"]
+    # gthread is gunicorn's threaded sync worker: each request holds one of the
+    # web.threads threads while its panel calls run on the worker's shared loop.
+    command =["gunicorn", "--workers", "2", "--worker-class", "gthread",
+               "--threads", str(config.get_web_threads()),
+               "--timeout", "120", "--bind", "0.0.0.0:5000", "webapp:app"]
     try:
         subprocess.Popen(command)
         logger.info("Web application started successfully.")
@@ -656,19 +994,31 @@ def main() -> None:
     if not bot_token or bot_token == "YOUR_TELEGRAM_BOT_TOKEN":
         logger.error("Bot token not configured in config.yml.")
         return
+    # Only the bot compacts the database after a migration; web workers never do.
+    run_pending_maintenance()
 
     application = Application.builder().token(bot_token).build()
     application.post_init = post_init
+    application.post_shutdown = post_shutdown
 
     run_web_app()
 
     job_queue = application.job_queue
     if job_queue:
+        job_queue.run_repeating(health_check_job, interval=timedelta(seconds=config.get_health_interval()),
+                                first=timedelta(seconds=5))
+        job_queue.run_repeating(deliver_outbox_job, interval=timedelta(seconds=OUTBOX_POLL_INTERVAL),
+                                first=timedelta(seconds=1))
         job_queue.run_repeating(check_inbounds_job, interval=timedelta(hours=6), first=timedelta(seconds=10))
         job_queue.run_daily(record_traffic_job, time=_scheduled_time(23, 50))
+        sampling_interval = config.get_sampling_interval()
+        if sampling_interval:
+            job_queue.run_repeating(sample_traffic_job, interval=timedelta(minutes=sampling_interval),
+                                    first=timedelta(minutes=1))
         report_hour = config.get_daily_report_hour()
         job_queue.run_daily(daily_report_job, time=_scheduled_time(report_hour))
-        job_queue.run_daily(traffic_reset_job, time=_scheduled_time(0, 5))
+        job_queue.run_repeating(reset_schedule_sync_job, interval=timedelta(seconds=RESET_SYNC_INTERVAL),
+                                first=timedelta(seconds=15))
     else:
         logger.warning("JobQueue not initialized.")
 
@@ -694,6 +1044,9 @@ def main() -> None:
     application.add_handler(CommandHandler("listpanels", listpanels_command))
     application.add_handler(CommandHandler("setresetday", setresetday_command))
     application.add_handler(CommandHandler("resetpanel", resetpanel_command))
+    application.add_handler(CommandHandler("resetclients", resetclients_command))
+    application.add_handler(CommandHandler("setcycle", setcycle_command))
+    application.add_handler(CommandHandler("nextresets", nextresets_command))
     application.add_handler(CommandHandler("report", report_command))
 
     logger.info("Bot is running...")
@@ -0,0 +1,197 @@
+# message_queue.py
+"""Outbound Telegram message queue for the bot process.
+
+Jobs and handlers queue notifications with send() / send_to_admins() and move
+on; one worker task delivers them.  Messages waiting for the same chat are
+merged into one (up to Telegram's 4096 character limit), sends are spaced per
+chat and globally to stay under the flood limits, a 429 pauses delivery for
+the retry-after Telegram asks for, and network errors are retried with
+exponential backoff.
+"""
+import asyncio
+import logging
+from collections import deque
+from datetime import timedelta
+from typing import Deque, Dict, Optional, Tuple
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+import config
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+MERGE_SEPARATOR = "\n\n"
+
+
+class MessageQueue:
+    def __init__(self, bot, per_chat_interval: float = 1.0, global_rate: float = 25.0,
+                 max_attempts: int = 5, base_backoff: float = 1.0):
+        self._bot = bot
+        self._per_chat_interval = per_chat_interval
+        self._global_interval = 1.0 / global_rate
+        self._max_attempts = max_attempts
+        self._base_backoff = base_backoff
+        self._pending: Dict[int, Deque[Tuple[str, Optional[str]]]] = {}
+        self._attempts: Dict[int, int] = {}
+        self._chat_ready_at: Dict[int, float] = {}
+        self._global_ready_at = 0.0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.dropped = 0
+
+    def put(self, chat_id: int, text: str, parse_mode: Optional[str] = "Markdown") -> None:
+        """Queue a message; never blocks."""
+        self._pending.setdefault(chat_id, deque()).append((text, parse_mode))
+        self._wakeup.set()
+
+    def pending(self) -> int:
+        return sum(len(q) for q in self._pending.values())
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Give queued messages up to ``timeout`` seconds to go out, then stop."""
+        if self._task is None:
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._pending and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._pending:
+            logger.warning(f"Message queue stopped with {self.pending()} undelivered messages.")
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            chat_id, wait = self._next_ready(loop.time())
+            if chat_id is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._send_next(chat_id, loop)
+            except Exception as e:
+                # Never let one message kill the worker.
+                logger.error(f"Message queue: unexpected error for chat {chat_id}: {e}")
+                if chat_id in self._pending:
+                    self._drop(chat_id, self._merge(chat_id)[2])
+
+    def _next_ready(self, now: float) -> Tuple[Optional[int], Optional[float]]:
+        """The chat to serve now, or (None, seconds until one is due)."""
+        best, best_at = None, None
+        for chat_id in self._pending:
+            at = max(self._chat_ready_at.get(chat_id, 0.0), self._global_ready_at)
+            if best_at is None or at < best_at:
+                best, best_at = chat_id, at
+        if best is None:
+            return None, None
+        if best_at <= now:
+            return best, None
+        return None, best_at - now
+
+    def _merge(self, chat_id: int) -> Tuple[str, Optional[str], int]:
+        """Join the chat's leading messages that share a parse mode and fit in one message."""
+        queue = self._pending[chat_id]
+        text, parse_mode = queue[0]
+        count = 1
+        for next_text, next_mode in list(queue)[1:]:
+            merged = text + MERGE_SEPARATOR + next_text
+            if next_mode != parse_mode or len(merged) > MAX_MESSAGE_LENGTH:
+                break
+            text, count = merged, count + 1
+        return text, parse_mode, count
+
+    def _drop(self, chat_id: int, count: int) -> None:
+        queue = self._pending.get(chat_id)
+        for _ in range(min(count, len(queue or ()))):
+            queue.popleft()
+        if queue is not None and not queue:
+            del self._pending[chat_id]
+        self._attempts.pop(chat_id, None)
+
+    async def _send_next(self, chat_id: int, loop: asyncio.AbstractEventLoop) -> None:
+        text, parse_mode, count = self._merge(chat_id)
+        try:
+            await self._bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+        except RetryAfter as e:
+            delay = e.retry_after
+            if isinstance(delay, timedelta):
+                delay = delay.total_seconds()
+            logger.warning(f"Telegram flood limit hit, pausing sends for {delay}s.")
+            # Flood control applies to the whole bot, not just this chat.
+            self._global_ready_at = loop.time() + float(delay)
+            return
+        except (BadRequest, Forbidden) as e:
+            logger.error(f"Message queue: dropping {count} message(s) to {chat_id}: {e}")
+            self.dropped += count
+            self._drop(chat_id, count)
+            return
+        except NetworkError as e:
+            attempts = self._attempts.get(chat_id, 0) + 1
+            if attempts >= self._max_attempts:
+                logger.error(f"Message queue: giving up on {count} message(s) to {chat_id} "
+                             f"after {attempts} attempts: {e}")
+                self.dropped += count
+                self._drop(chat_id, count)
+                return
+            self._attempts[chat_id] = attempts
+            self._chat_ready_at[chat_id] = loop.time() + self._base_backoff * 2 ** (attempts - 1)
+            return
+        except TelegramError as e:
+            logger.error(f"Message queue: dropping {count} message(s) to {chat_id}: {e}")
+            self.dropped += count
+            self._drop(chat_id, count)
+            return
+        self.sent += count
+        self._drop(chat_id, count)
+        now = loop.time()
+        self._chat_ready_at[chat_id] = now + self._per_chat_interval
+        self._global_ready_at = max(self._global_ready_at, now + self._global_interval)
+
+
+_queue: Optional[MessageQueue] = None
+
+
+def start(bot) -> MessageQueue:
+    """Create and start the process-wide queue; called from the bot's post_init."""
+    global _queue
+    _queue = MessageQueue(
+        bot,
+        per_chat_interval=config.get_send_per_chat_interval(),
+        global_rate=config.get_send_global_rate(),
+    )
+    _queue.start()
+    return _queue
+
+
+async def stop() -> None:
+    global _queue
+    if _queue is not None:
+        await _queue.stop()
+        _queue = None
+
+
+def send(chat_id: int, text: str, parse_mode: Optional[str] = "Markdown") -> None:
+    if _queue is None:
+        raise RuntimeError("message queue is not running")
+    _queue.put(chat_id, text, parse_mode)
+
+
+def send_to_admins(text: str, parse_mode: Optional[str] = "Markdown",
+                   exclude: Optional[int] = None) -> None:
+    for uid in config.get_admin_users():
+        if uid != exclude:
+            send(uid, text, parse_mode)
@@ -1,32 +1,19 @@
-import httpx
 import logging
 
-import config
+from database import enqueue_notification
 
 logger = logging.getLogger(__name__)
 
 
 def notify_admins(message: str, parse_mode: str = "Markdown") -> None:
-    """Send a Telegram message to all admin users via the Bot API (sync).
+    """Queue a Telegram message to all admin users; returns immediately.
 
-    Used by the Flask webapp to broadcast notifications that originate outside
-    the bot's own event loop.
+    Used by the Flask webapp, which runs outside the bot's event loop.  The
+    message goes into the notification_outbox table and the bot process
+    delivers it through its message queue, so a web request never waits on
+    Telegram and nothing is lost if the bot is restarting.
     """
-    bot_token = config.get_bot_token()
-    admin_users = config.get_admin_users()
-    if not bot_token or bot_token == "YOUR_TELEGRAM_BOT_TOKEN":
-        logger.warning("notify_admins: bot token not configured, skipping.")
-        return
-    if not admin_users:
-        return
-    api_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    with httpx.Client(timeout=15) as client:
-        for uid in admin_users:
-            try:
-                client.post(api_url, json={
-                    "chat_id": uid,
-                    "text": message,
-                    "parse_mode": parse_mode,
-                })
-            except Exception as e:
-                logger.error(f"notify_admins: failed to notify admin {uid}: {e}")
+    try:
+        enqueue_notification(message, parse_mode)
+    except Exception as e:
+        logger.error(f"notify_admins: failed to queue notification: {e}")
@@ -1,7 +1,14 @@
 # query_logic.py
+import logging
+import time
 from datetime import datetime
 import config
-from xui_api import XUIApi
+from xui_api import build_client_index, get_panel_api
+from health import is_circuit_open
+from database import record_reset_attempts, record_reset_carry
+from reset_schedule import own_cycle_emails
+
+logger = logging.getLogger(__name__)
 
 async def query_user_data(panel_name: str, email: str) -> (bool, dict or str):
     """
@@ -19,33 +26,23 @@ async def query_user_data(panel_name: str, email: str) -> (bool, dict or str):
     if panel_config.get("disabled", False):
         return False, f"面板 '{panel_name}' 已被禁用，无法查询。"
 
-    async with XUIApi(panel_config["url"], panel_config["username"], panel_config["password"]) as api:
-        inbounds_data = await api.get_inbounds()
-    if not inbounds_data or not inbounds_data.get("success"):
+    if is_circuit_open(panel_name):
+        return False, f"面板 '{panel_name}' 暂时无法连接，请稍后再试。"
+
+    api = get_panel_api(panel_name, panel_config)
+    index = await api.get_client_index_cached(config.get_query_cache_ttl())
+    if index is None:
         return False, "无法从面板获取数据，请稍后再试或联系管理员。"
 
-    found_inbound = None
-    for inbound in inbounds_data.get("obj", []):
-        clients = inbound.get("clientStats", [])
-        for client in clients:
-            if client.get("email") == email:
-                found_inbound = client
-                found_inbound.update({
-                    'total': client.get('total', inbound.get('total', 0)),
-                    'expiryTime': client.get('expiryTime', inbound.get('expiryTime', 0))
-                })
-                break
-        if found_inbound:
-            break
-
-    if found_inbound:
-        used_bytes = found_inbound.get("up", 0) + found_inbound.get("down", 0)
-        total_bytes = found_inbound.get("total", 0)
+    client = index.get(email)
+    if client is not None:
+        used_bytes = client.up + client.down
+        total_bytes = client.total
         
         used_gb = used_bytes / (1024**3)
         total_gb = total_bytes / (1024**3)
         
-        expiry_ts = found_inbound.get("expiryTime", 0)
+        expiry_ts = client.expiry_time
         expiry_date = datetime.fromtimestamp(expiry_ts / 1000).strftime('%Y-%m-%d') if expiry_ts > 0 else "永不过期"
 
         return True, {
@@ -57,3 +54,123 @@ async def query_user_data(panel_name: str, email: str) -> (bool, dict or str):
         }
     else:
         return False, f"在 '{panel_name}' 上未找到用户名为 '{email}' 的节点。"
+
+
+# Error of a client reset that cannot succeed on a retry.
+CLIENT_NOT_ON_PANEL = "用户不在面板上"
+# Error of every reset of a panel whose inbound list could not be read.
+PANEL_UNREACHABLE = "无法获取面板数据"
+
+
+async def reset_panel(name: str, whole_panel: bool, emails: list, record_date: str) -> dict:
+    """Reset a panel and/or some clients; returns {email or '': (success, clients reset, error)}.
+
+    Used by the scheduled and the manual resets alike.  A whole-panel reset
+    skips the clients that have their own billing cycle.
+
+    The counters are read right before the reset, from the same inbound list
+    the resets resolve inbound ids from, and kept for every client that was
+    reset (record_reset_carry) so the day's usage survives the counter drop.
+    """
+    keys = ([""] if whole_panel else []) + emails
+    if is_circuit_open(name):
+        return {key: (False, 0, "面板离线") for key in keys}
+    api = get_panel_api(name, config.get_panel_config(name))
+    inbounds = await api.get_inbounds()
+    if inbounds is None:
+        return {key: (False, 0, PANEL_UNREACHABLE) for key in keys}
+    index = build_client_index(inbounds)
+    outcome = {email: (False, 0, CLIENT_NOT_ON_PANEL) for email in emails if email not in index}
+    targets = [email for email in emails if email in index]
+    own_cycle = own_cycle_emails(name) if whole_panel else set()
+    panel_targets = [email for email in index if email not in own_cycle] if whole_panel else []
+    # Own-cycle clients that are not due themselves keep their counters.
+    keep = own_cycle.difference(targets)
+    if whole_panel and not keep:
+        logger.info(f"Resetting traffic for panel '{name}'.")
+        success = await api.reset_all_client_traffic()
+        reset = {email: success for email in index}
+    else:
+        # Inbounds without a kept client are still reset with one call each.
+        logger.info(f"Resetting {len(panel_targets) + len(targets)} clients on panel '{name}'.")
+        reset = await api.reset_clients_traffic(None if whole_panel else targets,
+                                                config.get_reset_concurrency(),
+                                                exclude=keep, inbounds=inbounds)
+        if reset is None:
+            return {key: (False, 0, PANEL_UNREACHABLE) for key in keys}
+    record_reset_carry([(name, email, stat.up, stat.down, stat.total, stat.expiry_time, record_date)
+                        for email, stat in index.items() if reset.get(email)])
+    if whole_panel:
+        failed = sum(1 for email in panel_targets if not reset.get(email))
+        outcome[""] = (not failed, len(panel_targets) - failed,
+                       f"{failed} 个用户重置失败" if failed else None)
+    for email in targets:
+        outcome[email] = (reset[email], int(reset[email]), None if reset[email] else "重置失败")
+    return outcome
+
+
+def record_manual_reset(panel_name: str, started: int, outcome: dict) -> None:
+    """Log a manual reset in reset_log, as the first attempt of a reset due when it started."""
+    finished = int(time.time())
+    record_reset_attempts([(panel_name, email, started, 1, started, finished, success, count, error)
+                           for email, (success, count, error) in outcome.items()])
+
+
+async def reset_panel_now(panel_name: str, emails: list = None) -> (bool, dict or str):
+    """
+    手动重置流量: emails 为 None 时重置整个面板 (跳过有独立计费周期的用户), 否则只重置这些用户.
+
+    与定时重置一样, 重置前的流量会计入当天用量, 并记录到 reset_log.
+
+    :return: 一个元组 (success, result).
+             成功时 result 是 reset_panel() 的 {email 或 '': (是否成功, 重置用户数, 错误)} 字典.
+             失败时 result 是一个错误信息字符串.
+    """
+    panel_config = config.get_panel_config(panel_name)
+    if not panel_config:
+        return False, f"未找到名为 '{panel_name}' 的面板配置。"
+    if panel_config.get("disabled", False):
+        return False, f"面板 '{panel_name}' 已被禁用。"
+    if is_circuit_open(panel_name):
+        return False, f"面板 '{panel_name}' 当前离线，请稍后再试。"
+
+    started = int(time.time())
+    record_date = datetime.now(config.SCHEDULE_TIMEZONE).strftime("%Y-%m-%d")
+    outcome = await reset_panel(panel_name, emails is None, list(dict.fromkeys(emails or [])),
+                                record_date)
+    record_manual_reset(panel_name, started, outcome)
+    if any(error == PANEL_UNREACHABLE for _, _, error in outcome.values()):
+        return False, "无法从面板获取数据，请稍后再试或联系管理员。"
+    return True, outcome
+
+
+async def reset_panel_clients(panel_name: str, emails: list) -> (bool, dict or str):
+    """
+    批量重置指定用户的流量 (经 reset_panel_now, 同样计入当天用量并记录到 reset_log).
+
+    :param panel_name: 面板名称
+    :param emails: 用户 email 列表
+    :return: 一个元组 (success, result).
+             成功时 result 是 {email: 是否重置成功} 字典.
+             失败时 result 是一个错误信息字符串.
+    """
+    success, outcome = await reset_panel_now(panel_name, emails)
+    if not success:
+        return False, outcome
+    return True, {email: outcome[email][0] for email in dict.fromkeys(emails)}
+
+
+# Failed emails listed in a reset summary; the rest are only counted.
+RESET_SUMMARY_MAX_FAILED = 20
+
+
+def format_client_reset_summary(panel_name: str, results: dict) -> str:
+    """Markdown summary of a bulk client reset for Telegram."""
+    failed = [email for email, ok in results.items() if not ok]
+    lines = [f"**{panel_name}**: 已重置 {len(results) - len(failed)}/{len(results)} 个用户的流量。"]
+    if failed:
+        lines.append(f"❌ 重置失败 ({len(failed)}):")
+        lines += [f"- `{email}`" for email in failed[:RESET_SUMMARY_MAX_FAILED]]
+        if len(failed) > RESET_SUMMARY_MAX_FAILED:
+            lines.append(f"...以及另外 {len(failed) - RESET_SUMMARY_MAX_FAILED} 个")
+    return "\n".join(lines)
@@ -0,0 +1,53 @@
+# rate_limit.py
+"""Failed-query limiter shared by the bot and the web workers.
+
+State lives in the rate_limits table, so a user or IP gets the same budget
+no matter which process serves it, and entries expire on their own.  Keys
+are namespaced by source, e.g. "tg:<user id>" or "ip:<address>".
+"""
+import time
+from typing import Optional
+
+import config
+from database import add_rate_limit_failure, clear_rate_limit, get_rate_limit
+
+
+def _now() -> float:
+    return time.time()
+
+
+def format_block_duration() -> str:
+    """The configured ban length for user-facing messages, e.g. '2小时'."""
+    minutes = int(config.get_rate_limit_block() // 60)
+    if minutes and minutes % 60 == 0:
+        return f"{minutes // 60}小时"
+    return f"{max(1, minutes)}分钟"
+
+
+def blocked_for(key: str, now: Optional[float] = None) -> int:
+    """Seconds left on the key's ban, 0 if it may query."""
+    now = now if now is not None else _now()
+    row = get_rate_limit(key, now)
+    if not row or row["blocked_until"] <= now:
+        return 0
+    return int(row["blocked_until"] - now)
+
+
+def record_failure(key: str, now: Optional[float] = None) -> bool:
+    """Count a failed query; True if it got the key banned."""
+    now = now if now is not None else _now()
+    blocked_until = add_rate_limit_failure(
+        key,
+        config.get_rate_limit_max_failures(),
+        config.get_rate_limit_window(),
+        config.get_rate_limit_block(),
+        now,
+    )
+    return blocked_until > now
+
+
+def record_success(key: str, now: Optional[float] = None) -> None:
+    now = now if now is not None else _now()
+    # Most keys have no failures on record; skip the write for them.
+    if get_rate_limit(key, now):
+        clear_rate_limit(key, now)
@@ -0,0 +1,289 @@
+# reset_schedule.py
+"""Billing-cycle traffic resets, kept in a priority queue of due times.
+
+A panel with a reset day (or, without one, the global monthly reset) resets
+all its clients once a month at 00:05 in the panel's time zone.  Clients in
+the client_cycles table reset on their own day instead: the day of their
+cycle start date, or the day and time of their expiryTime.
+
+Due times sit in a heap, so the bot only wakes when the earliest reset is
+due, and in the reset_schedule table, so a reset whose time passed while
+the bot was down runs once on the next start.  A failed reset is retried
+after ``reset.retry_interval``, doubling up to ``reset.retry_max_interval``,
+until ``reset.retry_deadline`` after its due time; then it waits for the
+next cycle.
+"""
+import heapq
+import logging
+import time
+from calendar import monthrange
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import config
+from database import (
+    delete_reset_schedule, get_client_cycles, get_reset_schedule, save_reset_schedule,
+)
+
+logger = logging.getLogger(__name__)
+
+# (panel_name, email); email "" is a reset of the whole panel.
+Key = Tuple[str, str]
+
+# Local time of day panel-wide resets run at.
+PANEL_RESET_HOUR, PANEL_RESET_MINUTE = 0, 5
+
+
+class Cycle(NamedTuple):
+    """A monthly reset on ``day`` at hour:minute, local time in ``tz``.
+
+    In months shorter than ``day`` the reset falls on the last day.
+    """
+    day: int
+    hour: int
+    minute: int
+    tz: str
+
+    def __str__(self) -> str:
+        return f"{self.day} {self.hour:02d}:{self.minute:02d} {self.tz}"
+
+
+def _now() -> int:
+    return int(time.time())
+
+
+def is_valid_timezone(name: str) -> bool:
+    try:
+        ZoneInfo(name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+
+
+def zone(name: Optional[str]) -> ZoneInfo:
+    """The named time zone, the configured default for None, UTC if unknown."""
+    name = name or config.get_reset_timezone()
+    if is_valid_timezone(name):
+        return ZoneInfo(name)
+    logger.warning(f"Unknown time zone '{name}', using UTC.")
+    return ZoneInfo("UTC")
+
+
+def next_reset(cycle: Cycle, after: float) -> int:
+    """Epoch seconds of the first reset of ``cycle`` strictly after ``after``."""
+    tz = zone(cycle.tz)
+    local = datetime.fromtimestamp(after, tz)
+    year, month = local.year, local.month
+    while True:
+        day = min(cycle.day, monthrange(year, month)[1])
+        at = datetime(year, month, day, cycle.hour, cycle.minute, tzinfo=tz).timestamp()
+        if at > after:
+            return int(at)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def panel_cycle(name: str, panel_config: Dict) -> Optional[Cycle]:
+    if panel_config.get("disabled", False):
+        return None
+    day = config.get_panel_reset_day(name)
+    if day is None:
+        if not config.is_monthly_reset_enabled():
+            return None
+        day = 1
+    return Cycle(day, PANEL_RESET_HOUR, PANEL_RESET_MINUTE, config.get_panel_timezone(name))
+
+
+def client_cycle(row: Dict) -> Optional[Cycle]:
+    """The cycle of a client_cycles row; None while its expiryTime is unknown."""
+    tz = row["timezone"] or config.get_reset_timezone()
+    if row["cycle_start"]:
+        return Cycle(datetime.strptime(row["cycle_start"], "%Y-%m-%d").day, 0, 0, tz)
+    # Negative expiry times count from first use and have no fixed date yet.
+    if row["expiry_time"] > 0:
+        expiry = datetime.fromtimestamp(row["expiry_time"] / 1000, zone(tz))
+        return Cycle(expiry.day, expiry.hour, expiry.minute, tz)
+    return None
+
+
+def desired_cycles() -> Dict[Key, Cycle]:
+    """Every reset that should be scheduled, from config.yml and client_cycles."""
+    panels = config.get_all_panels()
+    cycles = {}
+    for name, pconf in panels.items():
+        cycle = panel_cycle(name, pconf)
+        if cycle:
+            cycles[(name, "")] = cycle
+    for row in get_client_cycles():
+        pconf = panels.get(row["panel_name"])
+        if not pconf or pconf.get("disabled", False):
+            continue
+        cycle = client_cycle(row)
+        if cycle:
+            cycles[(row["panel_name"], row["email"])] = cycle
+    return cycles
+
+
+def own_cycle_emails(panel_name: str) -> Set[str]:
+    """Clients a panel-wide reset must skip because they have their own cycle."""
+    return {row["email"] for row in get_client_cycles(panel_name)}
+
+
+def group_by_panel(keys: Iterable[Key]) -> Dict[str, Tuple[bool, List[str]]]:
+    """{panel_name: (whole panel due, [due client emails])}."""
+    grouped: Dict[str, Tuple[bool, List[str]]] = {}
+    for panel_name, email in keys:
+        whole, emails = grouped.get(panel_name, (False, []))
+        if email:
+            emails.append(email)
+        grouped[panel_name] = (whole or not email, emails)
+    return grouped
+
+
+class _Entry(NamedTuple):
+    """Schedule state of one reset, as stored in reset_schedule."""
+    next_reset_at: int
+    last_reset_at: Optional[int] = None
+    attempts: int = 0
+    retry_at: Optional[int] = None
+
+    @property
+    def run_at(self) -> int:
+        return self.retry_at if self.retry_at is not None else self.next_reset_at
+
+
+class ResetScheduler:
+    """Heap of due reset times, mirrored to the reset_schedule table.
+
+    Heap entries are (run_at, key); one whose time no longer matches the
+    key's current entry was superseded and is dropped when it reaches the top.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[int, Key]] = []
+        self._entries: Dict[Key, _Entry] = {}
+        self._cycles: Dict[Key, Cycle] = {}
+        # Popped by pop_due() and not yet completed or failed; sync() leaves them alone.
+        self._running: Dict[Key, _Entry] = {}
+
+    def _push(self, key: Key, entry: _Entry) -> None:
+        self._entries[key] = entry
+        heapq.heappush(self._heap, (entry.run_at, key))
+
+    def _save(self, items: List[Tuple[Key, _Entry]]) -> None:
+        save_reset_schedule([(*key, str(self._cycles[key]), *entry) for key, entry in items])
+
+    def sync(self, now: Optional[float] = None) -> None:
+        """Reload the rules from config.yml and client_cycles; makes no panel calls.
+
+        A stored due time is kept while its rule is unchanged, even once it
+        has passed (a reset missed while the bot was down); a new or changed
+        rule is scheduled from now on.
+        """
+        now = now if now is not None else _now()
+        cycles = desired_cycles()
+        stored = get_reset_schedule()
+        changed = []
+        for key, cycle in cycles.items():
+            if key in self._running:
+                continue
+            row = stored.get(key)
+            if row and row["cycle"] == str(cycle):
+                entry = _Entry(row["next_reset_at"], row["last_reset_at"],
+                               row["attempts"], row["retry_at"])
+            else:
+                entry = _Entry(next_reset(cycle, now), row["last_reset_at"] if row else None)
+                changed.append((key, entry))
+            if self._entries.get(key) != entry:
+                self._push(key, entry)
+        self._cycles = cycles
+        self._save(changed)
+        delete_reset_schedule([key for key in stored if key not in cycles])
+        for key in [key for key in self._entries if key not in cycles]:
+            del self._entries[key]
+        if len(self._heap) > 2 * len(self._entries) + 16:
+            self._heap = [(entry.run_at, key) for key, entry in self._entries.items()]
+            heapq.heapify(self._heap)
+
+    def next_due(self) -> Optional[int]:
+        while self._heap:
+            run_at, key = self._heap[0]
+            entry = self._entries.get(key)
+            if entry is not None and entry.run_at == run_at:
+                return run_at
+            heapq.heappop(self._heap)
+        return None
+
+    def due_at(self, key: Key) -> Optional[int]:
+        entry = self._entries.get(key)
+        return entry.run_at if entry else None
+
+    def pop_due(self, now: Optional[float] = None) -> List[Key]:
+        """Remove and return the keys due by ``now``; complete() or fail() reschedules them."""
+        now = now if now is not None else _now()
+        keys = []
+        while True:
+            run_at = self.next_due()
+            if run_at is None or run_at > now:
+                break
+            _, key = heapq.heappop(self._heap)
+            self._running[key] = self._entries.pop(key)
+            keys.append(key)
+        return keys
+
+    def attempt(self, key: Key) -> Tuple[int, int]:
+        """(due time, attempt number) of a popped key."""
+        entry = self._running[key]
+        return entry.next_reset_at, entry.attempts + 1
+
+    def complete(self, keys: Iterable[Key], now: Optional[float] = None) -> None:
+        """Schedule the next cycle of reset keys and store it with the reset time."""
+        now = now if now is not None else _now()
+        done = []
+        for key in keys:
+            self._running.pop(key, None)
+            cycle = self._cycles.get(key)
+            if cycle is None:
+                continue
+            entry = _Entry(next_reset(cycle, now), int(now))
+            self._push(key, entry)
+            done.append((key, entry))
+        self._save(done)
+
+    def fail(self, key: Key, now: Optional[float] = None) -> Optional[int]:
+        """Schedule a retry of a failed reset; returns its time, or None once past the deadline.
+
+        Past the deadline the reset is given up and the next cycle scheduled.
+        """
+        now = now if now is not None else _now()
+        entry = self._running.pop(key)
+        cycle = self._cycles.get(key)
+        if cycle is None:
+            return None
+        attempts = entry.attempts + 1
+        delay = min(config.get_reset_retry_interval() * 2 ** (attempts - 1),
+                    config.get_reset_retry_max_interval())
+        retry_at = int(now + delay)
+        if retry_at > entry.next_reset_at + config.get_reset_retry_deadline():
+            entry, retry_at = _Entry(next_reset(cycle, now), entry.last_reset_at), None
+        else:
+            entry = entry._replace(attempts=attempts, retry_at=retry_at)
+        self._push(key, entry)
+        self._save([(key, entry)])
+        return retry_at
+
+    def fail_unfinished(self, keys: Iterable[Key], now: Optional[float] = None) -> List[Key]:
+        """fail() the popped keys that were neither completed nor failed; returns them.
+
+        Their outcome is unknown, so they are retried with the usual backoff
+        rather than put back due at once, which would rerun them in a loop.
+        """
+        unfinished = [key for key in keys if key in self._running]
+        for key in unfinished:
+            self.fail(key, now)
+        return unfinished
+
+    def upcoming(self, limit: int = 10) -> List[Tuple[int, Key, Cycle, int]]:
+        """(run time, key, cycle, failed attempts) of the next ``limit`` resets."""
+        soonest = heapq.nsmallest(limit, self._entries.items(), key=lambda item: item[1].run_at)
+        return [(entry.run_at, key, self._cycles[key], entry.attempts) for key, entry in soonest]
@@ -0,0 +1,360 @@
+"""Local stand-in for a 3x-ui panel, for integration and load tests.
+
+Serves the legacy API (POST /panel/inbound/list, POST /server/status, ...),
+the newer one (GET /panel/api/inbounds/list, GET /panel/api/server/status,
+...) or both, over real HTTP on 127.0.0.1 from a background thread.  The
+inbound list is generated with any number of inbounds and clients, and
+latency, HTTP errors, truncated responses, session expiry and traffic
+counter resets can be injected while it runs.  Every request is counted by
+route in ``calls``.
+
+    with PanelSimulator(style="legacy", inbounds=20, clients_per_inbound=500) as panel:
+        api = XUIApi(panel.url, panel.username, panel.password)
+
+Run directly to serve a panel for manual testing:
+
+    python tests/panel_simulator.py --port 2053 --style both --inbounds 50
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote
+
+GB = 1024 ** 3
+
+
+class _Server(ThreadingHTTPServer):
+    # The default backlog of 5 drops connects from a burst of concurrent
+    # requests, which then wait a full second for the SYN retransmit.
+    request_queue_size = 128
+    daemon_threads = True
+
+# (style, method, pattern, route name)
+_ROUTES = [
+    ("api", "GET", re.compile(r"/panel/api/inbounds/list"), "inbounds"),
+    ("api", "GET", re.compile(r"/panel/api/server/status"), "status"),
+    ("api", "POST", re.compile(r"/panel/api/inbounds/resetAllClientTraffics/-1"), "reset_all"),
+    ("api", "POST", re.compile(r"/panel/api/inbounds/resetAllClientTraffics/(\d+)"), "reset_inbound"),
+    ("api", "POST", re.compile(r"/panel/api/inbounds/(\d+)/resetClientTraffic/(.+)"), "reset_client"),
+    ("legacy", "POST", re.compile(r"/panel/inbound/list"), "inbounds"),
+    ("legacy", "POST", re.compile(r"/server/status"), "status"),
+    ("legacy", "POST", re.compile(r"/panel/inbound/resetAllClientTraffics/-1"), "reset_all"),
+    ("legacy", "POST", re.compile(r"/panel/inbound/resetAllClientTraffics/(\d+)"), "reset_inbound"),
+    ("legacy", "POST", re.compile(r"/panel/inbound/(\d+)/resetClientTraffic/(.+)"), "reset_client"),
+]
+
+
+class PanelSimulator:
+    def __init__(self, style: str = "api", inbounds: int = 2, clients_per_inbound: int = 10,
+                 username: str = "admin", password: str = "admin", cookie_name: str = "3x-ui",
+                 latency: float = 0.0, error_rate: float = 0.0, session_ttl: Optional[float] = None,
+                 port: int = 0, seed: int = 0):
+        if style not in ("api", "legacy", "both"):
+            raise ValueError(f"unknown API style: {style}")
+        self.style = style
+        self.username = username
+        self.password = password
+        self.cookie_name = cookie_name
+        self.latency = latency
+        self.error_rate = error_rate
+        self.session_ttl = session_ttl
+        self.calls: Counter = Counter()
+        self._port = port
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, float] = {}
+        self._session_seq = 0
+        self._failures: List[int] = []
+        self._truncate = 0
+        self._inbounds = self._generate(inbounds, clients_per_inbound)
+        self._body: Optional[bytes] = None
+        self._server: Optional[_Server] = None
+        self._thread: Optional[threading.Thread] = None
+
+    # --- Lifecycle ---
+
+    def start(self) -> "PanelSimulator":
+        self._server = _Server(("127.0.0.1", self._port), self._handler_class())
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "PanelSimulator":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def panel_config(self) -> Dict[str, str]:
+        return {"url": self.url, "username": self.username, "password": self.password}
+
+    # --- Data ---
+
+    def _generate(self, inbounds: int, clients_per_inbound: int) -> List[Dict]:
+        result = []
+        for i in range(1, inbounds + 1):
+            stats = []
+            for j in range(clients_per_inbound):
+                stats.append({
+                    "id": j + 1, "inboundId": i, "enable": True,
+                    "email": f"user-{i:03d}-{j:05d}",
+                    "up": self._random.randrange(GB), "down": self._random.randrange(4 * GB),
+                    "total": 100 * GB, "expiryTime": 0, "reset": 0,
+                })
+            settings = {"clients": [{"id": f"uuid-{i}-{s['id']}", "email": s["email"],
+                                     "limitIp": 0, "totalGB": s["total"], "enable": True}
+                                    for s in stats]}
+            result.append({
+                "id": i, "remark": f"inbound-{i}", "enable": True, "protocol": "vless",
+                "port": 10000 + i, "up": 0, "down": 0, "total": 0, "expiryTime": 0,
+                "settings": json.dumps(settings),
+                "streamSettings": json.dumps({"network": "tcp", "security": "none"}),
+                "clientStats": stats,
+            })
+        return result
+
+    @property
+    def emails(self) -> List[str]:
+        return [s["email"] for inbound in self._inbounds for s in inbound["clientStats"]]
+
+    def client(self, email: str) -> Optional[Dict]:
+        for inbound in self._inbounds:
+            for stats in inbound["clientStats"]:
+                if stats["email"] == email:
+                    return stats
+        return None
+
+    def add_traffic(self, up: int = 0, down: int = 0, emails: Optional[Iterable[str]] = None) -> None:
+        """Grow the counters of the given clients (all by default)."""
+        wanted = set(emails) if emails is not None else None
+        with self._lock:
+            for inbound in self._inbounds:
+                for stats in inbound["clientStats"]:
+                    if wanted is None or stats["email"] in wanted:
+                        stats["up"] += up
+                        stats["down"] += down
+            self._body = None
+
+    def reset_counters(self, emails: Optional[Iterable[str]] = None) -> None:
+        """Zero the counters of the given clients (all by default), as the panel itself would."""
+        wanted = set(emails) if emails is not None else None
+        with self._lock:
+            self._reset(lambda stats: wanted is None or stats["email"] in wanted)
+
+    def _reset(self, matches) -> int:
+        count = 0
+        for inbound in self._inbounds:
+            for stats in inbound["clientStats"]:
+                if matches(stats):
+                    stats["up"] = stats["down"] = 0
+                    count += 1
+        self._body = None
+        return count
+
+    # --- Fault injection ---
+
+    def fail_next(self, count: int = 1, status: int = 500) -> None:
+        """Answer the next ``count`` authenticated API requests with ``status``."""
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def truncate_next(self, count: int = 1) -> None:
+        """Cut the next ``count`` inbound list responses off halfway."""
+        with self._lock:
+            self._truncate += count
+
+    def expire_sessions(self) -> None:
+        with self._lock:
+            self._sessions.clear()
+
+    # --- Request handling ---
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.calls[name] += 1
+
+    def _handler_class(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are separate writes on a kept-alive socket;
+            # with Nagle on, each small response waits for a delayed ACK.
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                simulator._handle(self, "GET")
+
+            def do_POST(self):
+                simulator._handle(self, "POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _handle(self, handler: BaseHTTPRequestHandler, method: str) -> None:
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        if self.latency:
+            time.sleep(self.latency)
+        path = handler.path.split("?", 1)[0]
+        if method == "POST" and path.rstrip("/") == "/login":
+            return self._login(handler, body)
+
+        route = self._route(method, path)
+        if route is None:
+            self._count("not_found")
+            return self._send(handler, 404, b"404 page not found", "text/plain")
+        style, name, match = route
+        if not self._authenticated(handler):
+            self._count("unauthorized")
+            if style == "legacy":
+                return self._send(handler, 307, b"", "text/plain", {"Location": "/login"})
+            return self._send(handler, 401, b"", "text/plain")
+        self._count(name)
+
+        with self._lock:
+            status = self._failures.pop(0) if self._failures else None
+        if status is None and self.error_rate and self._random.random() < self.error_rate:
+            status = 500
+        if status is not None:
+            self._count("errors")
+            return self._send(handler, status, b"Internal Server Error", "text/plain")
+
+        if name == "inbounds":
+            return self._send_inbounds(handler)
+        if name == "status":
+            return self._json(handler, {"success": True, "msg": "", "obj": self._status()})
+        with self._lock:
+            if name == "reset_all":
+                self._reset(lambda stats: True)
+                return self._json(handler, {"success": True, "msg": ""})
+            if name == "reset_inbound":
+                inbound_id = int(match.group(1))
+                self._reset(lambda s: s["inboundId"] == inbound_id)
+                return self._json(handler, {"success": True, "msg": ""})
+            inbound_id, email = int(match.group(1)), unquote(match.group(2))
+            found = self._reset(lambda s: s["inboundId"] == inbound_id and s["email"] == email)
+        return self._json(handler, {"success": bool(found), "msg": "" if found else "not found"})
+
+    def _route(self, method: str, path: str) -> Optional[Tuple[str, str, "re.Match"]]:
+        for style, route_method, pattern, name in _ROUTES:
+            if self.style not in (style, "both") or route_method != method:
+                continue
+            match = pattern.fullmatch(path)
+            if match:
+                return style, name, match
+        return None
+
+    def _login(self, handler: BaseHTTPRequestHandler, body: bytes) -> None:
+        self._count("login")
+        form = {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()}
+        if form.get("username") != self.username or form.get("password") != self.password:
+            return self._json(handler, {"success": False, "msg": "Wrong username or password."})
+        with self._lock:
+            self._session_seq += 1
+            token = f"session-{self._session_seq}"
+            self._sessions[token] = time.monotonic()
+        cookie = f"{self.cookie_name}={token}; Path=/; HttpOnly"
+        return self._json(handler, {"success": True, "msg": "Login Successfully"},
+                          {"Set-Cookie": cookie})
+
+    def _authenticated(self, handler: BaseHTTPRequestHandler) -> bool:
+        cookies = {}
+        for part in (handler.headers.get("Cookie") or "").split(";"):
+            name, _, value = part.strip().partition("=")
+            cookies[name] = value
+        token = cookies.get(self.cookie_name)
+        with self._lock:
+            issued = self._sessions.get(token)
+            if issued is None:
+                return False
+            if self.session_ttl is not None and time.monotonic() - issued > self.session_ttl:
+                del self._sessions[token]
+                return False
+        return True
+
+    def _status(self) -> Dict:
+        return {
+            "cpu": 12.5, "cpuCores": 4, "uptime": 86400 * 3 + 3600,
+            "mem": {"current": 2 * GB, "total": 8 * GB},
+            "disk": {"current": 20 * GB, "total": 80 * GB},
+            "netTraffic": {"sent": 500 * GB, "recv": 700 * GB},
+            "xray": {"state": "running", "errorMsg": "", "version": "25.1.1"},
+        }
+
+    def _send_inbounds(self, handler: BaseHTTPRequestHandler) -> None:
+        with self._lock:
+            if self._body is None:
+                self._body = json.dumps({"success": True, "msg": "", "obj": self._inbounds}).encode()
+            body = self._body
+            truncate = self._truncate > 0
+            self._truncate = max(0, self._truncate - 1)
+        if truncate:
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/json")
+            handler.send_header("Content-Length", str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body[:len(body) // 2])
+            handler.wfile.flush()
+            handler.close_connection = True
+            return
+        return self._send(handler, 200, body, "application/json")
+
+    def _json(self, handler: BaseHTTPRequestHandler, data: Dict,
+              headers: Optional[Dict[str, str]] = None) -> None:
+        return self._send(handler, 200, json.dumps(data).encode(), "application/json", headers)
+
+    @staticmethod
+    def _send(handler: BaseHTTPRequestHandler, status: int, body: bytes, content_type: str,
+              headers: Optional[Dict[str, str]] = None) -> None:
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a simulated 3x-ui panel.")
+    parser.add_argument("--port", type=int, default=2053)
+    parser.add_argument("--style", choices=("api", "legacy", "both"), default="both")
+    parser.add_argument("--inbounds", type=int, default=10)
+    parser.add_argument("--clients", type=int, default=100, help="clients per inbound")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    panel = PanelSimulator(style=args.style, inbounds=args.inbounds,
+                           clients_per_inbound=args.clients, latency=args.latency,
+                           error_rate=args.error_rate, port=args.port).start()
+    print(f"Serving {args.style} 3x-ui API at {panel.url} "
+          f"(login {panel.username}/{panel.password}); Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        panel.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""Base class for tests that need a database: each test gets a fresh one.
+
+database.DB_DIR/DB_PATH point at a temporary directory for the duration of
+the test, so nothing is written to the real data/traffic.db.
+"""
+import os
+import tempfile
+import unittest
+
+import database
+
+
+class TempDatabaseTestCase(unittest.TestCase):
+    # Create the schema in setUp; tests of the migrations themselves turn this off.
+    init_db = True
+
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        old = database.DB_DIR, database.DB_PATH
+        database.DB_DIR = temp_dir.name
+        database.DB_PATH = os.path.join(temp_dir.name, "traffic.db")
+
+        def restore():
+            database.close_db()
+            database.DB_DIR, database.DB_PATH = old
+            temp_dir.cleanup()
+
+        # Cleanups run after the subclass's tearDown, so it can still use the database.
+        self.addCleanup(restore)
+        if self.init_db:
+            database.init_db()
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import yaml
+
+import config
+
+BASE = {
+    "bot_token": "token",
+    "users": {"admin_users": [1], "normal_users": [2]},
+    "panels": {"P": {"url": "http://p", "username": "u", "password": "x", "disabled": True}},
+}
+
+
+class ConfigStoreTests(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._old = config.CONFIG_FILE, config.config, config._stamp
+        config.CONFIG_FILE = os.path.join(self._temp_dir.name, "config.yml")
+        self._write_external(BASE)
+        config._reload(force=True)
+        self._interval = patch("config.RELOAD_CHECK_INTERVAL", 0)
+        self._interval.start()
+
+    def tearDown(self):
+        self._interval.stop()
+        config.CONFIG_FILE = self._old[0]
+        config._install(self._old[1], self._old[2])
+        self._temp_dir.cleanup()
+
+    def _write_external(self, data):
+        """Write the file the way another process would, through a new inode."""
+        tmp = config.CONFIG_FILE + ".other"
+        with open(tmp, "w", encoding="utf-8") as f:
+            yaml.dump(data, f, allow_unicode=True)
+        os.replace(tmp, config.CONFIG_FILE)
+
+    def _on_disk(self):
+        with open(config.CONFIG_FILE, encoding="utf-8") as f:
+            return yaml.safe_load(f)
+
+    def test_lookups_do_not_reparse_an_unchanged_file(self):
+        with patch("config._read_file", wraps=config._read_file) as read:
+            for _ in range(100):
+                self.assertTrue(config.is_authorized(2))
+                self.assertTrue(config.is_admin(1))
+                self.assertEqual(config.get_panel_config("P")["url"], "http://p")
+        read.assert_not_called()
+        self.assertFalse(config.is_authorized(3))
+        self.assertFalse(config.is_admin(2))
+
+    def test_changes_by_other_processes_are_picked_up(self):
+        self._write_external(dict(BASE, users={"admin_users": [1], "normal_users": [3]}))
+        self.assertFalse(config.is_authorized(2))
+        self.assertTrue(config.is_authorized(3))
+
+    def test_unreadable_file_keeps_the_last_good_config(self):
+        with open(config.CONFIG_FILE, "w", encoding="utf-8") as f:
+            f.write("users: [unclosed")
+        self.assertTrue(config.is_authorized(2))
+        self.assertEqual(config.get_bot_token(), "token")
+
+    def test_edits_start_from_the_file_and_are_written_atomically(self):
+        with patch("config.RELOAD_CHECK_INTERVAL", 3600):
+            self._write_external(dict(BASE, users={"admin_users": [1], "normal_users": [2, 5]}))
+            # The in-memory copy is stale, but the edit starts from the file.
+            self.assertTrue(config.add_normal_user(6))
+        self.assertEqual(self._on_disk()["users"]["normal_users"], [2, 5, 6])
+        self.assertTrue(config.is_authorized(6))
+        self.assertFalse(config.add_normal_user(1))
+        self.assertTrue(config.del_normal_user(2))
+        self.assertFalse(config.del_normal_user(2))
+        self.assertEqual(sorted(os.listdir(self._temp_dir.name)), ["config.yml", "config.yml.lock"])
+
+    def test_panel_helpers(self):
+        config.add_or_update_panel("P", "http://new", "u2", "y", reset_day=15)
+        panel = self._on_disk()["panels"]["P"]
+        self.assertEqual(panel, {"url": "http://new", "username": "u2", "password": "y",
+                                 "disabled": True, "reset_day": 15})
+        self.assertEqual(config.get_panel_reset_day("P"), 15)
+        self.assertTrue(config.set_panel_disabled("P", False))
+        self.assertFalse(config.set_panel_disabled("missing", True))
+        self.assertFalse(config.get_panel_config("P")["disabled"])
+        self.assertTrue(config.delete_panel("P"))
+        self.assertFalse(config.delete_panel("P"))
+        self.assertEqual(self._on_disk()["panels"], {})
+        self.assertIsNone(config.get_panel_reset_day("P"))
+
+
+if __name__ == "__main__":
+    unittest.main()
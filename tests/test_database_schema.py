@@ -0,0 +1,122 @@
+import sqlite3
+import unittest
+from unittest.mock import patch
+
+import database
+from temp_db import TempDatabaseTestCase
+
+LEGACY_SCHEMA = """
+    CREATE TABLE traffic_records (
+        id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        panel_name  TEXT    NOT NULL,
+        email       TEXT    NOT NULL,
+        record_date TEXT    NOT NULL,
+        upload      INTEGER DEFAULT 0,
+        download    INTEGER DEFAULT 0,
+        total_bytes INTEGER DEFAULT 0,
+        expiry_time INTEGER DEFAULT 0,
+        created_at  TEXT    DEFAULT (datetime('now','localtime')),
+        UNIQUE(panel_name, email, record_date)
+    );
+    CREATE INDEX idx_tr_date  ON traffic_records(record_date);
+    CREATE INDEX idx_tr_panel ON traffic_records(panel_name);
+    CREATE INDEX idx_tr_email ON traffic_records(email);
+    INSERT INTO traffic_records (panel_name, email, record_date, upload, download, created_at)
+    VALUES ('P1', 'a', '2026-08-01', 1, 1, '2026-08-01 23:50:00'),
+           ('P1', 'a', '2026-08-02', 2, 2, '2026-08-02 23:50:00');
+"""
+
+
+class DatabaseSchemaTests(TempDatabaseTestCase):
+    init_db = False
+
+    def _tables(self):
+        rows = database._get_conn().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        ).fetchall()
+        return {r["name"] for r in rows}
+
+    def _plan(self, sql, params=()):
+        rows = database._get_conn().execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        return [r["detail"] for r in rows]
+
+    def test_existing_database_is_migrated_in_place(self):
+        conn = sqlite3.connect(database.DB_PATH)
+        conn.executescript(LEGACY_SCHEMA)
+        conn.close()
+
+        database.init_db()
+
+        self.assertNotIn("traffic_records", self._tables())
+        self.assertTrue({"panels", "clients", "traffic_snapshots"} <= self._tables())
+        version = database._get_conn().execute("PRAGMA user_version").fetchone()[0]
+        self.assertEqual(version, len(database._MIGRATIONS))
+        self.assertTrue(database.has_daily_traffic_snapshot("2026-08-02"))
+        self.assertEqual(database.get_daily_stats("2026-08-02", "2026-08-02")[0]["daily_total"], 2)
+        latest = database.get_latest_snapshot()[0]
+        self.assertEqual((latest["record_date"], latest["created_at"]),
+                         ("2026-08-02", "2026-08-02 23:50:00"))
+
+    def test_vacuum_after_the_rewrite_is_left_to_the_bot(self):
+        conn = sqlite3.connect(database.DB_PATH)
+        conn.executescript(LEGACY_SCHEMA)
+        conn.close()
+
+        with patch.object(database, "logger") as log:
+            database.init_db()
+            database.init_db()
+            self.assertFalse([c for c in log.info.call_args_list if "Compacting" in c[0][0]])
+            database.run_pending_maintenance()
+            database.run_pending_maintenance()
+        self.assertEqual(len([c for c in log.info.call_args_list if "Compacting" in c[0][0]]), 1)
+        self.assertEqual(database._get_conn().execute("PRAGMA freelist_count").fetchone()[0], 0)
+
+    def test_a_new_database_needs_no_vacuum(self):
+        database.init_db()
+        rows = database._get_conn().execute("SELECT task FROM pending_maintenance").fetchall()
+        self.assertEqual(rows, [])
+
+    def test_migrations_are_applied_once(self):
+        database.init_db()
+        database.batch_record_traffic([("P1", "a", 1, 1, 0, 0, "2026-08-01")])
+
+        self.assertEqual(database._migrate(database._get_conn()), [])
+        database.init_db()
+
+        self.assertEqual(database.get_panel_user_list("P1"), ["a"])
+
+    def test_end_of_day_check_is_an_index_search(self):
+        database.init_db()
+
+        plan = self._plan(
+            "SELECT 1 FROM traffic_snapshots WHERE day = ? AND created_at >= ? LIMIT 1",
+            (20667, 20667 * 86400 + 23 * 3600),
+        )
+
+        self.assertTrue(any("SEARCH" in p and "idx_ts_day_created" in p for p in plan), plan)
+
+    def test_latest_snapshot_probes_the_primary_key_and_keeps_stale_clients(self):
+        database.init_db()
+        database.batch_record_traffic([
+            ("P1", "gone", 5, 5, 0, 0, "2026-08-01"),
+            ("P1", "a", 1, 1, 0, 0, "2026-08-01"),
+            ("P1", "a", 3, 3, 0, 0, "2026-08-02"),
+            ("P2", "a", 9, 9, 0, 0, "2026-08-02"),
+        ])
+
+        for panel_name in (None, "P1"):
+            plan = self._plan(database._latest_snapshot_sql(panel_name),
+                              (panel_name,) if panel_name else ())
+            self.assertFalse([p for p in plan if p.startswith(("SCAN t", "SCAN m"))], plan)
+            self.assertTrue(any(p.startswith("SEARCH t USING PRIMARY KEY") for p in plan), plan)
+
+        latest = database.get_latest_snapshot()
+        self.assertEqual(
+            [(r["panel_name"], r["email"], r["record_date"]) for r in latest],
+            [("P1", "gone", "2026-08-01"), ("P1", "a", "2026-08-02"), ("P2", "a", "2026-08-02")],
+        )
+        self.assertEqual(len(database.get_latest_snapshot("P2")), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
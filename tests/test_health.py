@@ -0,0 +1,89 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+import database
+import health
+import main
+from temp_db import TempDatabaseTestCase
+
+
+class _FakeStatusApi:
+    calls = []
+    up = True
+
+    def __init__(self, name):
+        self.name = name
+
+    async def get_server_status(self):
+        self.calls.append(self.name)
+        return {"xray": {"state": "running"}} if self.up else None
+
+
+class PanelHealthTests(TempDatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self._patches = [
+            patch("health.config.get_health_failure_threshold", return_value=2),
+            patch("health.config.get_health_interval", return_value=60),
+            patch("health.config.get_health_max_backoff", return_value=300),
+        ]
+        for p in self._patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+
+    def test_circuit_opens_after_threshold_and_backs_off(self):
+        self.assertEqual(health.record_probe("P", None, 8, "超时", now=1000), (False, False))
+        self.assertFalse(health.is_circuit_open("P", now=1001))
+
+        self.assertEqual(health.record_probe("P", None, 8, "超时", now=1100), (False, True))
+        self.assertTrue(health.is_circuit_open("P", now=1159))
+        self.assertFalse(health.is_circuit_open("P", now=1160))
+
+        delays = []
+        for now in (2000, 3000, 4000, 5000):
+            health.record_probe("P", None, 8, "超时", now=now)
+            delays.append(health.get_health("P")["retry_at"] - now)
+        self.assertEqual(delays, [120, 240, 300, 300])
+
+        self.assertEqual(health.record_probe("P", "running", 0.05, None, now=6000), (True, False))
+        row = health.get_health("P")
+        self.assertEqual((row["failures"], row["latency_ms"]), (0, 50))
+        self.assertFalse(health.is_circuit_open("P", now=6000))
+
+    @patch("health.get_panel_api", lambda name, pconf: _FakeStatusApi(name))
+    def test_open_panels_are_skipped_until_their_retry_time(self):
+        _FakeStatusApi.calls, _FakeStatusApi.up = [], False
+        panels = {"A": {}, "Off": {"disabled": True}}
+
+        for now in (1000, 1060, 1100):
+            asyncio.run(health.check_panels(panels, timeout=1, now=now))
+        self.assertEqual(_FakeStatusApi.calls, ["A", "A"])
+
+        _FakeStatusApi.up = True
+        checked = asyncio.run(health.check_panels(panels, timeout=1, now=1120))
+        self.assertEqual(checked, [("A", True, False, None)])
+
+    @patch("main.send_to_admins")
+    @patch("health.get_panel_api", lambda name, pconf: _FakeStatusApi(name))
+    def test_job_alerts_once_per_outage_and_on_recovery(self, send):
+        _FakeStatusApi.calls, _FakeStatusApi.up = [], False
+        with patch("main.config.get_all_panels", return_value={"A": {}}), \
+                patch("main.config.get_health_timeout", return_value=1), \
+                patch("health._now", side_effect=[0, 100, 1000, 2000]):
+            for _ in range(3):
+                asyncio.run(main.health_check_job(None))
+            _FakeStatusApi.up = True
+            asyncio.run(main.health_check_job(None))
+
+        sent = [c.args[0] for c in send.call_args_list]
+        self.assertEqual(len(sent), 2)
+        self.assertIn("离线告警", sent[0])
+        self.assertIn("已恢复", sent[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import asyncio
+import unittest
+
+from telegram.error import BadRequest, RetryAfter, TimedOut
+
+from message_queue import MessageQueue, MAX_MESSAGE_LENGTH
+
+
+class _FakeBot:
+    def __init__(self, failures=None):
+        self.sent = []
+        self.failures = failures or {}
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        errors = self.failures.get(chat_id)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append((asyncio.get_running_loop().time(), chat_id, text))
+
+
+async def _drain(queue, bot, **kwargs):
+    queue.start()
+    await queue.stop(timeout=kwargs.get("timeout", 5))
+    return bot.sent
+
+
+class MessageQueueTests(unittest.TestCase):
+    def test_messages_to_one_chat_are_merged_without_blocking_the_caller(self):
+        bot = _FakeBot()
+
+        async def run():
+            queue = MessageQueue(bot, per_chat_interval=0)
+            for i in range(3):
+                queue.put(1, f"m{i}")
+            queue.put(1, "plain", parse_mode=None)
+            queue.put(1, "x" * MAX_MESSAGE_LENGTH, parse_mode=None)
+            self.assertEqual(bot.sent, [])
+            return await _drain(queue, bot)
+
+        sent = asyncio.run(run())
+        self.assertEqual([text[:5] for _, _, text in sent], ["m0\n\nm", "plain", "xxxxx"])
+        self.assertEqual(sent[0][2], "m0\n\nm1\n\nm2")
+
+    def test_per_chat_and_global_spacing(self):
+        bot = _FakeBot()
+
+        async def run():
+            queue = MessageQueue(bot, per_chat_interval=0.2, global_rate=20)
+            queue.put(1, "a")
+            queue.put(2, "b")
+            await asyncio.sleep(0)
+            queue.start()
+            await asyncio.sleep(0.01)
+            queue.put(1, "c")
+            await queue.stop()
+            return bot.sent
+
+        sent = asyncio.run(run())
+        times = {text: at for at, _, text in sent}
+        self.assertGreaterEqual(times["b"] - times["a"], 0.05 - 1e-3)
+        self.assertGreaterEqual(times["c"] - times["a"], 0.2 - 1e-3)
+
+    def test_retry_after_pauses_and_network_errors_back_off(self):
+        bot = _FakeBot({1: [RetryAfter(0.2)], 2: [TimedOut(), TimedOut()]})
+
+        async def run():
+            queue = MessageQueue(bot, per_chat_interval=0, base_backoff=0.05)
+            started = asyncio.get_running_loop().time()
+            queue.put(1, "a")
+            queue.put(2, "b")
+            sent = await _drain(queue, bot)
+            return started, sent, queue
+
+        started, sent, queue = asyncio.run(run())
+        self.assertEqual(sorted(text for _, _, text in sent), ["a", "b"])
+        self.assertTrue(all(at - started >= 0.2 - 1e-3 for at, _, _ in sent))
+        self.assertEqual((queue.sent, queue.dropped), (2, 0))
+
+    def test_undeliverable_messages_are_dropped(self):
+        bot = _FakeBot({1: [BadRequest("chat not found")], 2: [TimedOut()] * 3})
+
+        async def run():
+            queue = MessageQueue(bot, per_chat_interval=0, max_attempts=3, base_backoff=0.01)
+            queue.put(1, "a")
+            queue.put(2, "b")
+            queue.put(3, "c")
+            sent = await _drain(queue, bot)
+            return sent, queue
+
+        sent, queue = asyncio.run(run())
+        self.assertEqual([text for _, _, text in sent], ["c"])
+        self.assertEqual((queue.sent, queue.dropped, queue.pending()), (1, 2, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
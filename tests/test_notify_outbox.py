@@ -0,0 +1,44 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+import database
+import main
+import notify
+from temp_db import TempDatabaseTestCase
+
+
+class NotificationOutboxTests(TempDatabaseTestCase):
+    def test_notify_admins_only_queues(self):
+        with patch("httpx.Client") as client:
+            notify.notify_admins("✅ done")
+            notify.notify_admins("plain", parse_mode=None)
+        client.assert_not_called()
+
+        rows = database.take_notifications()
+        self.assertEqual([(r["chat_id"], r["text"], r["parse_mode"]) for r in rows],
+                         [(None, "✅ done", "Markdown"), (None, "plain", None)])
+        self.assertEqual(database.take_notifications(), [])
+
+    def test_take_notifications_respects_limit_and_order(self):
+        for i in range(5):
+            database.enqueue_notification(f"m{i}")
+        first = database.take_notifications(limit=3)
+        rest = database.take_notifications(limit=3)
+        self.assertEqual([r["text"] for r in first + rest], [f"m{i}" for i in range(5)])
+
+    @patch("main.message_queue.send")
+    @patch("main.send_to_admins")
+    def test_job_hands_rows_to_the_message_queue(self, send_to_admins, send):
+        notify.notify_admins("broadcast")
+        database.enqueue_notification("direct", None, chat_id=42)
+
+        self.assertEqual(asyncio.run(main.deliver_outbox_job(None)), 2)
+        self.assertEqual(asyncio.run(main.deliver_outbox_job(None)), 0)
+
+        send_to_admins.assert_called_once_with("broadcast", "Markdown")
+        send.assert_called_once_with(42, "direct", None)
+
+
+if __name__ == "__main__":
+    unittest.main()
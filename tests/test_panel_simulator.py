@@ -0,0 +1,176 @@
+import asyncio
+import unittest
+
+import httpx
+
+import database
+from panel_simulator import PanelSimulator
+from temp_db import TempDatabaseTestCase
+from xui_api import XUIApi, close_all_panel_apis, drop_panel_api, get_panel_api
+
+
+def _run(panel, *calls):
+    """Run the named XUIApi calls in order on one client; returns (api, results)."""
+    async def go():
+        async with XUIApi(panel.url, panel.username, panel.password) as api:
+            results = []
+            for name, *args in calls:
+                results.append(await getattr(api, name)(*args))
+            return api, results
+    return asyncio.run(go())
+
+
+class XUIApiAgainstSimulatorTests(unittest.TestCase):
+    def test_new_api_lists_every_client_with_one_login(self):
+        with PanelSimulator(style="api", inbounds=5, clients_per_inbound=200) as panel:
+            api, (clients, status) = _run(panel, ("get_all_clients",), ("get_server_status",))
+        self.assertEqual(sorted(c["email"] for c in clients), sorted(panel.emails))
+        one = next(c for c in clients if c["email"] == "user-003-00007")
+        stats = panel.client("user-003-00007")
+        self.assertEqual((one["up"], one["down"], one["inbound_id"]), (stats["up"], stats["down"], 3))
+        self.assertEqual(status["xray"]["state"], "running")
+        self.assertEqual(api.api_style, "api")
+        self.assertEqual(panel.calls, {"login": 1, "inbounds": 1, "status": 1})
+
+    def test_legacy_panel_is_detected_once(self):
+        with PanelSimulator(style="legacy") as panel:
+            api, (first, second, status) = _run(
+                panel, ("get_inbounds",), ("get_inbounds",), ("get_server_status",))
+        self.assertEqual(len(first["obj"]), 2)
+        self.assertEqual(second, first)
+        self.assertIsNotNone(status)
+        self.assertEqual(api.api_style, "legacy")
+        # Only the very first call probes the new API before falling back.
+        self.assertEqual(panel.calls["not_found"], 1)
+        self.assertEqual(panel.calls["inbounds"], 2)
+
+    def test_login_cookie_name_is_detected(self):
+        for cookie_name in ("session", "x-ui", "custom-cookie"):
+            with PanelSimulator(cookie_name=cookie_name) as panel:
+                api, (data,) = _run(panel, ("get_inbounds",))
+            self.assertIsNotNone(data, cookie_name)
+            self.assertEqual(api.cookie_name, cookie_name)
+
+    def test_wrong_password_fails_without_calling_the_api(self):
+        with PanelSimulator() as panel:
+            async def go():
+                async with XUIApi(panel.url, panel.username, "wrong") as api:
+                    return await api.get_inbounds()
+            self.assertIsNone(asyncio.run(go()))
+        self.assertEqual(panel.calls, {"login": 1})
+
+    def test_expired_session_logs_in_again(self):
+        for style in ("api", "legacy"):
+            with PanelSimulator(style=style) as panel:
+                async def go():
+                    async with XUIApi(panel.url, panel.username, panel.password) as api:
+                        await api.get_inbounds()
+                        panel.expire_sessions()
+                        return await api.get_inbounds(), await api.get_all_clients()
+                data, clients = asyncio.run(go())
+            self.assertIsNotNone(data, style)
+            self.assertEqual(len(clients), 20)
+            self.assertEqual(panel.calls["login"], 2, style)
+
+    def test_errors_and_truncated_bodies_are_recovered_from(self):
+        with PanelSimulator() as panel:
+            panel.fail_next()
+            panel.truncate_next()
+            api, (failed,) = _run(panel, ("get_inbounds",))
+            with self.assertRaises(httpx.RemoteProtocolError):
+                _run(panel, ("get_all_clients",))
+            api, (recovered,) = _run(panel, ("get_all_clients",))
+        self.assertIsNone(failed)
+        self.assertEqual(len(recovered), 20)
+
+    def test_resets_clear_counters_on_the_panel(self):
+        with PanelSimulator(inbounds=2, clients_per_inbound=3) as panel:
+            api, (one, _, clients) = _run(
+                panel, ("reset_client_traffic_by_email", "user-002-00001"),
+                ("get_all_clients",), ("get_all_clients",))
+            self.assertTrue(one)
+            self.assertEqual(panel.client("user-002-00001")["up"], 0)
+            self.assertNotEqual(panel.client("user-002-00002")["up"], 0)
+
+            panel.add_traffic(up=5)
+            api, (ok, clients) = _run(panel, ("reset_all_client_traffic",), ("get_all_clients",))
+        self.assertTrue(ok)
+        self.assertTrue(all(c["up"] == c["down"] == 0 for c in clients))
+
+    def test_bulk_reset_fetches_inbounds_once(self):
+        with PanelSimulator(inbounds=4, clients_per_inbound=50) as panel:
+            emails = panel.emails[::3] + ["nobody"]
+            api, (results,) = _run(panel, ("reset_clients_traffic", emails, 8))
+            self.assertEqual(results, {**{e: True for e in emails[:-1]}, "nobody": False})
+            self.assertTrue(all(panel.client(e)["up"] == 0 for e in emails[:-1]))
+            self.assertNotEqual(panel.client(panel.emails[1])["up"], 0)
+        self.assertEqual(panel.calls["inbounds"], 1)
+        self.assertEqual(panel.calls["reset_client"], len(emails) - 1)
+
+    def test_bulk_reset_of_an_unreachable_panel_returns_none(self):
+        with PanelSimulator() as panel:
+            panel.fail_next()
+            api, (results,) = _run(panel, ("reset_clients_traffic", panel.emails))
+        self.assertIsNone(results)
+        self.assertEqual(panel.calls["reset_client"], 0)
+
+
+class StoredApiDetailsTests(TempDatabaseTestCase):
+    def _restart_and_call(self, panel, *names):
+        """Drop the shared clients, as a process restart would, and call the panel."""
+        async def go():
+            await close_all_panel_apis()
+            api = get_panel_api("P", panel.panel_config)
+            restored = api.api_style
+            for name in names:
+                await getattr(api, name)()
+            await close_all_panel_apis()
+            return restored
+        return asyncio.run(go())
+
+    def test_detected_style_survives_a_restart(self):
+        with PanelSimulator(style="legacy", cookie_name="session") as panel:
+            self.assertIsNone(self._restart_and_call(panel, "get_inbounds", "get_server_status"))
+            self.assertEqual(panel.calls["not_found"], 1)
+            meta = database.get_panel_meta("P")
+            self.assertEqual((meta["api_style"], meta["cookie_name"], meta["version"]),
+                             ("legacy", "session", "25.1.1"))
+
+            self.assertEqual(self._restart_and_call(panel, "get_inbounds", "get_all_clients"), "legacy")
+            self.assertEqual(panel.calls["not_found"], 1)
+
+    def test_a_stale_style_is_detected_again(self):
+        with PanelSimulator(style="legacy") as panel:
+            database.save_panel_meta("P", panel.url, "api", "3x-ui", None)
+            self.assertEqual(self._restart_and_call(panel, "get_inbounds"), "api")
+            self.assertEqual(panel.calls["not_found"], 1)
+            self.assertEqual(database.get_panel_meta("P")["api_style"], "legacy")
+
+    def test_a_stale_style_is_replaced_on_the_snapshot_path(self):
+        with PanelSimulator(style="both") as panel:
+            database.save_panel_meta("P", panel.url, "legacy", "3x-ui", None)
+            panel.fail_next(1)
+            self.assertEqual(self._restart_and_call(panel, "get_all_clients"), "legacy")
+            self.assertEqual(panel.calls["errors"], 1)
+            self.assertEqual(database.get_panel_meta("P")["api_style"], "api")
+
+    def test_a_style_that_stopped_answering_is_forgotten(self):
+        with PanelSimulator(style="api") as panel:
+            database.save_panel_meta("P", panel.url, "api", "3x-ui", None)
+            panel.fail_next(1)
+            self.assertEqual(self._restart_and_call(panel, "get_inbounds"), "api")
+            self.assertIsNone(database.get_panel_meta("P"))
+            self.assertIsNone(self._restart_and_call(panel, "get_inbounds"))
+            self.assertEqual(database.get_panel_meta("P")["api_style"], "api")
+
+    def test_details_of_another_url_or_a_removed_panel_are_not_used(self):
+        with PanelSimulator(style="api") as panel:
+            database.save_panel_meta("P", "http://old-address", "legacy", "x-ui", None)
+            self.assertIsNone(self._restart_and_call(panel))
+            self._restart_and_call(panel, "get_inbounds")
+            drop_panel_api("P")
+        self.assertIsNone(database.get_panel_meta("P"))
+
+
+if __name__ == "__main__":
+    unittest.main()
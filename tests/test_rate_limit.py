@@ -0,0 +1,88 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+import database
+import rate_limit
+import webapp
+from temp_db import TempDatabaseTestCase
+
+
+class RateLimitTests(TempDatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self._patches = [
+            patch("rate_limit.config.get_rate_limit_max_failures", return_value=5),
+            patch("rate_limit.config.get_rate_limit_window", return_value=300),
+            patch("rate_limit.config.get_rate_limit_block", return_value=7200),
+        ]
+        for p in self._patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+
+    def _rows(self):
+        return database._get_conn().execute("SELECT key FROM rate_limits").fetchall()
+
+    def test_fifth_failure_in_the_window_bans(self):
+        results = [rate_limit.record_failure("tg:1", now=1000 + 60 * i) for i in range(5)]
+        self.assertEqual(results, [False] * 4 + [True])
+        self.assertEqual(rate_limit.blocked_for("tg:1", now=1300), 7200 - 60)
+        self.assertEqual(rate_limit.blocked_for("tg:2", now=1300), 0)
+        self.assertEqual(rate_limit.blocked_for("tg:1", now=1240 + 7200), 0)
+        self.assertEqual(rate_limit.format_block_duration(), "2小时")
+
+    def test_old_failures_slide_out_of_the_window(self):
+        for i in range(4):
+            self.assertFalse(rate_limit.record_failure("ip:a", now=1000 + i))
+        # Halfway through the next window only half of the old failures still count.
+        results = [rate_limit.record_failure("ip:a", now=1450 + i) for i in range(4)]
+        self.assertEqual(results, [False] * 3 + [True])
+
+    def test_success_clears_failures_but_not_a_ban(self):
+        for i in range(4):
+            rate_limit.record_failure("ip:a", now=1000 + i)
+        rate_limit.record_success("ip:a", now=1010)
+        self.assertFalse(rate_limit.record_failure("ip:a", now=1011))
+
+        for i in range(5):
+            rate_limit.record_failure("ip:b", now=1000 + i)
+        rate_limit.record_success("ip:b", now=1010)
+        self.assertGreater(rate_limit.blocked_for("ip:b", now=1010), 0)
+
+    def test_expired_entries_are_purged(self):
+        for i in range(100):
+            rate_limit.record_failure(f"ip:{i}", now=1000)
+        for i in range(5):
+            rate_limit.record_failure("ip:banned", now=1000 + i)
+        rate_limit.record_failure("ip:new", now=1000 + 601)
+        self.assertEqual(sorted(r["key"] for r in self._rows()), ["ip:banned", "ip:new"])
+
+    def test_state_is_shared_between_connections(self):
+        # Each thread has its own pooled connection, like separate processes.
+        def fail():
+            rate_limit.record_failure("ip:a", now=1000)
+
+        for _ in range(5):
+            t = threading.Thread(target=fail)
+            t.start()
+            t.join()
+        self.assertGreater(rate_limit.blocked_for("ip:a", now=1001), 0)
+
+    @patch("webapp.record_query_log")
+    def test_api_query_bans_after_repeated_misses(self, _log):
+        async def missing(panel_name, email):
+            return False, "未找到"
+
+        webapp.app.config.update(TESTING=True)
+        client = webapp.app.test_client()
+        with patch("webapp.query_user_data", missing):
+            codes = [client.post("/api/query", json={"panel_name": "P", "email": "x"}).status_code
+                     for _ in range(6)]
+        self.assertEqual(codes, [404] * 4 + [429, 429])
+
+
+if __name__ == "__main__":
+    unittest.main()
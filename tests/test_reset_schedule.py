@@ -0,0 +1,257 @@
+import asyncio
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from zoneinfo import ZoneInfo
+
+import database
+import main
+import query_logic
+from panel_simulator import PanelSimulator
+from reset_schedule import Cycle, ResetScheduler, next_reset
+from temp_db import TempDatabaseTestCase
+from xui_api import close_all_panel_apis
+
+UTC = ZoneInfo("UTC")
+
+
+def _ts(*args, tz=UTC):
+    return int(datetime(*args, tzinfo=tz).timestamp())
+
+
+class NextResetTests(unittest.TestCase):
+    def test_day_past_the_month_end_falls_on_the_last_day(self):
+        cycle = Cycle(31, 0, 0, "UTC")
+        self.assertEqual(next_reset(cycle, _ts(2026, 1, 31)), _ts(2026, 2, 28))
+        self.assertEqual(next_reset(cycle, _ts(2028, 1, 31)), _ts(2028, 2, 29))
+        self.assertEqual(next_reset(cycle, _ts(2026, 2, 28)), _ts(2026, 3, 31))
+
+    def test_reset_time_is_local_to_the_cycle_time_zone(self):
+        hong_kong = ZoneInfo("Asia/Hong_Kong")
+        cycle = Cycle(1, 0, 5, "Asia/Hong_Kong")
+        self.assertEqual(next_reset(cycle, _ts(2026, 10, 31, 16, 4)), _ts(2026, 11, 1, 0, 5, tz=hong_kong))
+        # Strictly after: a reset that just ran is not due again.
+        due = _ts(2026, 11, 1, 0, 5, tz=hong_kong)
+        self.assertEqual(next_reset(cycle, due), _ts(2026, 12, 1, 0, 5, tz=hong_kong))
+
+
+class ResetSchedulerTests(TempDatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cfg = {"panels": {"P": {"url": "http://p", "reset_day": 15}},
+                    "reset": {"timezone": "UTC", "retry_interval": 1, "retry_max_interval": 4,
+                              "retry_deadline": 1}}
+        self._config = patch("config._current", lambda: self.cfg)
+        self._config.start()
+
+    def tearDown(self):
+        self._config.stop()
+
+    def test_resets_come_due_in_order_and_move_to_the_next_cycle(self):
+        database.batch_record_traffic([("P", "exp", 1, 1, 0, _ts(2026, 3, 20, 8, 30) * 1000, "2026-03-01")])
+        database.set_client_cycle("P", "exp", None, None)
+        database.set_client_cycle("P", "start", "2026-01-10", None)
+        database.set_client_cycle("P", "unknown", None, None)  # No expiry known yet.
+        scheduler = ResetScheduler()
+        scheduler.sync(now=_ts(2026, 3, 1))
+
+        self.assertEqual(scheduler.next_due(), _ts(2026, 3, 10))
+        self.assertEqual(scheduler.pop_due(now=_ts(2026, 3, 16)), [("P", "start"), ("P", "")])
+        scheduler.complete([("P", "start"), ("P", "")], now=_ts(2026, 3, 16))
+        self.assertEqual(scheduler.next_due(), _ts(2026, 3, 20, 8, 30))
+        self.assertEqual([key for _, key, _, _ in scheduler.upcoming()],
+                         [("P", "exp"), ("P", "start"), ("P", "")])
+        self.assertEqual(scheduler.due_at(("P", "")), _ts(2026, 4, 15, 0, 5))
+
+    def test_resets_missed_while_down_run_once_after_a_restart(self):
+        scheduler = ResetScheduler()
+        scheduler.sync(now=_ts(2026, 3, 1))
+        self.assertEqual(scheduler.pop_due(now=_ts(2026, 3, 14)), [])
+
+        restarted = ResetScheduler()
+        restarted.sync(now=_ts(2026, 5, 20))
+        self.assertEqual(restarted.pop_due(now=_ts(2026, 5, 20)), [("P", "")])
+        restarted.complete([("P", "")], now=_ts(2026, 5, 20))
+        self.assertEqual(restarted.next_due(), _ts(2026, 6, 15, 0, 5))
+        self.assertEqual(database.get_reset_schedule()[("P", "")]["last_reset_at"], _ts(2026, 5, 20))
+
+    def test_changed_or_removed_rules_are_rescheduled_from_now(self):
+        scheduler = ResetScheduler()
+        scheduler.sync(now=_ts(2026, 3, 1))
+        self.cfg["panels"]["P"]["reset_day"] = 20
+        scheduler.sync(now=_ts(2026, 3, 25))
+        self.assertEqual(scheduler.pop_due(now=_ts(2026, 3, 25)), [])
+        self.assertEqual(scheduler.next_due(), _ts(2026, 4, 20, 0, 5))
+
+        self.cfg["panels"]["P"]["disabled"] = True
+        scheduler.sync(now=_ts(2026, 3, 25))
+        self.assertIsNone(scheduler.next_due())
+        self.assertEqual(database.get_reset_schedule(), {})
+
+    def test_running_resets_are_not_scheduled_twice(self):
+        scheduler = ResetScheduler()
+        scheduler.sync(now=_ts(2026, 3, 1))
+        keys = scheduler.pop_due(now=_ts(2026, 3, 16))
+        scheduler.sync(now=_ts(2026, 3, 16))
+        self.assertEqual(scheduler.pop_due(now=_ts(2026, 3, 16)), [])
+        scheduler.complete(keys, now=_ts(2026, 3, 16))
+        self.assertEqual(scheduler.next_due(), _ts(2026, 4, 15, 0, 5))
+
+    def test_failed_resets_back_off_until_the_deadline(self):
+        scheduler = ResetScheduler()
+        scheduler.sync(now=_ts(2026, 3, 1))
+        due = _ts(2026, 3, 15, 0, 5)
+        retries = []
+        now = due
+        while True:
+            [key] = scheduler.pop_due(now=now)
+            self.assertEqual(scheduler.attempt(key), (due, len(retries) + 1))
+            retry_at = scheduler.fail(key, now=now)
+            if retry_at is None:
+                break
+            retries.append(retry_at - now)
+            now = retry_at
+        # 1, 2, 4, 4, ... minutes until the next retry would pass the 1 hour deadline.
+        self.assertEqual(retries[:4], [60, 120, 240, 240])
+        self.assertLessEqual(now - due, 3600)
+        self.assertEqual(scheduler.next_due(), _ts(2026, 4, 15, 0, 5))
+
+        # A retry survives a restart, with its attempt count.
+        scheduler.pop_due(now=_ts(2026, 4, 15, 0, 5))
+        scheduler.fail(("P", ""), now=_ts(2026, 4, 15, 0, 5))
+        restarted = ResetScheduler()
+        restarted.sync(now=_ts(2026, 4, 15, 0, 5))
+        self.assertEqual(restarted.next_due(), _ts(2026, 4, 15, 0, 6))
+        restarted.pop_due(now=_ts(2026, 4, 15, 0, 6))
+        self.assertEqual(restarted.attempt(("P", "")), (_ts(2026, 4, 15, 0, 5), 2))
+
+    def test_an_interrupted_run_is_retried_with_backoff(self):
+        self.addCleanup(setattr, main, "reset_scheduler", main.reset_scheduler)
+        main.reset_scheduler = ResetScheduler()
+        main.reset_scheduler.sync()
+        due = int(time.time())
+        database.save_reset_schedule([("P", "", str(Cycle(15, 0, 5, "UTC")), due, None, 0, None)])
+
+        with patch("main.reset_panel", return_value={"": (True, 3, None)}), \
+                patch("main._finish_panel_resets", side_effect=RuntimeError("disk full")):
+            with self.assertRaises(RuntimeError):
+                asyncio.run(main.traffic_reset_job(None))
+            # Not due again straight away, which would repeat the failure in a loop.
+            self.assertEqual(asyncio.run(main.traffic_reset_job(None)), [])
+        retry_at = main.reset_scheduler.due_at(("P", ""))
+        self.assertTrue(due + 60 <= retry_at <= int(time.time()) + 60)
+        self.assertEqual(database.get_reset_schedule()[("P", "")]["attempts"], 1)
+
+    def test_due_resets_run_in_one_batch_per_panel(self):
+        with PanelSimulator(inbounds=2, clients_per_inbound=5) as panel:
+            self.cfg["panels"] = {"P": {**panel.panel_config, "reset_day": 1}}
+            own, kept, other = "user-001-00001", "user-001-00002", "user-002-00003"
+            database.set_client_cycle("P", own, "2026-01-20", None)
+            database.set_client_cycle("P", kept, "2026-01-10", None)
+            self.addCleanup(setattr, main, "reset_scheduler", main.reset_scheduler)
+            main.reset_scheduler = ResetScheduler()
+            main.reset_scheduler.sync(now=_ts(2026, 1, 25))
+            database.save_reset_schedule([
+                ("P", "", str(Cycle(1, 0, 5, "UTC")), 0, None, 0, None),
+                ("P", own, str(Cycle(20, 0, 0, "UTC")), 0, None, 0, None),
+                ("P", kept, str(Cycle(10, 0, 0, "UTC")), _ts(2100, 1, 10), None, 0, None),
+            ])
+
+            async def run():
+                try:
+                    return await main.traffic_reset_job(None)
+                finally:
+                    await close_all_panel_apis()
+
+            with patch("main.send_to_admins") as send, patch("query_logic.is_circuit_open", return_value=False):
+                self.assertEqual(len(asyncio.run(run())), 2)
+                self.assertEqual(panel.client(other)["up"], 0)
+                self.assertEqual(panel.client(own)["up"], 0)
+                # The panel-wide reset skipped the client whose own cycle is not due: its
+                # inbound was reset client by client, the other inbound with one call.
+                self.assertGreater(panel.client(kept)["up"], 0)
+                self.assertEqual(panel.calls["reset_all"], 0)
+                self.assertEqual(panel.calls["reset_inbound"], 1)
+                self.assertEqual(panel.calls["reset_client"], 4)
+                self.assertIn("流量重置成功", send.call_args_list[0][0][0])
+                self.assertEqual(asyncio.run(run()), [])
+
+    def test_panels_reset_concurrently_and_failures_retry_later(self):
+        with PanelSimulator(latency=0.3, seed=1) as a, PanelSimulator(latency=0.3, seed=2) as b:
+            self.cfg["panels"] = {
+                "A": {**a.panel_config, "reset_day": 1},
+                "B": {**b.panel_config, "reset_day": 1},
+                "Down": {"url": "http://127.0.0.1:9", "username": "u", "password": "p", "reset_day": 1},
+            }
+            today = datetime.now(main.SCHEDULE_TIMEZONE).date()
+            yesterday = (today - timedelta(days=1)).strftime("%Y-%m-%d")
+            database.batch_record_traffic([("A", email, 0, 0, 0, 0, yesterday) for email in a.emails])
+            used = sum(a.client(email)["up"] + a.client(email)["down"] for email in a.emails)
+            self.addCleanup(setattr, main, "reset_scheduler", main.reset_scheduler)
+            main.reset_scheduler = ResetScheduler()
+            main.reset_scheduler.sync()
+            due = int(time.time())
+            database.save_reset_schedule([(name, "", str(Cycle(1, 0, 5, "UTC")), due, None, 0, None)
+                                          for name in ("A", "B", "Down")])
+
+            async def run():
+                try:
+                    return await main.traffic_reset_job(None)
+                finally:
+                    await close_all_panel_apis()
+
+            with patch("main.send_to_admins") as send, \
+                    patch("query_logic.is_circuit_open", side_effect=lambda name: name == "Down"):
+                started = time.monotonic()
+                self.assertEqual(len(asyncio.run(run())), 3)
+                # Login, inbound list and reset of both panels side by side, not one after the other.
+                self.assertLess(time.monotonic() - started, 1.5)
+
+        log = {row["panel_name"]: row for row in database.get_reset_log()}
+        self.assertEqual((log["A"]["success"], log["A"]["clients"], log["A"]["attempt"]), (1, 20, 1))
+        self.assertEqual((log["Down"]["success"], log["Down"]["error"]), (0, "面板离线"))
+        self.assertEqual(main.reset_scheduler.due_at(("Down", "")) - log["Down"]["finished_at"], 60)
+        messages = "\n".join(call[0][0] for call in send.call_args_list)
+        self.assertIn("Down**: 流量重置失败 (面板离线)，将于", messages)
+        # The usage read right before the reset still counts for today.
+        day = today.strftime("%Y-%m-%d")
+        self.assertEqual(database.get_daily_stats(day, day, panel_name="A")[0]["daily_total"], used)
+
+    def test_manual_resets_keep_the_usage_skip_own_cycles_and_are_logged(self):
+        with PanelSimulator(inbounds=2, clients_per_inbound=5) as panel:
+            self.cfg["panels"] = {"P": panel.panel_config}
+            own = "user-001-00001"
+            database.set_client_cycle("P", own, "2026-01-20", None)
+            today = datetime.now(main.SCHEDULE_TIMEZONE).date()
+            yesterday = (today - timedelta(days=1)).strftime("%Y-%m-%d")
+            database.batch_record_traffic([("P", email, 0, 0, 0, 0, yesterday) for email in panel.emails])
+            used = sum(panel.client(email)["up"] + panel.client(email)["down"] for email in panel.emails)
+
+            async def run(*args):
+                try:
+                    return await query_logic.reset_panel_now("P", *args)
+                finally:
+                    await close_all_panel_apis()
+
+            with patch("query_logic.is_circuit_open", return_value=False):
+                ok, outcome = asyncio.run(run())
+                self.assertTrue(ok)
+                self.assertEqual(outcome, {"": (True, 9, None)})
+                self.assertGreater(panel.client(own)["up"], 0)
+                self.assertEqual((panel.calls["reset_inbound"], panel.calls["reset_client"]), (1, 4))
+                ok, outcome = asyncio.run(run([own, "nobody"]))
+                self.assertEqual(outcome["nobody"], (False, 0, query_logic.CLIENT_NOT_ON_PANEL))
+                self.assertEqual(panel.client(own)["up"], 0)
+
+        log = database.get_reset_log()
+        self.assertEqual(sorted((r["email"], r["success"], r["clients"], r["attempt"]) for r in log),
+                         [("", 1, 9, 1), ("nobody", 0, 0, 1), (own, 1, 1, 1)])
+        self.assertEqual(log[-1]["due_at"], log[-1]["started_at"])
+        # The counters read right before the resets still count for today.
+        day = today.strftime("%Y-%m-%d")
+        self.assertEqual(database.get_daily_stats(day, day, panel_name="P")[0]["daily_total"], used)
+
+
+if __name__ == "__main__":
+    unittest.main()
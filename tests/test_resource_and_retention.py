@@ -56,6 +56,24 @@ class ResourceAndRetentionTests(unittest.TestCase):
             finally:
                 database.DB_DIR, database.DB_PATH = old_dir, old_path
 
+    def test_connection_is_pooled_and_reopened_after_close(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            old_dir, old_path = database.DB_DIR, database.DB_PATH
+            database.DB_DIR = temp_dir
+            database.DB_PATH = os.path.join(temp_dir, "traffic.db")
+            try:
+                database.init_db()
+                first = database._get_conn()
+                database.record_query_log("web", "1.2.3.4", "panel", "user", True)
+                self.assertIs(database._get_conn(), first)
+
+                database.close_db()
+
+                self.assertIsNot(database._get_conn(), first)
+                self.assertEqual(len(database.get_query_logs()), 1)
+            finally:
+                database.DB_DIR, database.DB_PATH = old_dir, old_path
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,104 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+import main
+
+
+class _FakeMessage:
+    def __init__(self, text):
+        self.texts = [text]
+
+    async def reply_text(self, text, **kwargs):
+        self.sent = _FakeMessage(text)
+        return self.sent
+
+    async def edit_text(self, text, **kwargs):
+        self.texts.append(text)
+
+
+class _FakeUpdate:
+    def __init__(self):
+        self.message = _FakeMessage("/status")
+
+
+class _FakeStatusApi:
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def get_server_status(self):
+        if self.delay is None:
+            return None
+        await asyncio.sleep(self.delay)
+        return {"xray": {"state": "running"}}
+
+
+def _fake_panel_api(name, pconf):
+    return _FakeStatusApi(pconf["delay"])
+
+
+class StatusOverviewTests(unittest.TestCase):
+    @patch("main.STATUS_EDIT_INTERVAL", 0)
+    @patch("main.record_probe")
+    @patch("main.is_circuit_open", return_value=False)
+    @patch("health.get_panel_api", _fake_panel_api)
+    def test_panels_are_probed_concurrently_and_one_message_is_edited(self, _open, record):
+        panels = {
+            "Fast": {"delay": 0.05}, "Slow": {"delay": 0.3}, "Dead": {"delay": 5},
+            "Broken": {"delay": None}, "Off": {"delay": 0, "disabled": True},
+        }
+        update = _FakeUpdate()
+        with patch("main.config.get_status_timeout", return_value=0.5):
+            started = time.monotonic()
+            asyncio.run(main._status_overview(update, panels))
+            elapsed = time.monotonic() - started
+
+        self.assertLess(elapsed, 1.5)
+        texts = update.message.sent.texts
+        self.assertIn("`查询中...`", texts[0])
+        self.assertEqual(len(texts), 5)
+        # Broken answers at once, then Fast; Slow is still pending at that point.
+        self.assertRegex(texts[2], r"\*\*Fast\*\*: Running \(\d+ ms\)")
+        self.assertIn("**Slow**: `查询中...`", texts[2])
+        final = texts[-1]
+        self.assertNotIn("查询中", final)
+        self.assertRegex(final, r"\*\*Dead\*\*: `超时` \(\d+ ms\)")
+        self.assertIn("**Broken**: `连接失败`", final)
+        self.assertIn("**Off**: `已禁用`", final)
+        self.assertEqual(record.call_count, 4)
+
+    @patch("main.probe_panel")
+    @patch("main.get_health", return_value={"checked_at": 0, "latency_ms": 8000, "error": "超时"})
+    @patch("main.is_circuit_open", side_effect=lambda name: name == "Dead")
+    @patch("main.record_probe")
+    @patch("health.get_panel_api", _fake_panel_api)
+    def test_open_circuit_panels_are_shown_from_cache_without_probing(self, _record, _open,
+                                                                      _health, probe):
+        async def fake_probe(name, pconf, timeout):
+            return "running", 0.01, None
+        probe.side_effect = fake_probe
+        update = _FakeUpdate()
+        with patch("main.config.get_status_timeout", return_value=1):
+            asyncio.run(main._status_overview(update, {"Dead": {}, "Up": {}}))
+
+        self.assertEqual([c.args[0] for c in probe.call_args_list], ["Up"])
+        self.assertRegex(update.message.sent.texts[0], r"\*\*Dead\*\*: `离线，\d+秒前检查` \(8000 ms\)")
+
+    @patch("main.STATUS_EDIT_INTERVAL", 60)
+    @patch("main.record_probe")
+    @patch("main.is_circuit_open", return_value=False)
+    @patch("health.get_panel_api", _fake_panel_api)
+    def test_edits_are_throttled_but_the_final_state_is_always_sent(self, _open, _record):
+        panels = {name: {"delay": 0.01 * i} for i, name in enumerate("ABCD")}
+        update = _FakeUpdate()
+        with patch("main.config.get_status_timeout", return_value=1):
+            asyncio.run(main._status_overview(update, panels))
+
+        texts = update.message.sent.texts
+        self.assertEqual(len(texts), 2)
+        self.assertNotIn("查询中", texts[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+from datetime import datetime, timedelta
+
+import database
+import main
+from temp_db import TempDatabaseTestCase
+
+GB = 1024 ** 3
+RULES = {"quota_percent": 90, "spike_factor": 3, "spike_min_bytes": GB, "expiry_days": 3}
+
+
+class TrafficAlertRuleTests(TempDatabaseTestCase):
+    def _day(self, n):
+        return (datetime(2026, 8, 1) + timedelta(days=n)).strftime("%Y-%m-%d")
+
+    def _seed_history(self):
+        # 'steady' uses 1 GB a day, 'spiky' 1 GB a day and then 5 GB, 'small' stays tiny.
+        for n in range(8):
+            database.batch_record_traffic([
+                ("P1", "steady", n * GB, 0, 100 * GB, 0, self._day(n)),
+                ("P1", "spiky", n * GB, 0, 100 * GB, 0, self._day(n)),
+                ("P1", "small", n, 0, 0, 0, self._day(n)),
+            ])
+
+    def _alerts(self, rows, rules=RULES):
+        return {(a["rule"], a["email"]) for a in database.batch_record_traffic(rows, rules)}
+
+    def test_each_rule_fires_over_the_whole_batch(self):
+        self._seed_history()
+        soon = int((datetime.now() + timedelta(days=1)).timestamp() * 1000)
+        later = int((datetime.now() + timedelta(days=30)).timestamp() * 1000)
+
+        alerts = self._alerts([
+            ("P1", "steady", 8 * GB, 0, 100 * GB, later, self._day(8)),
+            ("P1", "spiky", 12 * GB, 0, 100 * GB, 0, self._day(8)),
+            ("P1", "small", 500, 0, 0, soon, self._day(8)),
+            ("P2", "full", 95 * GB, 0, 100 * GB, 0, self._day(8)),
+        ])
+
+        self.assertEqual(alerts, {("spike", "spiky"), ("expiry", "small"), ("quota", "full")})
+
+    def test_alerts_are_sent_once_per_period(self):
+        row = ("P2", "full", 95 * GB, 0, 100 * GB, 0, self._day(0))
+        self.assertEqual(self._alerts([row]), {("quota", "full")})
+        self.assertEqual(self._alerts([row]), set())
+        self.assertEqual(self._alerts([row[:6] + (self._day(1),)]), set())
+        # A new month is a new quota period.
+        self.assertEqual(self._alerts([row[:6] + (self._day(31),)]), {("quota", "full")})
+
+    def test_disabled_rules_and_no_rules(self):
+        row = ("P2", "full", 95 * GB, 0, 100 * GB, 0, self._day(0))
+        self.assertEqual(self._alerts([row], dict(RULES, quota_percent=0)), set())
+        self.assertEqual(database.batch_record_traffic([row]), [])
+
+    def test_digest_groups_alerts_by_rule(self):
+        alerts = [
+            {"rule": "quota", "panel_name": "P2", "email": "full",
+             "value": 95 * GB, "threshold": 100 * GB},
+            {"rule": "spike", "panel_name": "P1", "email": "spiky",
+             "value": 5 * GB, "threshold": GB},
+        ] + [{"rule": "quota", "panel_name": "P", "email": f"u{i}", "value": 1, "threshold": 1}
+             for i in range(main.ALERT_DIGEST_MAX_LINES)]
+
+        text = main._format_alert_digest(alerts, RULES)
+
+        self.assertIn(f"共 {len(alerts)} 条", text)
+        self.assertIn("- P2 / `full`: 95.00 GB / 100.00 GB (95%)", text)
+        self.assertIn("...以及另外 1 条", text)
+        self.assertIn("- P1 / `spiky`: 当日 5.00 GB，日均 1024.00 MB", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+
+import database
+from temp_db import TempDatabaseTestCase
+
+GB = 1024 ** 3
+
+
+class TrafficDeltaTests(TempDatabaseTestCase):
+    def _record(self, rows):
+        database.batch_record_traffic([
+            (panel, email, up, down, 100 * GB, 0, day) for panel, email, up, down, day in rows
+        ])
+
+    def _seed(self):
+        self._record([("P1", "a", 1 * GB, 2 * GB, "2026-08-01"),
+                      ("P1", "b", 0, 1 * GB, "2026-08-01"),
+                      ("P2", "a", 0, 0, "2026-08-01")])
+        self._record([("P1", "a", 2 * GB, 5 * GB, "2026-08-02"),
+                      ("P1", "b", 0, 4 * GB, "2026-08-02"),
+                      ("P2", "a", 0, 1 * GB, "2026-08-02")])
+        # Counter reset on P1/a: the whole new value counts for the day.
+        self._record([("P1", "a", 0, 1 * GB, "2026-08-03"),
+                      ("P1", "b", 0, 4 * GB, "2026-08-03")])
+
+    def test_daily_stats_use_deltas_with_counter_resets(self):
+        self._seed()
+
+        daily = database.get_daily_stats("2026-08-01", "2026-08-03")
+
+        self.assertEqual([d["daily_total"] for d in daily], [0, 8 * GB, 1 * GB])
+        self.assertEqual(daily[1]["total_upload"], 1 * GB)
+        self.assertEqual(
+            database.get_panel_daily_stats("2026-08-02", "2026-08-02"),
+            [{"record_date": "2026-08-02", "panel_name": "P1", "daily_total": 7 * GB,
+              "user_count": 2},
+             {"record_date": "2026-08-02", "panel_name": "P2", "daily_total": 1 * GB,
+              "user_count": 1}],
+        )
+        self.assertEqual(
+            database.get_top_users("2026-08-02", "2026-08-03", panel_name="P1"),
+            [{"email": "a", "panel_name": "P1", "total_usage": 5 * GB},
+             {"email": "b", "panel_name": "P1", "total_usage": 3 * GB}],
+        )
+        self.assertEqual(
+            database.get_user_daily_stats("2026-08-03", "2026-08-03", "P1", email="a"),
+            [{"record_date": "2026-08-03", "email": "a", "daily_total": 1 * GB}],
+        )
+
+    def test_rewriting_a_day_refreshes_the_following_day(self):
+        self._record([("P1", "a", 0, 5 * GB, "2026-08-02")])
+        self._record([("P1", "a", 0, 1 * GB, "2026-08-01")])
+
+        daily = database.get_daily_stats("2026-08-02", "2026-08-02")
+
+        self.assertEqual(daily[0]["daily_total"], 4 * GB)
+
+    def test_backfill_matches_incremental_deltas(self):
+        self._seed()
+        incremental = database.get_user_daily_stats("2026-08-01", "2026-08-03", "P1")
+
+        database.rebuild_traffic_deltas()
+
+        self.assertEqual(
+            database.get_user_daily_stats("2026-08-01", "2026-08-03", "P1"), incremental
+        )
+
+    def test_panel_rollup_matches_per_user_deltas(self):
+        self._seed()
+        per_user = database.get_user_daily_stats("2026-08-01", "2026-08-03", "P1")
+
+        daily = database.get_daily_stats("2026-08-01", "2026-08-03", panel_name="P1")
+
+        for day in daily:
+            self.assertEqual(
+                day["daily_total"],
+                sum(u["daily_total"] for u in per_user if u["record_date"] == day["record_date"]),
+            )
+
+    def test_usage_before_a_bot_reset_is_kept(self):
+        self._record([("P1", "a", 1 * GB, 1 * GB, "2026-08-01")])
+        # Morning sample, then the bot reads 3 GB / 2 GB and resets the client.
+        self._record([("P1", "a", 2 * GB, 1 * GB, "2026-08-02")])
+        database.record_reset_carry([("P1", "a", 3 * GB, 2 * GB, 100 * GB, 0, "2026-08-02")])
+        self.assertEqual(database.get_daily_stats("2026-08-02", "2026-08-02")[0]["daily_total"], 3 * GB)
+
+        # Samples after the reset add to the usage before it; so does a second reset.
+        self._record([("P1", "a", 1 * GB, 0, "2026-08-02")])
+        database.record_reset_carry([("P1", "a", 2 * GB, 0, 100 * GB, 0, "2026-08-02")])
+        self._record([("P1", "a", 0, 1 * GB, "2026-08-02")])
+        self._record([("P1", "a", 1 * GB, 1 * GB, "2026-08-03")])
+
+        daily = database.get_daily_stats("2026-08-02", "2026-08-03")
+        self.assertEqual([d["daily_total"] for d in daily], [6 * GB, 1 * GB])
+        incremental = database.get_user_daily_stats("2026-08-01", "2026-08-03", "P1")
+        database.rebuild_traffic_deltas()
+        self.assertEqual(database.get_user_daily_stats("2026-08-01", "2026-08-03", "P1"), incremental)
+
+    def test_cleanup_drops_expired_deltas(self):
+        self._seed()
+
+        database.cleanup_old_traffic(retention_days=2, reference_date="2026-08-03")
+
+        self.assertEqual(
+            [d["record_date"] for d in database.get_daily_stats("2026-08-01", "2026-08-03")],
+            ["2026-08-02", "2026-08-03"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
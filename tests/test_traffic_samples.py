@@ -0,0 +1,46 @@
+import unittest
+
+import database
+from temp_db import TempDatabaseTestCase
+
+HOUR = 3600
+NOW = 1_790_000_000 // HOUR * HOUR
+
+
+class TrafficSampleTierTests(TempDatabaseTestCase):
+    def _sample_every_5_minutes(self, hours_back):
+        start = NOW - hours_back * HOUR
+        for i, ts in enumerate(range(start, NOW + 1, 300)):
+            database.record_traffic_samples([("P1", "a", i, 2 * i)], ts)
+
+    def test_old_raw_samples_keep_the_last_sample_of_each_hour(self):
+        self._sample_every_5_minutes(50)
+
+        folded, expired = database.downsample_traffic_samples(raw_hours=48, hourly_days=30, now=NOW)
+
+        samples = database.get_client_samples("P1", "a", NOW - 50 * HOUR, NOW)
+        hourly = [s for s in samples if s["resolution"] == "hourly"]
+        raw = [s for s in samples if s["resolution"] == "raw"]
+        self.assertEqual((folded, expired), (24, 0))
+        self.assertEqual([s["sampled_at"] for s in hourly], [NOW - 50 * HOUR, NOW - 49 * HOUR])
+        # Hour bucket keeps the counters of its 11th (last) 5-minute sample.
+        self.assertEqual((hourly[0]["upload"], hourly[0]["download"]), (11, 22))
+        self.assertEqual(raw[0]["sampled_at"], NOW - 48 * HOUR)
+        self.assertEqual(raw[-1]["upload"], 600)
+
+    def test_hourly_samples_expire_after_retention(self):
+        self._sample_every_5_minutes(3)
+        database.downsample_traffic_samples(raw_hours=1, hourly_days=30, now=NOW)
+
+        _, expired = database.downsample_traffic_samples(raw_hours=1, hourly_days=1,
+                                                         now=NOW + 86400 - 90 * 60)
+
+        self.assertEqual(expired, 2)
+        self.assertEqual(
+            database.get_client_samples("P1", "a", 0, NOW + 86400)[0]["sampled_at"],
+            NOW - HOUR,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+import main
+
+
+class _FakePanelApi:
+    delays = {}
+
+    def __init__(self, url, username, password):
+        self.url = url
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return None
+
+    async def get_all_clients(self):
+        delay = self.delays.get(self.url, 0)
+        if delay < 0:
+            raise RuntimeError("boom")
+        await asyncio.sleep(delay)
+        if self.url == "empty":
+            return []
+        return [
+            {"email": f"{self.url}-user", "up": 1, "down": 2, "total": 10, "expiryTime": 0},
+            {"email": "", "up": 0, "down": 0, "total": 0, "expiryTime": 0},
+        ]
+
+
+def _fake_panel_api(name, pconf):
+    return _FakePanelApi(pconf["url"], pconf["username"], pconf["password"])
+
+
+def _panel(url, **extra):
+    return {"url": url, "username": "u", "password": "p", **extra}
+
+
+class RecordTrafficFanOutTests(unittest.TestCase):
+    @patch("main.cleanup_old_traffic")
+    @patch("main.batch_record_traffic", return_value=[])
+    @patch("main.is_circuit_open", lambda name: False)
+    @patch("main.get_panel_api", _fake_panel_api)
+    def test_panels_are_polled_concurrently_with_per_panel_report(self, batch, _cleanup):
+        _FakePanelApi.delays = {"a": 0.2, "b": 0.2, "c": 0.2, "dead": -1, "slow": 5}
+        panels = {
+            "A": _panel("a"), "B": _panel("b"), "C": _panel("c"),
+            "Dead": _panel("dead"), "Slow": _panel("slow"), "Empty": _panel("empty"),
+            "Off": _panel("off", disabled=True),
+        }
+        with patch("main.config.get_all_panels", return_value=panels), \
+                patch("main.config.get_snapshot_concurrency", return_value=10), \
+                patch("main.config.get_snapshot_timeout", return_value=0.5):
+            started = time.monotonic()
+            results = asyncio.run(main.record_traffic_job(None))
+            elapsed = time.monotonic() - started
+
+        self.assertLess(elapsed, 1.5)
+        by_panel = {r["panel"]: r for r in results}
+        self.assertEqual(set(by_panel), {"A", "B", "C", "Dead", "Slow", "Empty"})
+        self.assertTrue(all(by_panel[n]["ok"] for n in ("A", "B", "C", "Empty")))
+        self.assertEqual(by_panel["Empty"]["records"], [])
+        self.assertFalse(by_panel["Dead"]["ok"])
+        self.assertEqual(by_panel["Dead"]["error"], "boom")
+        self.assertIn("timed out", by_panel["Slow"]["error"])
+        records = batch.call_args[0][0]
+        self.assertEqual(sorted(r[0] for r in records), ["A", "B", "C"])
+        self.assertEqual(len({r[6] for r in records}), 1)
+
+    @patch("main.cleanup_old_traffic")
+    @patch("main.batch_record_traffic", return_value=[])
+    @patch("main.is_circuit_open", lambda name: False)
+    @patch("main.get_panel_api", _fake_panel_api)
+    def test_concurrency_cap_is_respected(self, _batch, _cleanup):
+        _FakePanelApi.delays = {"a": 0.2, "b": 0.2}
+        panels = {"A": _panel("a"), "B": _panel("b")}
+        with patch("main.config.get_all_panels", return_value=panels), \
+                patch("main.config.get_snapshot_concurrency", return_value=1), \
+                patch("main.config.get_snapshot_timeout", return_value=5):
+            started = time.monotonic()
+            asyncio.run(main.record_traffic_job(None))
+            elapsed = time.monotonic() - started
+
+        self.assertGreaterEqual(elapsed, 0.4)
+
+
+class SampleTrafficJobTests(unittest.TestCase):
+    @patch("main.downsample_traffic_samples")
+    @patch("main.batch_record_traffic", return_value=[])
+    @patch("main.record_traffic_samples")
+    @patch("main.is_circuit_open", lambda name: False)
+    @patch("main.get_panel_api", _fake_panel_api)
+    def test_sample_also_refreshes_todays_daily_snapshot(self, samples, batch, downsample):
+        _FakePanelApi.delays = {}
+        with patch("main.config.get_all_panels", return_value={"A": _panel("a")}), \
+                patch("main.config.get_sampling_raw_hours", return_value=48), \
+                patch("main.config.get_sampling_hourly_days", return_value=30):
+            asyncio.run(main.sample_traffic_job(None))
+
+        rows, sampled_at = samples.call_args[0]
+        self.assertEqual(rows, [("A", "a-user", 1, 2)])
+        self.assertIsInstance(sampled_at, int)
+        self.assertEqual([r[1] for r in batch.call_args[0][0]], ["a-user"])
+        downsample.assert_called_once_with(48, 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
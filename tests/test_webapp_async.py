@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import webapp
+from temp_db import TempDatabaseTestCase
+
+
+class PanelLoopTests(unittest.TestCase):
+    def test_concurrent_requests_share_one_loop(self):
+        loops = []
+
+        async def slow_call():
+            loops.append(asyncio.get_running_loop())
+            await asyncio.sleep(0.3)
+            return True
+
+        threads = [threading.Thread(target=webapp.run_async, args=(slow_call(),)) for _ in range(5)]
+        started = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(len(set(map(id, loops))), 1)
+
+    def test_exceptions_propagate_to_the_request_thread(self):
+        async def failing():
+            raise ValueError("panel down")
+
+        with self.assertRaises(ValueError):
+            webapp.run_async(failing())
+
+    def test_hung_calls_time_out_and_are_cancelled(self):
+        cancelled = threading.Event()
+
+        async def hung():
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        with patch("webapp.config.get_web_panel_timeout", return_value=0.2):
+            with self.assertRaises(TimeoutError):
+                webapp.run_async(hung())
+        self.assertTrue(cancelled.wait(1))
+
+
+class ApiQueryTests(TempDatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        webapp.app.config.update(TESTING=True)
+        self.client = webapp.app.test_client()
+
+    @patch("webapp.record_query_log")
+    def test_query_awaits_shared_query_logic(self, _log):
+        async def fake_query(panel_name, email):
+            return True, {"email": email, "panel_name": panel_name}
+
+        with patch("webapp.query_user_data", fake_query):
+            response = self.client.post("/api/query", json={"panel_name": "P", "email": "a"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["email"], "a")
+
+
+class AdminResetClientsTests(unittest.TestCase):
+    def setUp(self):
+        webapp.app.config.update(TESTING=True, SECRET_KEY="test")
+        self.client = webapp.app.test_client()
+        with self.client.session_transaction() as session:
+            session["is_admin"] = True
+
+    @patch("webapp.notify_admins")
+    @patch("webapp.config.get_panel_config", return_value={"url": "http://p"})
+    def test_reports_each_client(self, _conf, notify):
+        async def fake_reset(panel_name, emails):
+            return True, {email: email != "b" for email in emails}
+
+        with patch("webapp.reset_panel_clients", fake_reset):
+            response = self.client.post("/api/admin/panels/P/reset_clients", json={"emails": ["a", "b", "c"]})
+
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual((body["succeeded"], body["failed"]), (2, ["b"]))
+        self.assertIn("2/3", notify.call_args[0][0])
+
+    @patch("webapp.config.get_panel_config", return_value={"url": "http://p"})
+    def test_rejects_a_missing_email_list(self, _conf):
+        for payload in ({}, {"emails": []}, {"emails": "a"}):
+            response = self.client.post("/api/admin/panels/P/reset_clients", json=payload)
+            self.assertEqual(response.status_code, 400, payload)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,371 @@
+import asyncio
+import json
+import threading
+import unittest
+from unittest.mock import patch
+
+import httpx
+
+import query_logic
+import xui_api
+from temp_db import TempDatabaseTestCase
+from xui_api import XUIApi, ClientStat, build_client_index, get_panel_api, drop_panel_api
+
+INBOUNDS = {
+    "success": True,
+    "obj": [
+        {"id": 1, "total": 50, "expiryTime": 7, "clientStats": [
+            {"email": "a", "up": 1, "down": 2, "total": 10, "expiryTime": 3},
+            {"email": "b", "up": 4, "down": 5},
+        ]},
+        {"id": 2, "clientStats": [
+            {"email": "c", "inboundId": 2, "up": 6, "down": 0, "total": 0, "expiryTime": 0},
+            {"email": "a", "up": 99, "down": 99},
+        ]},
+    ],
+}
+
+
+class _PanelHandler:
+    """Minimal 3x-ui stand-in that expires the session on demand."""
+
+    def __init__(self):
+        self.logins = 0
+        self.calls = 0
+        self.valid_cookie = None
+        self.reset_paths = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/login":
+            self.logins += 1
+            self.valid_cookie = f"c{self.logins}"
+            return httpx.Response(200, json={"success": True},
+                                  headers={"set-cookie": f"3x-ui={self.valid_cookie}"})
+        self.calls += 1
+        if f"3x-ui={self.valid_cookie}" not in request.headers.get("cookie", ""):
+            return httpx.Response(307, headers={"location": "/login"})
+        if request.url.path == "/panel/api/inbounds/list":
+            return httpx.Response(200, json=INBOUNDS)
+        if "resetAllClientTraffics" in request.url.path:
+            return httpx.Response(200, json={"success": True})
+        if request.url.path.startswith("/panel/api/inbounds/2/resetClientTraffic/"):
+            self.reset_paths.append(request.url.path)
+            return httpx.Response(200, json={"success": True})
+        return httpx.Response(404)
+
+
+def _api_with(handler) -> XUIApi:
+    api = XUIApi("http://panel.example", "user", "password")
+    api.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return api
+
+
+class XUIApiSessionTests(unittest.TestCase):
+    def test_session_and_style_are_reused_across_calls(self):
+        handler = _PanelHandler()
+        api = _api_with(handler)
+
+        async def run():
+            for _ in range(3):
+                self.assertIsNotNone(await api.get_inbounds())
+            await api.aclose()
+
+        asyncio.run(run())
+        self.assertEqual(handler.logins, 1)
+        self.assertEqual(handler.calls, 3)
+        self.assertEqual(api.api_style, "api")
+
+    def test_relogs_in_once_when_session_expires(self):
+        handler = _PanelHandler()
+        api = _api_with(handler)
+
+        async def run():
+            await api.get_inbounds()
+            handler.valid_cookie = "rotated"
+            data = await api.get_inbounds()
+            await api.aclose()
+            return data
+
+        self.assertIsNotNone(asyncio.run(run()))
+        self.assertEqual(handler.logins, 2)
+        self.assertEqual(api.session_cookie, "c2")
+
+    def test_client_is_rebuilt_for_a_new_event_loop(self):
+        api = XUIApi("http://panel.example", "user", "password")
+
+        async def bind():
+            api._bind_loop()
+            return api.client
+
+        first = asyncio.run(bind())
+        api.session_cookie = "kept"
+        second = asyncio.run(bind())
+        self.assertIsNot(first, second)
+        self.assertEqual(api.session_cookie, "kept")
+
+    def test_replaced_client_is_closed_on_its_own_loop(self):
+        api = XUIApi("http://panel.example", "user", "password")
+        other = asyncio.new_event_loop()
+        thread = threading.Thread(target=other.run_forever, daemon=True)
+        thread.start()
+
+        async def bind():
+            api._bind_loop()
+            return api.client
+
+        try:
+            first = asyncio.run_coroutine_threadsafe(bind(), other).result()
+            second = asyncio.run(bind())
+            # Let the close scheduled on the other loop run.
+            asyncio.run_coroutine_threadsafe(asyncio.sleep(0.05), other).result()
+            self.assertTrue(first.is_closed)
+            self.assertFalse(second.is_closed)
+        finally:
+            other.call_soon_threadsafe(other.stop)
+            thread.join()
+            other.close()
+
+
+class InboundCacheTests(unittest.TestCase):
+    def test_cache_serves_hits_within_ttl_and_coalesces_misses(self):
+        handler = _PanelHandler()
+        api = _api_with(handler)
+
+        async def run():
+            first = await asyncio.gather(*(api.get_inbounds_cached(60) for _ in range(5)))
+            again = await api.get_inbounds_cached(60)
+            await api.aclose()
+            return first, again
+
+        first, again = asyncio.run(run())
+        self.assertEqual(handler.calls, 1)
+        self.assertTrue(all(r is again for r in first))
+        self.assertEqual((api.cache_hits, api.cache_misses), (5, 1))
+
+    def test_expired_entries_are_refetched(self):
+        handler = _PanelHandler()
+        api = _api_with(handler)
+
+        async def run():
+            await api.get_inbounds_cached(0)
+            await api.get_inbounds_cached(0)
+            await api.aclose()
+
+        asyncio.run(run())
+        self.assertEqual(handler.calls, 2)
+
+    def test_reset_invalidates_the_cache(self):
+        handler = _PanelHandler()
+        api = _api_with(handler)
+
+        async def run():
+            await api.get_inbounds_cached(60)
+            self.assertTrue(await api.reset_all_client_traffic())
+            await api.get_inbounds_cached(60)
+            await api.aclose()
+
+        asyncio.run(run())
+        self.assertEqual(api.cache_misses, 2)
+
+
+class SharedResetStampTests(TempDatabaseTestCase):
+    def test_reset_in_another_process_drops_the_cache(self):
+        handler = _PanelHandler()
+        # Two shared clients of one panel, as in the bot and a web worker.
+        web, bot = _api_with(handler), _api_with(handler)
+        web.panel_name = bot.panel_name = "P"
+
+        async def run():
+            await web.get_inbounds_cached(60)
+            await web.get_inbounds_cached(60)
+            self.assertTrue(await bot.reset_all_client_traffic())
+            await web.get_inbounds_cached(60)
+            await web.get_inbounds_cached(60)
+            await web.aclose()
+            await bot.aclose()
+
+        asyncio.run(run())
+        self.assertEqual((web.cache_hits, web.cache_misses), (2, 2))
+
+
+class ClientIndexTests(unittest.TestCase):
+    def test_index_applies_inbound_fallbacks_and_first_match(self):
+        index = build_client_index(INBOUNDS)
+
+        self.assertEqual(index["a"], ClientStat(1, 1, 2, 10, 3))
+        self.assertEqual(index["b"], ClientStat(1, 4, 5, 50, 7))
+        self.assertEqual(index["c"].inbound_id, 2)
+        self.assertEqual(build_client_index({"success": False}), {})
+
+    def test_index_is_built_once_per_cached_payload(self):
+        api = _api_with(_PanelHandler())
+
+        async def run():
+            first = await api.get_client_index_cached(60)
+            second = await api.get_client_index_cached(60)
+            await api.aclose()
+            return first, second
+
+        first, second = asyncio.run(run())
+        self.assertIs(first, second)
+
+    def test_reset_by_email_resolves_inbound_id(self):
+        handler = _PanelHandler()
+        api = _api_with(handler)
+
+        async def run():
+            ok = await api.reset_client_traffic_by_email("c")
+            missing = await api.reset_client_traffic_by_email("nobody")
+            await api.aclose()
+            return ok, missing
+
+        self.assertEqual(asyncio.run(run()), (True, False))
+        self.assertEqual(handler.reset_paths, ["/panel/api/inbounds/2/resetClientTraffic/c"])
+
+    def test_all_clients_are_built_from_the_index(self):
+        api = _api_with(_PanelHandler())
+
+        async def run():
+            clients = await api.get_all_clients()
+            await api.aclose()
+            return clients
+
+        clients = asyncio.run(run())
+        self.assertEqual([c["email"] for c in clients], ["a", "b", "c"])
+        self.assertEqual(clients[1]["total"], 50)
+
+    def test_all_clients_fall_back_to_the_legacy_list(self):
+        broken_answers = {
+            "success false": httpx.Response(200, json={"success": False, "msg": "no"}),
+            "server error": httpx.Response(500, text="<html>Internal Server Error</html>"),
+        }
+        for case, broken in broken_answers.items():
+            def handler(request):
+                if request.url.path == "/login":
+                    return httpx.Response(200, json={"success": True},
+                                          headers={"set-cookie": "3x-ui=c"})
+                if request.url.path == "/panel/api/inbounds/list":
+                    return broken
+                if request.url.path == "/panel/inbound/list":
+                    return httpx.Response(200, json=INBOUNDS)
+                return httpx.Response(404)
+
+            api = _api_with(handler)
+
+            async def run():
+                clients = await api.get_all_clients()
+                await api.aclose()
+                return clients
+
+            self.assertEqual([c["email"] for c in asyncio.run(run())], ["a", "b", "c"], case)
+            self.assertEqual(api.api_style, "legacy", case)
+
+    def test_all_clients_raise_the_login_failure(self):
+        api = _api_with(lambda request: httpx.Response(200, json={"success": False}))
+
+        async def run():
+            try:
+                with self.assertRaisesRegex(ValueError, "login rejected"):
+                    await api.get_all_clients()
+            finally:
+                await api.aclose()
+
+        asyncio.run(run())
+
+    def test_listing_fails_only_after_every_style_failed(self):
+        def handler(request):
+            if request.url.path == "/login":
+                return httpx.Response(200, json={"success": True}, headers={"set-cookie": "3x-ui=c"})
+            return httpx.Response(500, text="<html>Internal Server Error</html>")
+
+        api = _api_with(handler)
+
+        async def run():
+            try:
+                with self.assertRaises(ValueError):
+                    async for _ in api.iter_clients():
+                        pass
+            finally:
+                await api.aclose()
+
+        asyncio.run(run())
+        self.assertIsNone(api.api_style)
+
+
+class ClientStatsParserTests(unittest.TestCase):
+    def _parse(self, body: bytes, chunk: int):
+        parser = xui_api._ClientStatsParser()
+        out = []
+        for i in range(0, len(body), chunk):
+            out.extend(parser.feed(body[i:i + chunk]))
+        out.extend(parser.close())
+        return parser, out
+
+    def test_matches_full_parse_for_any_chunk_size(self):
+        payload = {"success": True, "obj": [
+            {"settings": json.dumps({"clients": [{"email": "x\\\"}"}]}), "clientStats": [
+                {"email": "é\"q", "up": 1, "down": 2, "extra": {"nested": [1, {"a": "}"}]}},
+            ], "id": 5, "total": 9, "expiryTime": 4},
+        ] + INBOUNDS["obj"]}
+        body = json.dumps(payload, ensure_ascii=False).encode()
+
+        for chunk in (1, 3, 7, 64, len(body)):
+            parser, out = self._parse(body, chunk)
+            self.assertTrue(parser.success)
+            first = {}
+            for email, stat in out:
+                first.setdefault(email, stat)
+            self.assertEqual(first, build_client_index(payload), chunk)
+
+    def test_truncated_body_is_rejected(self):
+        body = json.dumps(INBOUNDS).encode()
+        with self.assertRaises(ValueError):
+            self._parse(body[:-3], 16)
+
+
+class QueryUserDataTests(unittest.TestCase):
+    def test_lookup_uses_client_index(self):
+        api = _api_with(_PanelHandler())
+        pconf = {"url": "http://panel.example", "username": "user", "password": "password"}
+
+        async def run():
+            found = await query_logic.query_user_data("P", "b")
+            missing = await query_logic.query_user_data("P", "zzz")
+            await api.aclose()
+            return found, missing
+
+        with patch("query_logic.config.get_panel_config", return_value=pconf), \
+                patch("query_logic.config.get_query_cache_ttl", return_value=60), \
+                patch("query_logic.is_circuit_open", return_value=False), \
+                patch("query_logic.get_panel_api", return_value=api):
+            (ok, result), (missing_ok, _) = asyncio.run(run())
+
+        self.assertTrue(ok)
+        self.assertEqual(result["used_gb"], f"{9 / 1024 ** 3:.2f}")
+        self.assertFalse(missing_ok)
+        self.assertEqual(api.cache_misses, 1)
+
+
+class PanelSessionRegistryTests(TempDatabaseTestCase):
+    def tearDown(self):
+        xui_api._sessions.clear()
+
+    def test_same_config_returns_shared_client(self):
+        pconf = {"url": "http://a", "username": "u", "password": "p"}
+        self.assertIs(get_panel_api("A", pconf), get_panel_api("A", dict(pconf)))
+
+    def test_changed_config_replaces_client(self):
+        first = get_panel_api("A", {"url": "http://a", "username": "u", "password": "p"})
+        second = get_panel_api("A", {"url": "http://a", "username": "u", "password": "new"})
+        self.assertIsNot(first, second)
+        self.assertEqual(second.password, "new")
+
+    def test_dropped_panel_gets_a_fresh_client(self):
+        pconf = {"url": "http://a", "username": "u", "password": "p"}
+        first = get_panel_api("A", pconf)
+        drop_panel_api("A")
+        self.assertIsNot(first, get_panel_api("A", pconf))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,30 +1,65 @@
 import asyncio
+import concurrent.futures
 import hashlib
+import os
+import threading
 from datetime import datetime, timedelta, date
 from flask import Flask, render_template, request, jsonify, session, redirect, url_for, g
 from functools import wraps
 import config
-from query_logic import query_user_data
-from xui_api import XUIApi
+import rate_limit
+from query_logic import query_user_data, reset_panel_now, reset_panel_clients, format_client_reset_summary
+from xui_api import get_panel_api, drop_panel_api, get_inbounds_cache_stats
 from database import (
     get_daily_stats, get_panel_daily_stats, get_user_daily_stats,
     get_top_users, get_latest_snapshot, get_date_range,
     get_panel_user_list, init_db,
-    record_query_log, get_query_logs,
+    record_query_log, get_query_logs, get_reset_log, delete_panel_health,
 )
 from notify import notify_admins
+from health import get_all_health, is_down
 
 app = Flask(__name__)
 # Stable secret shared by all Gunicorn workers.
 try:
-    app.secret_key = hashlib.sha256((config.get_config().get("bot_token", "") or "tgxui-default-secret").encode("utf-8")).hexdigest()
+    app.secret_key = hashlib.sha256((config.get_bot_token() or "tgxui-default-secret").encode("utf-8")).hexdigest()
 except Exception:
     app.secret_key = "tgxui-fallback-secret-key"
 
 init_db()
 
-failed_web_attempts = {}
-blocked_ips = {}
+# --- Panel I/O loop ---
+# Request threads (gunicorn gthread workers) hand panel calls to one event loop
+# per worker process, so in-flight queries run concurrently and reuse the
+# shared XUIApi clients instead of building a loop and client per request.
+_panel_loop = None
+_panel_loop_pid = None
+_panel_loop_lock = threading.Lock()
+
+
+def _get_panel_loop() -> asyncio.AbstractEventLoop:
+    global _panel_loop, _panel_loop_pid
+    with _panel_loop_lock:
+        if _panel_loop is None or _panel_loop_pid != os.getpid():
+            _panel_loop = asyncio.new_event_loop()
+            _panel_loop_pid = os.getpid()
+            threading.Thread(target=_panel_loop.run_forever, name="panel-io", daemon=True).start()
+        return _panel_loop
+
+
+def run_async(coro):
+    """Run a coroutine on the worker's panel loop and wait for its result.
+
+    Gives up after ``web.panel_timeout`` seconds: the coroutine is cancelled
+    and TimeoutError raised, so a hung panel cannot hold the request thread.
+    """
+    timeout = config.get_web_panel_timeout()
+    future = asyncio.run_coroutine_threadsafe(coro, _get_panel_loop())
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise TimeoutError(f"面板在 {timeout:.0f} 秒内没有响应")
 
 
 def is_admin_login() -> bool:
@@ -83,14 +118,23 @@ def admin_dashboard():
 @require_admin
 def admin_get_panels():
     panels = config.get_all_panels()
+    health = get_all_health()
     result = []
     for name, pconf in panels.items():
+        row = health.get(name)
         result.append({
             "name": name,
             "url": pconf.get("url", ""),
             "username": pconf.get("username", ""),
             "reset_day": pconf.get("reset_day", 1),
             "disabled": bool(pconf.get("disabled", False)),
+            "health": {
+                "online": not is_down(row),
+                "xray_state": row["xray_state"],
+                "latency_ms": row["latency_ms"],
+                "error": row["error"],
+                "checked_at": row["checked_at"],
+            } if row else None,
         })
     return jsonify(result)
 
@@ -132,6 +176,9 @@ def admin_add_panel():
 @require_admin
 def admin_delete_panel(name):
     if config.delete_panel(name):
+        # Close the shared client on the loop that owns it.
+        _get_panel_loop().call_soon_threadsafe(drop_panel_api, name)
+        delete_panel_health(name)
         return jsonify({"ok": True, "message": f"面板 '{name}' 已删除。"})
     return jsonify({"error": f"未找到面板 '{name}'"}), 404
 
@@ -144,13 +191,13 @@ def admin_test_panel(name):
         return jsonify({"error": f"未找到面板 '{name}'"}), 404
     try:
         async def _test():
-            async with XUIApi(pconf["url"], pconf["username"], pconf["password"]) as api:
-                ok = await api.login()
-                status = None
-                if ok:
-                    status = await api.get_server_status()
+            api = get_panel_api(name, pconf)
+            ok = await api.login()
+            status = None
+            if ok:
+                status = await api.get_server_status()
             return ok, status
-        ok, status = asyncio.run(_test())
+        ok, status = run_async(_test())
     except Exception as e:
         return jsonify({"error": f"连接失败: {e}"}), 500
     if ok:
@@ -161,21 +208,43 @@ def admin_test_panel(name):
 @app.route('/api/admin/panels/<name>/reset', methods=['POST'])
 @require_admin
 def admin_reset_panel(name):
-    pconf = config.get_panel_config(name)
-    if not pconf:
+    if not config.get_panel_config(name):
         return jsonify({"error": f"未找到面板 '{name}'"}), 404
     try:
-        async def _reset():
-            async with XUIApi(pconf["url"], pconf["username"], pconf["password"]) as api:
-                return await api.reset_all_client_traffic()
-        ok = asyncio.run(_reset())
+        ok, result = run_async(reset_panel_now(name))
     except Exception as e:
         return jsonify({"error": f"重置失败: {e}"}), 500
-    if ok:
+    if not ok:
+        return jsonify({"error": result}), 503
+    success, count, error = result[""]
+    if success:
         notify_admins(f"✅ **{name}**: 流量重置成功！(手动重置，由 Web 后台触发)")
-        return jsonify({"ok": True, "message": f"面板 '{name}' 流量已重置。"})
-    notify_admins(f"❌ **{name}**: 流量重置失败！(手动重置，由 Web 后台触发)")
-    return jsonify({"error": "重置失败。"}), 500
+        return jsonify({"ok": True, "message": f"面板 '{name}' 流量已重置 (共 {count} 个用户)。"})
+    notify_admins(f"❌ **{name}**: 流量重置失败 ({error})！(手动重置，由 Web 后台触发)")
+    return jsonify({"error": f"重置失败: {error}"}), 500
+
+
+@app.route('/api/admin/panels/<name>/reset_clients', methods=['POST'])
+@require_admin
+def admin_reset_clients(name):
+    emails = (request.get_json(silent=True) or {}).get("emails")
+    if not isinstance(emails, list) or not emails or not all(isinstance(e, str) and e for e in emails):
+        return jsonify({"error": "请提供要重置的用户列表 (emails)。"}), 400
+    if not config.get_panel_config(name):
+        return jsonify({"error": f"未找到面板 '{name}'"}), 404
+    try:
+        ok, result = run_async(reset_panel_clients(name, emails))
+    except Exception as e:
+        return jsonify({"error": f"重置失败: {e}"}), 500
+    if not ok:
+        return jsonify({"error": result}), 503
+    notify_admins(f"{format_client_reset_summary(name, result)}\n(手动重置，由 Web 后台触发)")
+    return jsonify({
+        "ok": True,
+        "results": result,
+        "succeeded": sum(result.values()),
+        "failed": [email for email, done in result.items() if not done],
+    })
 
 
 # --- Admin API: Users ---
@@ -246,9 +315,8 @@ def admin_get_settings():
 def admin_set_monthly_reset():
     data = request.get_json()
     enabled = bool((data or {}).get("enable", False))
-    cfg = config.get_config()
-    cfg.setdefault("monthly_reset", {})["enable"] = enabled
-    config.save_config(cfg)
+    with config.edit_config() as cfg:
+        cfg.setdefault("monthly_reset", {})["enable"] = enabled
     return jsonify({"ok": True, "message": f"月度重置已{'开启' if enabled else '关闭'}。"})
 
 
@@ -260,9 +328,8 @@ def admin_set_daily_report():
     hour = int((data or {}).get("hour", 8))
     if hour < 0 or hour > 23:
         hour = 8
-    cfg = config.get_config()
-    cfg["daily_report"] = {"enable": enabled, "hour": hour}
-    config.save_config(cfg)
+    with config.edit_config() as cfg:
+        cfg["daily_report"] = {"enable": enabled, "hour": hour}
     return jsonify({"ok": True, "message": "日报设置已保存。"})
 
 
@@ -273,9 +340,8 @@ def admin_set_accounting_mode():
     mode = (data or {}).get("mode", "unidirectional")
     if mode not in ("unidirectional", "bidirectional"):
         mode = "unidirectional"
-    cfg = config.get_config()
-    cfg["traffic"] = {"accounting_mode": mode}
-    config.save_config(cfg)
+    with config.edit_config() as cfg:
+        cfg["traffic"] = {"accounting_mode": mode}
     return jsonify({"ok": True, "message": f"统计方式已设为 {mode}。"})
 
 
@@ -378,6 +444,18 @@ def admin_stats_panel(name):
 
 # --- Admin Query Logs ---
 
+@app.route('/api/admin/cache_stats')
+@require_admin
+def admin_cache_stats():
+    async def _stats():
+        return get_inbounds_cache_stats()
+    return jsonify({
+        "ttl": config.get_query_cache_ttl(),
+        "worker_pid": os.getpid(),
+        "panels": run_async(_stats()),
+    })
+
+
 @app.route('/api/admin/query_logs')
 @require_admin
 def admin_query_logs():
@@ -387,20 +465,24 @@ def admin_query_logs():
     return jsonify(get_query_logs(limit=limit))
 
 
+@app.route('/api/admin/reset_log')
+@require_admin
+def admin_reset_log():
+    limit = request.args.get("limit", 200, type=int)
+    if limit < 1 or limit > 1000:
+        limit = 200
+    return jsonify(get_reset_log(limit=limit, panel_name=request.args.get("panel") or None))
+
+
 # --- User Query API ---
 
 @app.route('/api/query', methods=['POST'])
 def api_query():
     ip_address = request.remote_addr
-    if ip_address in blocked_ips:
-        unblock_time = blocked_ips[ip_address]
-        if datetime.now() < unblock_time:
-            remaining = unblock_time - datetime.now()
-            return jsonify({"error": f"您因查询过于频繁已被暂时封禁，请在 {int(remaining.total_seconds() / 60)} 分钟后再试。"}), 429
-        else:
-            del blocked_ips[ip_address]
-            if ip_address in failed_web_attempts:
-                del failed_web_attempts[ip_address]
+    limit_key = f"ip:{ip_address}"
+    remaining = rate_limit.blocked_for(limit_key)
+    if remaining:
+        return jsonify({"error": f"您因查询过于频繁已被暂时封禁，请在 {int(remaining / 60)} 分钟后再试。"}), 429
 
     data = request.get_json()
     if not data or 'panel_name' not in data or 'email' not in data:
@@ -410,29 +492,17 @@ def api_query():
     email = data['email']
 
     try:
-        success, result = asyncio.run(query_user_data(panel_name, email))
+        success, result = run_async(query_user_data(panel_name, email))
         try:
             record_query_log("web", ip_address, panel_name, email, success)
         except Exception:
             pass
         if success:
-            if ip_address in failed_web_attempts:
-                del failed_web_attempts[ip_address]
+            rate_limit.record_success(limit_key)
             return jsonify(result)
         else:
-            now = datetime.now()
-            if ip_address not in failed_web_attempts:
-                failed_web_attempts[ip_address] = []
-            failed_web_attempts[ip_address].append(now)
-            five_minutes_ago = now - timedelta(minutes=5)
-            failed_web_attempts[ip_address] = [
-                t for t in failed_web_attempts[ip_address] if t > five_minutes_ago
-            ]
-            if len(failed_web_attempts[ip_address]) >= 5:
-                block_duration = timedelta(hours=2)
-                blocked_ips[ip_address] = now + block_duration
-                del failed_web_attempts[ip_address]
-                return jsonify({"error": "您因查询不存在的用户过于频繁，已被封禁2小时。"}), 429
+            if rate_limit.record_failure(limit_key):
+                return jsonify({"error": f"您因查询不存在的用户过于频繁，已被封禁{rate_limit.format_block_duration()}。"}), 429
             return jsonify({"error": result}), 404
     except Exception as e:
         print(f"Web API error: {e}")
@@ -1,10 +1,257 @@
+import asyncio
+import codecs
 import httpx
+import json
 import logging
-from typing import Dict, Any, Optional, List, Tuple
+import re
+import time
+from urllib.parse import quote
+from typing import Dict, Any, Optional, List, Set, Tuple, NamedTuple, AsyncIterator, Iterable
+
+from database import (
+    delete_panel_meta, get_panel_meta, get_panel_reset_stamp, mark_panel_reset, save_panel_meta,
+)
 
 logger = logging.getLogger(__name__)
 
 
+class ClientStat(NamedTuple):
+    """Traffic counters of one client, with the inbound it belongs to."""
+    inbound_id: Any
+    up: int
+    down: int
+    total: int
+    expiry_time: int
+
+
+def build_client_index(inbounds_data: Optional[Dict[str, Any]]) -> Dict[str, ClientStat]:
+    """Flatten an inbound list payload into ``{email: ClientStat}``.
+
+    A client's ``total`` and ``expiryTime`` fall back to its inbound's when the
+    client entry does not carry them.  The first inbound listing an email wins.
+    """
+    index: Dict[str, ClientStat] = {}
+    if not inbounds_data or not inbounds_data.get("success"):
+        return index
+    for inbound in inbounds_data.get("obj") or []:
+        inbound_id = inbound.get("id")
+        inbound_total = inbound.get("total", 0)
+        inbound_expiry = inbound.get("expiryTime", 0)
+        for cs in inbound.get("clientStats") or []:
+            email = cs.get("email", "")
+            if email in index:
+                continue
+            index[email] = ClientStat(
+                cs.get("inboundId", inbound_id),
+                cs.get("up", 0),
+                cs.get("down", 0),
+                cs.get("total", inbound_total),
+                cs.get("expiryTime", inbound_expiry),
+            )
+    return index
+
+
+def _inbound_members(inbounds_data: Dict[str, Any]) -> Dict[Any, Set[str]]:
+    """``{inbound id: emails of its clients}`` of an inbound list payload, for non-empty inbounds."""
+    members: Dict[Any, Set[str]] = {}
+    for inbound in inbounds_data.get("obj") or []:
+        for cs in inbound.get("clientStats") or []:
+            inbound_id = cs.get("inboundId", inbound.get("id"))
+            if inbound_id is not None:
+                members.setdefault(inbound_id, set()).add(cs.get("email", ""))
+    return members
+
+
+_NON_SPACE = re.compile(r"\S")
+_SCALAR = re.compile(r"[^\s,:\[\]{}\"]+")
+_STRING_BODY = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_FLAT_OBJECT = re.compile(r'\{[^"{}\[\]]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"{}\[\]]*)*\}', re.DOTALL)
+_CAPTURE_TOKEN = re.compile(r'["{}\[\]]')
+_INBOUND_FIELDS = ("id", "total", "expiryTime")
+
+
+class _ClientStatsParser:
+    """Incremental scanner for ``obj[].clientStats[]`` of an inbound list body.
+
+    Only client objects and the few inbound scalars used as fallbacks are
+    materialized.  Everything else, notably the large ``settings`` and
+    ``streamSettings`` strings, is skipped as it streams past, so memory is
+    bounded by one client record rather than by the response size.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        # Where scanning resumes in _buf; earlier text is only kept for a capture.
+        self._pos = 0
+        # (kind, key in parent) for every open container.
+        self._stack: List[Tuple[str, Optional[str]]] = []
+        self._key: Optional[str] = None
+        self._expect_key = False
+        self._in_string = False
+        # Buffer offset of the client object being read, if any.
+        self._capture: Optional[int] = None
+        self._inbound: Dict[str, Any] = {}
+        self._pending: List[Dict[str, Any]] = []
+        self.success: Optional[bool] = None
+
+    def feed(self, data: bytes, final: bool = False) -> List[Tuple[str, ClientStat]]:
+        self._buf += self._decoder.decode(data, final)
+        out: List[Tuple[str, ClientStat]] = []
+        consumed = self._scan(out, final)
+        keep = consumed if self._capture is None else self._capture
+        if self._capture is not None:
+            self._capture = 0
+        self._buf = self._buf[keep:]
+        self._pos = consumed - keep
+        if final and (self._stack or self._buf.strip()):
+            raise ValueError("truncated inbound list response")
+        return out
+
+    def close(self) -> List[Tuple[str, ClientStat]]:
+        return self.feed(b"", final=True)
+
+    def _in_inbound_list(self) -> bool:
+        return len(self._stack) >= 2 and self._stack[1] == ("[", "obj")
+
+    @staticmethod
+    def _string_end(buf: str, i: int) -> int:
+        """Index of the closing quote of a string whose body starts at ``i``, or -1."""
+        m = _STRING_BODY.match(buf, i)
+        return m.end() - 1 if m else -1
+
+    @staticmethod
+    def _string_tail(buf: str, start: int) -> int:
+        # Keep a trailing run of backslashes: it decides whether the next quote is escaped.
+        k = len(buf)
+        while k > start and buf[k - 1] == "\\":
+            k -= 1
+        return k
+
+    def _scan(self, out: List[Tuple[str, ClientStat]], final: bool) -> int:
+        buf = self._buf
+        pos = self._pos
+        if self._in_string:
+            end = self._string_end(buf, pos)
+            if end < 0:
+                return self._string_tail(buf, pos)
+            self._in_string = False
+            pos = end + 1
+        while True:
+            if self._capture is not None:
+                # Inside a client object only nesting matters; json.loads parses it on close.
+                m = _CAPTURE_TOKEN.search(buf, pos)
+                if not m:
+                    return len(buf)
+                pos = m.start()
+                ch = buf[pos]
+                if ch == '"':
+                    end = self._string_end(buf, pos + 1)
+                    if end < 0:
+                        return pos
+                    pos = end + 1
+                    continue
+                if ch in "{[":
+                    self._stack.append((ch, None))
+                    pos += 1
+                    continue
+                # Closing brackets fall through to the general handling below.
+            m = _NON_SPACE.search(buf, pos)
+            if not m:
+                return len(buf)
+            pos = m.start()
+            ch = buf[pos]
+            if ch == '"':
+                end = self._string_end(buf, pos + 1)
+                if self._expect_key or self._capture is not None:
+                    if end < 0:
+                        return pos
+                    if self._expect_key:
+                        raw = buf[pos + 1:end]
+                        self._key = json.loads(buf[pos:end + 1]) if "\\" in raw else raw
+                        self._expect_key = False
+                elif end < 0:
+                    self._in_string = True
+                    return self._string_tail(buf, pos + 1)
+                pos = end + 1
+            elif ch in "{[":
+                if ch == "{" and self._in_inbound_list():
+                    if len(self._stack) == 2:
+                        self._inbound, self._pending = {}, []
+                    elif (len(self._stack) == 4 and self._capture is None
+                          and self._stack[3] == ("[", "clientStats")):
+                        flat = _FLAT_OBJECT.match(buf, pos)
+                        if flat:
+                            # Client stats are flat objects; take the whole thing in one step.
+                            self._client(json.loads(flat.group()), out)
+                            pos = flat.end()
+                            continue
+                        self._capture = pos
+                parent_is_object = bool(self._stack) and self._stack[-1][0] == "{"
+                self._stack.append((ch, self._key if parent_is_object else None))
+                self._key = None
+                self._expect_key = ch == "{"
+                pos += 1
+            elif ch in "}]":
+                if not self._stack:
+                    raise ValueError("unbalanced inbound list response")
+                self._stack.pop()
+                self._expect_key = False
+                if ch == "}" and self._in_inbound_list():
+                    if self._capture is not None and len(self._stack) == 4:
+                        self._client(json.loads(buf[self._capture:pos + 1]), out)
+                        self._capture = None
+                    elif len(self._stack) == 2:
+                        for client in self._pending:
+                            self._emit(client, out)
+                        self._pending = []
+                pos += 1
+            elif ch == ",":
+                if self._stack and self._stack[-1][0] == "{":
+                    self._key = None
+                    self._expect_key = True
+                pos += 1
+            elif ch == ":":
+                pos += 1
+            else:
+                sm = _SCALAR.match(buf, pos)
+                if sm.end() == len(buf) and not final:
+                    return pos
+                if self._wants_scalar():
+                    self._scalar(json.loads(sm.group()))
+                pos = sm.end()
+
+    def _wants_scalar(self) -> bool:
+        depth = len(self._stack)
+        return ((depth == 1 and self._key == "success")
+                or (depth == 3 and self._key in _INBOUND_FIELDS and self._in_inbound_list()))
+
+    def _scalar(self, value: Any) -> None:
+        depth = len(self._stack)
+        if depth == 1 and self._key == "success":
+            self.success = bool(value)
+        elif depth == 3 and self._in_inbound_list() and self._key in _INBOUND_FIELDS:
+            self._inbound[self._key] = value
+
+    def _client(self, client: Dict[str, Any], out: List[Tuple[str, ClientStat]]) -> None:
+        # Inbound fallbacks normally precede clientStats; otherwise wait for the inbound to close.
+        missing = [f for f, cf in (("id", "inboundId"), ("total", "total"), ("expiryTime", "expiryTime"))
+                   if cf not in client and f not in self._inbound]
+        if missing:
+            self._pending.append(client)
+        else:
+            self._emit(client, out)
+
+    def _emit(self, client: Dict[str, Any], out: List[Tuple[str, ClientStat]]) -> None:
+        out.append((client.get("email", ""), ClientStat(
+            client.get("inboundId", self._inbound.get("id")),
+            client.get("up", 0),
+            client.get("down", 0),
+            client.get("total", self._inbound.get("total", 0)),
+            client.get("expiryTime", self._inbound.get("expiryTime", 0)),
+        )))
+
+
 class XUIApi:
     """
     Version-agnostic client for 3x-ui panels.
@@ -13,6 +260,10 @@ class XUIApi:
     POST /server/status) and the newer API (3x-ui >= v2.8.x, e.g. GET
     /panel/api/inbounds/list, GET /panel/api/server/status).  The working style is
     auto-detected per panel and cached on the instance.
+
+    Instances are cheap to keep around: use :func:`get_panel_api` to share one
+    long-lived client (connection pool, session cookie and detected API style)
+    per panel instead of building a new one per call.
     """
 
     def __init__(self, url: str, username: str, password: str):
@@ -24,6 +275,26 @@ class XUIApi:
         self.cookie_name = None
         # "legacy" or "api"; None until first successful call
         self.api_style = None
+        # Xray version reported by the last server status.
+        self.version = None
+        # Why the last login failed; None after a successful one.
+        self.login_error: Optional[str] = None
+        # Set on shared clients (get_panel_api); what they learn is persisted.
+        self.panel_name: Optional[str] = None
+        self._saved_meta: Optional[Tuple[Optional[str], ...]] = None
+        # Event loop the httpx client is bound to; set on first request.
+        self._loop = None
+        self._login_lock = None
+        # Short-lived copy of the inbound list for read-only lookups:
+        # (monotonic time fetched, wall-clock time the fetch started, payload).
+        self._inbounds_cache: Optional[Tuple[float, float, Dict[str, Any]]] = None
+        self._inbounds_fetch: Optional[asyncio.Future] = None
+        self._cache_generation = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Client index built from the cached payload it belongs to.
+        self._index: Dict[str, ClientStat] = {}
+        self._index_source: Optional[Dict[str, Any]] = None
 
     async def __aenter__(self):
         return self
@@ -34,13 +305,33 @@ class XUIApi:
     async def aclose(self):
         await self.client.aclose()
 
+    def _bind_loop(self) -> None:
+        """Rebuild loop-bound resources when used from a different event loop.
+
+        httpx connections cannot outlive the loop that opened them, so the old
+        client is closed on its own loop and replaced; the session cookie and
+        detected API style are plain values and are kept.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        if self._loop is not None:
+            _close_on_loop(self.client, self._loop)
+            self.client = httpx.AsyncClient(verify=False, timeout=30)
+            self._inbounds_fetch = None
+        self._loop = loop
+        self._login_lock = asyncio.Lock()
+
     async def login(self) -> bool:
+        self._bind_loop()
         login_url = f"{self.base_url}/login"
         credentials = {"username": self.username, "password": self.password}
+        self.login_error = None
         try:
             response = await self.client.post(login_url, data=credentials)
             if response.status_code == 200 and response.json().get("success"):
-                for name in ("3x-ui", "session", "x-ui", "login"):
+                known = (self.cookie_name,) if self.cookie_name else ()
+                for name in known + ("3x-ui", "session", "x-ui", "login"):
                     if response.cookies.get(name):
                         self.cookie_name = name
                         self.session_cookie = response.cookies.get(name)
@@ -49,14 +340,57 @@ class XUIApi:
                     self.cookie_name = next(iter(response.cookies))
                     self.session_cookie = response.cookies.get(self.cookie_name)
                 return True
+            self.login_error = f"login rejected (HTTP {response.status_code})"
         except (httpx.RequestError, ValueError) as e:
             logger.error(f"Error connecting to panel: {e}")
+            self.login_error = f"login failed: {e}"
         return False
 
+    def _remember(self) -> None:
+        """Persist the detected API details of a shared client; only writes on change."""
+        meta = (self.api_style, self.cookie_name, self.version)
+        if self.panel_name is None or self.api_style is None or meta == self._saved_meta:
+            return
+        try:
+            save_panel_meta(self.panel_name, self.base_url, *meta)
+            self._saved_meta = meta
+        except Exception as e:
+            logger.warning(f"Could not store API details of panel '{self.panel_name}': {e}")
+
+    def _forget_style(self) -> None:
+        """Drop a detected API style that stopped answering, here and in the stored details."""
+        self.api_style = None
+        if self.panel_name is None:
+            return
+        self._saved_meta = None
+        try:
+            delete_panel_meta(self.panel_name)
+        except Exception as e:
+            logger.warning(f"Could not forget API details of panel '{self.panel_name}': {e}")
+
     async def _ensure_session(self) -> bool:
-        if not self.session_cookie:
+        self._bind_loop()
+        if self.session_cookie:
+            return True
+        async with self._login_lock:
+            # Another coroutine may have logged in while we waited.
+            if self.session_cookie:
+                return True
+            return await self.login()
+
+    async def _relogin(self, stale_cookie: Optional[str]) -> bool:
+        """Log in again after the panel rejected ``stale_cookie``."""
+        async with self._login_lock:
+            if self.session_cookie and self.session_cookie != stale_cookie:
+                return True
+            self.session_cookie = None
             return await self.login()
-        return True
+
+    @staticmethod
+    def _session_expired(response: httpx.Response) -> bool:
+        if response.status_code == 401:
+            return True
+        return response.is_redirect and "login" in response.headers.get("location", "")
 
     def _auth(self) -> Optional[Dict[str, str]]:
         if self.session_cookie and self.cookie_name:
@@ -67,10 +401,11 @@ class XUIApi:
         """Perform an authenticated request; return the JSON body when success=true."""
         url = f"{self.base_url}{path}"
         try:
-            if method == "GET":
-                response = await self.client.get(url, cookies=self._auth())
-            else:
-                response = await self.client.post(url, cookies=self._auth())
+            response = await self._send(method, url)
+            if self._session_expired(response):
+                if not await self._relogin(self.session_cookie):
+                    return None
+                response = await self._send(method, url)
             if response.status_code == 404:
                 return None
             data = response.json()
@@ -80,8 +415,19 @@ class XUIApi:
             return None
         return None
 
-    async def _call_first(self, candidates: List[Tuple[str, str, str]]) -> Optional[Dict[str, Any]]:
-        """Try (style, method, path) candidates; prefer the detected style, fall back on the rest."""
+    async def _send(self, method: str, url: str) -> httpx.Response:
+        if method == "GET":
+            return await self.client.get(url, cookies=self._auth())
+        return await self.client.post(url, cookies=self._auth())
+
+    async def _call_first(self, candidates: List[Tuple[str, str, str]],
+                          redetect: bool = False) -> Optional[Dict[str, Any]]:
+        """Try (style, method, path) candidates; prefer the detected style, fall back on the rest.
+
+        With ``redetect`` (endpoints every panel answers, such as the inbound
+        list), a detected style that fails is forgotten before the others are
+        tried, so a stale stored style is replaced rather than retried first.
+        """
         if self.api_style:
             candidates = sorted(
                 candidates, key=lambda cand: 0 if cand[0] == self.api_style else 1
@@ -90,7 +436,10 @@ class XUIApi:
             data = await self._request(method, path)
             if data is not None:
                 self.api_style = style
+                self._remember()
                 return data
+            if redetect and style == self.api_style:
+                self._forget_style()
         return None
 
     async def get_inbounds(self) -> Optional[Dict[str, Any]]:
@@ -99,27 +448,160 @@ class XUIApi:
         return await self._call_first([
             ("api", "GET", "/panel/api/inbounds/list"),
             ("legacy", "POST", "/panel/inbound/list"),
-        ])
+        ], redetect=True)
+
+    async def get_inbounds_cached(self, ttl: float) -> Optional[Dict[str, Any]]:
+        """Like get_inbounds(), but serve a copy fetched within the last ``ttl`` seconds.
+
+        Concurrent misses share a single panel request.  A copy fetched before
+        the panel's last reset, by this or any other process, is not served.
+        The returned payload is shared between callers and must not be modified.
+        """
+        self._bind_loop()
+        cached = self._inbounds_cache
+        if cached and time.monotonic() - cached[0] < ttl and not self._reset_since(cached[1]):
+            self.cache_hits += 1
+            return cached[2]
+        if self._inbounds_fetch is not None:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            self._inbounds_fetch = asyncio.ensure_future(self._fetch_inbounds_for_cache())
+        return await asyncio.shield(self._inbounds_fetch)
+
+    async def _fetch_inbounds_for_cache(self) -> Optional[Dict[str, Any]]:
+        generation = self._cache_generation
+        started = time.time()
+        try:
+            data = await self.get_inbounds()
+            # Drop results that raced with a reset; they show pre-reset counters.
+            if data is not None and generation == self._cache_generation:
+                self._inbounds_cache = (time.monotonic(), started, data)
+            return data
+        finally:
+            if generation == self._cache_generation:
+                self._inbounds_fetch = None
+
+    async def get_client_index_cached(self, ttl: float) -> Optional[Dict[str, ClientStat]]:
+        """Email index over get_inbounds_cached(); rebuilt only when the payload changes."""
+        data = await self.get_inbounds_cached(ttl)
+        if data is None:
+            return None
+        if self._index_source is not data:
+            self._index = build_client_index(data)
+            self._index_source = data
+        return self._index
+
+    def invalidate_inbounds_cache(self) -> None:
+        self._cache_generation += 1
+        self._inbounds_cache = None
+        self._inbounds_fetch = None
+
+    def _reset_since(self, since: float) -> bool:
+        """Whether any process reset this shared client's panel at or after ``since``."""
+        if self.panel_name is None:
+            return False
+        try:
+            reset_at = get_panel_reset_stamp(self.panel_name)
+        except Exception as e:
+            logger.warning(f"Could not read the reset time of panel '{self.panel_name}': {e}")
+            return False
+        return reset_at is not None and reset_at >= since
+
+    def _after_reset(self) -> None:
+        """Drop cached inbound lists here and, through the stored reset time, in other processes."""
+        self.invalidate_inbounds_cache()
+        if self.panel_name is None:
+            return
+        try:
+            mark_panel_reset(self.panel_name, time.time())
+        except Exception as e:
+            logger.warning(f"Could not store the reset time of panel '{self.panel_name}': {e}")
+
+    async def iter_clients(self) -> AsyncIterator[Tuple[str, ClientStat]]:
+        """Stream ``(email, ClientStat)`` pairs from the inbound list.
+
+        The response body is parsed incrementally, so only one client record
+        is held at a time.  Emails may repeat across inbounds.  As in
+        _call_first, the detected API style is tried first and a style that
+        answers 404, an error status, a body that is not JSON or
+        success=false is skipped for the next one; a detected style that
+        fails is forgotten, as with _call_first(redetect=True).  Raises
+        httpx.RequestError or ValueError once every style has failed, or if a
+        transfer breaks after clients were already yielded; ValueError if the
+        login fails and httpx.HTTPStatusError if the panel keeps rejecting the
+        session, so an empty stream always means a panel without clients.
+        """
+        if not await self._ensure_session():
+            raise ValueError(self.login_error or "login failed")
+        candidates = [
+            ("api", "GET", "/panel/api/inbounds/list"),
+            ("legacy", "POST", "/panel/inbound/list"),
+        ]
+        if self.api_style:
+            candidates.sort(key=lambda cand: 0 if cand[0] == self.api_style else 1)
+        error: Optional[Exception] = None
+        for style, method, path in candidates:
+            yielded = False
+            try:
+                for attempt in range(2):
+                    async with self.client.stream(method, f"{self.base_url}{path}",
+                                                  cookies=self._auth()) as response:
+                        if self._session_expired(response):
+                            if attempt or not await self._relogin(self.session_cookie):
+                                # Not a style mismatch: skip the fallback below.
+                                raise httpx.HTTPStatusError(
+                                    f"{path} rejected the session ({self.login_error or 'expired'})",
+                                    request=response.request, response=response)
+                            continue
+                        if response.status_code != 200:
+                            raise ValueError(f"{path} answered HTTP {response.status_code}")
+                        parser = _ClientStatsParser()
+                        async for chunk in response.aiter_bytes():
+                            for item in parser.feed(chunk):
+                                yielded = True
+                                yield item
+                        for item in parser.close():
+                            yielded = True
+                            yield item
+                        if not parser.success:
+                            raise ValueError(f"{path} answered success=false")
+                        self.api_style = style
+                        self._remember()
+                        return
+            except (httpx.RequestError, ValueError) as e:
+                # Clients already handed out cannot be taken back; only a clean miss falls through.
+                if yielded:
+                    raise
+                if style == self.api_style:
+                    self._forget_style()
+                error = e
+        if error is not None:
+            raise error
 
     async def get_all_clients(self) -> List[Dict[str, Any]]:
         """Return a flat list of all clients across all inbounds with traffic info.
-        Each dict: {email, up, down, total, expiryTime, reset_day (from inbound)}
-        """
-        inbounds_data = await self.get_inbounds()
-        if not inbounds_data or not inbounds_data.get("success"):
-            return []
+        Each dict: {email, up, down, total, expiryTime, inbound_id}
 
+        Built from iter_clients(), so the raw inbound payload is never held in
+        memory; the first inbound listing an email wins.  Login and transfer
+        errors propagate as in iter_clients(); an empty list means the panel
+        has no clients.
+        """
         clients: List[Dict[str, Any]] = []
-        for inbound in inbounds_data.get("obj", []):
-            for cs in inbound.get("clientStats", []):
-                entry = {
-                    "email": cs.get("email", ""),
-                    "up": cs.get("up", 0),
-                    "down": cs.get("down", 0),
-                    "total": cs.get("total", 0),
-                    "expiryTime": cs.get("expiryTime", 0),
-                }
-                clients.append(entry)
+        seen = set()
+        async for email, stat in self.iter_clients():
+            if email in seen:
+                continue
+            seen.add(email)
+            clients.append({
+                "email": email,
+                "up": stat.up,
+                "down": stat.down,
+                "total": stat.total,
+                "expiryTime": stat.expiry_time,
+                "inbound_id": stat.inbound_id,
+            })
         return clients
 
     async def get_server_status(self) -> Optional[Dict[str, Any]]:
@@ -129,7 +611,11 @@ class XUIApi:
             ("api", "GET", "/panel/api/server/status"),
             ("legacy", "POST", "/server/status"),
         ])
-        return data.get("obj") if data else None
+        status = data.get("obj") if data else None
+        if isinstance(status, dict) and isinstance(status.get("xray"), dict):
+            self.version = status["xray"].get("version") or self.version
+            self._remember()
+        return status
 
     async def reset_all_client_traffic(self) -> bool:
         if not await self._ensure_session():
@@ -138,14 +624,187 @@ class XUIApi:
             ("api", "POST", "/panel/api/inbounds/resetAllClientTraffics/-1"),
             ("legacy", "POST", "/panel/inbound/resetAllClientTraffics/-1"),
         ])
+        # Also drops fetches that were in flight while the reset ran.
+        self._after_reset()
+        return data is not None
+
+    async def _reset_inbound(self, inbound_id: Any) -> bool:
+        """Reset every client of one inbound with a single call."""
+        if not await self._ensure_session():
+            return False
+        data = await self._call_first([
+            ("api", "POST", f"/panel/api/inbounds/resetAllClientTraffics/{inbound_id}"),
+            ("legacy", "POST", f"/panel/inbound/resetAllClientTraffics/{inbound_id}"),
+        ])
         return data is not None
 
     async def reset_client_traffic(self, inbound_id: str, email: str) -> bool:
         """Reset traffic for a single client by email within a specific inbound."""
+        success = await self._reset_client(inbound_id, email)
+        self._after_reset()
+        return success
+
+    async def _reset_client(self, inbound_id: str, email: str) -> bool:
         if not await self._ensure_session():
             return False
+        email = quote(email, safe="@")
         data = await self._call_first([
             ("api", "POST", f"/panel/api/inbounds/{inbound_id}/resetClientTraffic/{email}"),
             ("legacy", "POST", f"/panel/inbound/{inbound_id}/resetClientTraffic/{email}"),
         ])
         return data is not None
+
+    async def reset_client_traffic_by_email(self, email: str, ttl: float = 0) -> bool:
+        """Reset one client, resolving its inbound id through the client index."""
+        index = await self.get_client_index_cached(ttl)
+        stat = index.get(email) if index else None
+        if stat is None or stat.inbound_id is None:
+            return False
+        return await self.reset_client_traffic(stat.inbound_id, email)
+
+    async def reset_clients_traffic(self, emails: Optional[List[str]], concurrency: int = 20,
+                                    exclude: Iterable[str] = (),
+                                    inbounds: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, bool]]:
+        """Reset many clients; returns ``{email: success}``, or None if the panel is unreachable.
+
+        Inbound ids come from one fresh inbound list fetch (or ``inbounds``,
+        when the caller just fetched it).  An inbound whose clients are all
+        to be reset is reset with one call; the remaining clients one by one.
+        At most ``concurrency`` requests are in flight.  Emails not found on
+        the panel are reported as failed.  ``emails`` None resets every client
+        on the panel except those in ``exclude``.
+        """
+        if inbounds is None:
+            inbounds = await self.get_inbounds()
+        if inbounds is None:
+            return None
+        index = build_client_index(inbounds)
+        if emails is None:
+            skip = set(exclude)
+            emails = [email for email in index if email not in skip]
+        results = {email: False for email in emails}
+        wanted = set(results)
+        whole = {inbound_id: members for inbound_id, members in _inbound_members(inbounds).items()
+                 if members <= wanted}
+        batched = set().union(*whole.values())
+        found = [(email, index[email].inbound_id) for email in results
+                 if email in index and index[email].inbound_id is not None and email not in batched]
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def reset_inbound(inbound_id: Any, members: Set[str]) -> None:
+            async with semaphore:
+                success = await self._reset_inbound(inbound_id)
+            for email in members:
+                results[email] = success
+
+        async def reset(email: str, inbound_id: Any) -> None:
+            async with semaphore:
+                results[email] = await self._reset_client(inbound_id, email)
+
+        try:
+            await asyncio.gather(
+                *(reset_inbound(inbound_id, members) for inbound_id, members in whole.items()),
+                *(reset(email, inbound_id) for email, inbound_id in found),
+            )
+        finally:
+            self._after_reset()
+        return results
+
+
+async def _aclose_quietly(client: httpx.AsyncClient) -> None:
+    try:
+        await client.aclose()
+    except Exception as e:
+        logger.debug(f"Error closing panel client: {e}")
+
+
+def _close_on_loop(client: httpx.AsyncClient, loop: Optional[asyncio.AbstractEventLoop]) -> None:
+    """Close ``client`` in the background on ``loop``, the loop its connections belong to.
+
+    A closed or stopped loop cannot run the close; the connections of a
+    client used there are released when the client is garbage collected.
+    """
+    if loop is None or loop.is_closed():
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if loop is running:
+        loop.create_task(_aclose_quietly(client))
+    elif loop.is_running():
+        asyncio.run_coroutine_threadsafe(_aclose_quietly(client), loop)
+
+
+# --- Shared per-panel sessions ---
+
+_sessions: Dict[str, Tuple[Tuple[str, str, str], XUIApi]] = {}
+
+
+def _discard(api: XUIApi) -> None:
+    """Close a replaced client in the background."""
+    _close_on_loop(api.client, api._loop)
+
+
+def get_panel_api(name: str, panel_config: Dict[str, Any]) -> XUIApi:
+    """Return the long-lived client for a panel.
+
+    The client is keyed by panel name and rebuilt whenever the panel's url or
+    credentials change.  Callers must not close it.
+    """
+    key = (panel_config["url"], panel_config["username"], panel_config["password"])
+    entry = _sessions.get(name)
+    if entry and entry[0] == key:
+        return entry[1]
+    if entry:
+        _discard(entry[1])
+    api = XUIApi(*key)
+    api.panel_name = name
+    _restore(api)
+    _sessions[name] = (key, api)
+    return api
+
+
+def _restore(api: XUIApi) -> None:
+    """Start a shared client from the API details stored for its panel.
+
+    Details stored for a different URL are ignored.  A stored style that stops
+    answering the inbound list is forgotten and detected again, and the style
+    that answers instead is stored.
+    """
+    try:
+        meta = get_panel_meta(api.panel_name)
+    except Exception as e:
+        logger.warning(f"Could not load API details of panel '{api.panel_name}': {e}")
+        return
+    if not meta or meta["url"] != api.base_url:
+        return
+    api.api_style = meta["api_style"]
+    api.cookie_name = meta["cookie_name"]
+    api.version = meta["version"]
+    api._saved_meta = (api.api_style, api.cookie_name, api.version)
+
+
+def drop_panel_api(name: str) -> None:
+    """Forget the shared client of a removed panel."""
+    entry = _sessions.pop(name, None)
+    if entry:
+        _discard(entry[1])
+    delete_panel_meta(name)
+
+
+def get_inbounds_cache_stats() -> Dict[str, Dict[str, int]]:
+    """Inbound-list cache hit/miss counters of this process, per panel."""
+    return {name: {"hits": api.cache_hits, "misses": api.cache_misses}
+            for name, (_, api) in _sessions.items()}
+
+
+async def close_all_panel_apis() -> None:
+    """Close every shared client; used at shutdown."""
+    entries = list(_sessions.values())
+    _sessions.clear()
+    for _, api in entries:
+        try:
+            await api.aclose()
+        except Exception as e:
+            logger.debug(f"Error closing panel client: {e}")